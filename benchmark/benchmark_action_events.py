@@ -0,0 +1,76 @@
+"""Compares processing the events of a list action one by one with processing them in batches of the default
+batch size, e.g. the QueueMember events of a QueueStatus action.
+
+Usage: python benchmark/benchmark_action_events.py [--events 10000] [--queues 50] [--rounds 5]"""
+import argparse
+import sys
+from pathlib import Path
+from time import perf_counter
+from typing import List
+from asterisk.ami import Event
+from prometheus_client import CollectorRegistry
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
+
+import metric_values  # noqa: E402
+from event_filter import EventFilter  # noqa: E402
+from metric_values import MetricValue, MetricValueGauge  # noqa: E402
+
+
+def create_events(count: int, queues: int) -> List[Event]:
+    return [Event("QueueMember", {
+        "ActionID": "1",
+        "Queue": f"queue-{i % queues}",
+        "Name": f"PJSIP/{i}",
+        "Status": str(i % 8),
+        "Paused": str(i % 2),
+        "CallsTaken": str(i)}) for i in range(count)]
+
+
+def create_metrics() -> List[MetricValue]:
+    members = MetricValueGauge("benchmark_queue_members", "Members", {"queue": "$Queue"}, None, "1", 0)
+    paused = MetricValueGauge("benchmark_queue_members_paused", "Paused", {"queue": "$Queue"}, None, "$Paused", 0)
+    status = MetricValueGauge(
+        "benchmark_queue_member_status", "Status", {"queue": "$Queue", "member": "$Name"}, "$Status", None, None)
+    metrics: List[MetricValue] = [members, paused, status]
+    for metric in metrics:
+        metric.init()
+    return metrics
+
+
+def run(name: str, events: List[Event], rounds: int, batch_size: int) -> float:
+    metrics = create_metrics()
+    event_filter = EventFilter(["QueueMember"], metrics, batch_size=batch_size)
+
+    durations: List[float] = []
+    for _ in range(rounds):
+        start = perf_counter()
+        event_filter.on_scrape_start("1")
+        for event in events:
+            event_filter.process_event(event)
+        event_filter.on_scrape_end()
+        durations.append(perf_counter() - start)
+
+    best = min(durations)
+    print(f"{name:<12} {best * 1000:8.1f} ms per action, {best / len(events) * 1e6:6.2f} us per event")
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--queues", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    events = create_events(args.events, args.queues)
+    # Every run registers new gauges, so a fresh registry is used instead of the global one
+    metric_values.REGISTRY = CollectorRegistry()
+    single = run("one by one", events, args.rounds, 0)
+    metric_values.REGISTRY = CollectorRegistry()
+    batch = run("batch", events, args.rounds, 1000)
+    print(f"speedup      {single / batch:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Measures the peak RSS of the exporter while it scrapes a large list action, e.g. PJSIPShowEndpoints on a PBX
+with tens of thousands of endpoints, with different batch sizes of the action.
+
+The fake AMI server of the integration tests (test/fake_ami.py) sends the synthetic list. Every batch size is
+measured in a fresh client process that logs in and executes the action via the ClientWrapper and ActionExecuter,
+so the numbers only contain the memory of the exporter side.
+
+Usage: python benchmark/benchmark_action_memory.py [--items 50000] [--batch-sizes 0,1000,all]"""
+import argparse
+import re
+import resource
+import subprocess
+import sys
+from pathlib import Path
+from time import perf_counter
+from typing import Iterator, List
+
+# Before the standard library, whose test package would shadow the one of the exporter
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
+
+from action import Action, ActionExecuter  # noqa: E402
+from client_wrapper import ClientWrapper  # noqa: E402
+from event_filter import EventFilter  # noqa: E402
+from metric_values import MetricValue, MetricValueGauge  # noqa: E402
+from test.fake_ami import FakeAMIServer, Frame, ScriptedAction  # noqa: E402
+
+
+def endpoint_events(count: int) -> Iterator[Frame]:
+    """Yields the EndpointList events of a PJSIPShowEndpoints action, so the server never holds the whole list
+    in memory."""
+    for i in range(count):
+        yield {"Event": "EndpointList", "ObjectType": "endpoint", "ObjectName": f"{i:06d}",
+               "Transport": "transport-udp", "Aor": f"{i:06d}", "Auths": f"auth{i:06d}", "OutboundAuths": "",
+               "Contacts": f"{i:06d}/sip:{i:06d}@10.0.{i // 256 % 256}.{i % 256}:5060,",
+               "DeviceState": ("Not in use", "In use", "Unavailable", "Ringing")[i % 4], "ActiveChannels": ""}
+    yield {"Event": "EndpointListComplete", "EventList": "Complete", "ListItems": str(count)}
+
+
+def get_max_rss_mib() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_client(port: int, batch_size: int) -> None:
+    """Logs in to the fake AMI server, executes the action once and prints the peak RSS before and after."""
+    metrics: List[MetricValue] = [
+        MetricValueGauge("benchmark_endpoints", "Endpoints by state", {"state": "$DeviceState"}, None, "1", 0),
+        MetricValueGauge("benchmark_endpoint_contacts", "Contacts", {"transport": "$Transport"}, None, "1", 0)]
+    for metric in metrics:
+        metric.init()
+    event_filter = EventFilter(["EndpointList"], metrics, batch_size=batch_size)
+    action = Action("PJSIPShowEndpoints", [event_filter], "EndpointListComplete", 60, 600, 1, "default", "python")
+
+    client = ClientWrapper("127.0.0.1", port, 60, 60)
+    client.login("benchmark", "benchmark", 10, 10)
+    baseline = get_max_rss_mib()
+
+    start = perf_counter()
+    if not ActionExecuter(client).exec(action):
+        raise Exception("Unable to execute the action")
+    duration = perf_counter() - start
+    print(f"{baseline:.1f} {get_max_rss_mib():.1f} {duration:.3f}")
+    client.logoff()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=50000)
+    parser.add_argument("--batch-sizes", default="0,1000,all",
+                        help="Comma separated batch sizes, 'all' collects the whole list before processing it")
+    parser.add_argument("--client", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--batch-size", type=int, default=1000, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.client is not None:
+        run_client(args.client, args.batch_size)
+        return
+
+    server = FakeAMIServer("benchmark", "benchmark", batch_size=1000)
+    server.script("PJSIPShowEndpoints", ScriptedAction(events=lambda action: endpoint_events(args.items)))
+    port = server.start()
+    print(f"{'batch size':<12} {'RSS before':>12} {'peak RSS':>12} {'growth':>10} {'duration':>10}")
+    for name in args.batch_sizes.split(","):
+        batch_size = args.items + 1 if name == "all" else int(name)
+        output = subprocess.run(
+            [sys.executable, __file__, "--client", str(port), "--batch-size", str(batch_size)],
+            check=True, capture_output=True, text=True).stdout
+        match = re.search(r"^([\d.]+) ([\d.]+) ([\d.]+)$", output, re.MULTILINE)
+        if match is None:
+            raise Exception(f"Unexpected output of the client process: {output}")
+        before, peak, duration = (float(value) for value in match.groups())
+        print(f"{name:<12} {before:>9.1f} MiB {peak:>8.1f} MiB {peak - before:>6.1f} MiB {duration:>9.2f}s")
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
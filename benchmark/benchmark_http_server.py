@@ -0,0 +1,94 @@
+"""Compares the scrape latency of the asyncio MetricsServer with the prometheus_client start_http_server
+under parallel scrapes.
+
+Usage: python benchmark/benchmark_http_server.py [--series 5000] [--clients 8] [--requests 50]"""
+import argparse
+import asyncio
+import http.client
+import socket
+import statistics
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from time import perf_counter
+from typing import List
+from prometheus_client import CollectorRegistry, Gauge, start_http_server
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
+
+from http_server import MetricsServer  # noqa: E402
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def create_registry(series: int) -> CollectorRegistry:
+    registry = CollectorRegistry()
+    gauge = Gauge("benchmark_gauge", "Benchmark gauge", ["endpoint"], registry=registry)
+    for i in range(series):
+        gauge.labels(str(i)).set(i)
+    return registry
+
+
+def start_metrics_server(port: int, registry: CollectorRegistry, max_concurrent_scrapes: int) -> None:
+    loop = asyncio.new_event_loop()
+    server = MetricsServer(port, registry, "127.0.0.1", max_concurrent_scrapes=max_concurrent_scrapes)
+    loop.run_until_complete(server.start())
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+
+def scrape(port: int, requests: int, keep_alive: bool) -> List[float]:
+    latencies: List[float] = []
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    for _ in range(requests):
+        start = perf_counter()
+        connection.request("GET", "/metrics", headers={"Accept-Encoding": "gzip"})
+        connection.getresponse().read()
+        latencies.append(perf_counter() - start)
+        if not keep_alive:
+            connection.close()
+            connection = http.client.HTTPConnection("127.0.0.1", port)
+    connection.close()
+    return latencies
+
+
+def run(name: str, port: int, clients: int, requests: int, keep_alive: bool) -> None:
+    start = perf_counter()
+    with ThreadPoolExecutor(clients) as executor:
+        results = executor.map(lambda _: scrape(port, requests, keep_alive), range(clients))
+        latencies = sorted(latency for result in results for latency in result)
+    duration = perf_counter() - start
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f"{name:<24} p50={quantiles[49] * 1000:7.2f}ms p99={quantiles[98] * 1000:7.2f}ms "
+          f"max={latencies[-1] * 1000:7.2f}ms scrapes/s={len(latencies) / duration:7.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--series", type=int, default=5000)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--max-concurrent-scrapes", type=int, default=2)
+    args = parser.parse_args()
+
+    registry = create_registry(args.series)
+
+    prometheus_port = free_port()
+    start_http_server(prometheus_port, addr="127.0.0.1", registry=registry)
+
+    metrics_server_port = free_port()
+    start_metrics_server(metrics_server_port, registry, args.max_concurrent_scrapes)
+
+    print(f"{args.series} series, {args.clients} parallel clients, {args.requests} scrapes each")
+    run("start_http_server", prometheus_port, args.clients, args.requests, False)
+    run("MetricsServer", metrics_server_port, args.clients, args.requests, False)
+    run("MetricsServer keep-alive", metrics_server_port, args.clients, args.requests, True)
+
+
+if __name__ == "__main__":
+    main()
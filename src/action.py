@@ -1,10 +1,107 @@
-from dataclasses import dataclass
-from typing import Dict, List
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
 from client_wrapper import ClientWrapper
 from event_filter import EventFilter
-from asterisk.ami import Event, SimpleAction
+from asterisk.ami import Event, Response
+from command import CommandParser, iter_command_output
+from prometheus_client import REGISTRY, CollectorRegistry, Gauge
 import logging
-from time import time, sleep
+from time import monotonic, time, sleep
+
+
+class TokenBucket():
+    """Token bucket limiting how often something happens: the bucket holds up to burst tokens and is refilled
+    with rate tokens per second. Every execution takes a token."""
+
+    def __init__(self, rate: float, burst: float = 1) -> None:
+        # A bucket that is never refilled or can not hold a token would block its waiters forever
+        if rate <= 0:
+            raise Exception(f"Rate limit: The rate must be greater than 0, but is {rate}")
+        if burst < 1:
+            raise Exception(f"Rate limit: The burst must be at least 1, but is {burst}")
+        self.rate: float = rate
+        self.burst: float = burst
+        self.__tokens: float = burst
+        self.__last_refill: float = monotonic()
+
+    def __refill(self) -> None:
+        now = monotonic()
+        self.__tokens = min(self.burst, self.__tokens + (now - self.__last_refill) * self.rate)
+        self.__last_refill = now
+
+    def try_acquire(self) -> bool:
+        """Takes a token if one is available.
+
+        :return: True if a token was taken, False if the bucket is empty."""
+        self.__refill()
+        if self.__tokens < 1:
+            return False
+        self.__tokens -= 1
+        return True
+
+    def get_wait_time(self) -> float:
+        """Returns the seconds until the next token is available."""
+        self.__refill()
+        if self.__tokens >= 1:
+            return 0
+        return (1 - self.__tokens) / self.rate
+
+
+class ActionHeaders():
+    """Serialized headers of an action, built once when the action is loaded. Sending the action only appends
+    the values of the parameters referencing attributes of a discovered entity and the ActionID."""
+
+    def __init__(self, name: str, parameters: Dict[str, str]) -> None:
+        for header in [name, *parameters.keys(), *parameters.values()]:
+            if "\r" in header or "\n" in header:
+                raise Exception(f"Action '{name}': Parameters must not contain line breaks")
+
+        static = [f"Action: {name}\r\n"]
+        # Header prefix and name of the referenced attribute of every parameter starting with '$'
+        self.__references: List[Tuple[bytes, str]] = []
+        for header, value in parameters.items():
+            if value.startswith("$"):
+                self.__references.append((f"{header}: ".encode(), value[1:]))
+            else:
+                static.append(f"{header}: {value}\r\n")
+        self.__static: bytes = "".join(static).encode()
+
+    def serialize(self, action_id: str, entity: Dict[str, str]) -> bytes:
+        """Returns the action sent to the AMI with the given ActionID for the given discovered entity."""
+        parts = [self.__static]
+        for header, attribute in self.__references:
+            parts += (header, entity.get(attribute, "").encode(), b"\r\n")
+        parts += (b"ActionID: ", action_id.encode(), b"\r\n\r\n")
+        return b"".join(parts)
+
+
+@dataclass
+class Discovery():
+    """Action listing the entities another action is executed for, e.g. a QueueSummary action whose QueueSummary
+    events list the queues a QueueStatus action with the parameter Queue=$Queue is executed for.
+    The discovered entities are cached and only discovered again after the refresh_interval or a reconnect."""
+    name: str
+    event: str
+    until: str
+    # Attributes of the discovered events referenced by the parameters of the action, kept per entity
+    attributes: List[str]
+    response_timeout: int
+    event_timeout: int
+    parameters: Dict[str, str] = field(default_factory=dict)
+    refresh_interval: float = 300
+    # Attributes of every discovered entity, None until the first successful discovery.
+    entities: Optional[List[Dict[str, str]]] = None
+    # UNIX timestamp of the last successful discovery, reset to 0 after a reconnect.
+    last_refresh: float = 0
+    headers: ActionHeaders = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self.headers = ActionHeaders(self.name, self.parameters)
+
+    def is_due(self) -> bool:
+        """Checks whether the entities have to be discovered again."""
+        return self.entities is None or self.last_refresh == 0 or time() >= self.last_refresh + self.refresh_interval
 
 
 @dataclass
@@ -17,97 +114,369 @@ class Action():
     action_priority: int
     action_context: str
     action_caller_id: str
+    # Filters attached for the whole runtime of the exporter, used to keep the metrics of the action up to date
+    # using incremental events.
+    track_filter_list: List[EventFilter] = field(default_factory=list)
+    # If set, the action is only executed again after the interval (in seconds) has passed or after a reconnect.
+    # An infinite interval only executes the action at startup and after a reconnect.
+    resync_interval: Optional[float] = None
+    # UNIX timestamp of the last execution that collected every expected event.
+    last_execution: float = 0
+    # Limits how often the action is executed. Executions exceeding the limit are skipped.
+    rate_limiter: Optional[TokenBucket] = None
+    # If set, executions whose response takes longer than this (in seconds) back off like failed executions.
+    slow_response_time: Optional[float] = None
+    # Maximum factor by which the scrape interval of the action is stretched when backing off.
+    max_backoff: int = 8
+    # Current backoff factor: the action is only executed in every n-th scrape process.
+    backoff: int = 1
+    # Number of scrape processes skipped since the last execution due to the backoff.
+    skipped_scrapes: int = 0
+    # Additional parameters sent with the action. A value starting with '$' references an attribute of the
+    # discovered entity the action is executed for.
+    parameters: Dict[str, str] = field(default_factory=dict)
+    # If set, the action is executed once per discovered entity.
+    discovery: Optional[Discovery] = None
+    # Maximum number of executions of a fan-out waiting for their events at a time.
+    max_concurrency: int = 1
+    # If set, the action is a Command action whose output is parsed into rows by the parsers. The rows are
+    # processed by the filters like events, the action completes with its response instead of an 'until' event.
+    command_parsers: Optional[List[CommandParser]] = None
+    # Name of the action in the metrics of the scheduler, defaults to the name of the action.
+    label: str = ""
+    # Serialized headers of the action, built from the fields above when the action is created.
+    headers: ActionHeaders = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        if self.label == "":
+            self.label = self.name
+        self.headers = ActionHeaders(self.name, {
+            "Priority": str(self.action_priority),
+            "Context": str(self.action_context),
+            "CallerID": str(self.action_caller_id),
+            **self.parameters})
+
+    def is_due(self) -> bool:
+        """Checks whether the action has to be executed in the current scrape process.
+
+        :return: True if the action has no resync_interval or the resync_interval has passed since the last
+                 successful execution. Otherwise False is returned."""
+        if self.resync_interval is None or self.last_execution == 0:
+            return True
+        return time() >= self.last_execution + self.resync_interval
 
 
 class ActionExecuter():
-    """Class to execute multiple actions via a specific AMI client."""
+    """Class to execute multiple actions via a specific AMI client.
+    An action with a discovery is executed once per discovered entity. The executions of such a fan-out are
+    collected like a single execution: the filters of the action collect the events of every execution between
+    a single on_scrape_start and on_scrape_end."""
 
     def __init__(self, client: ClientWrapper) -> None:
         self.__client = client
 
-        self.__finished: bool = False
-        self.__action_id: str = ""
+        # ActionIDs of the executions of the current action, one per entity
+        self.__action_ids: List[str] = []
+        # ActionIDs of the sent executions whose 'until' event has not been collected yet
+        self.__pending_action_ids: Set[str] = set()
 
         self.__wait_sequence_timeout: float = 0.02
+        # Seconds it took to receive the slowest response of the last executed action
+        self.__response_time: float = 0
+        # Seconds from sending the last executed action until its last event, without discovering its entities
+        self.__duration: float = 0
 
     def __on_event(self, event: Event, **kwargs) -> None:
-        """Callback for the AMI Client. Used to wait for the end event of an action."""
+        """Callback for the AMI Client. Used to wait for the end events of the executions of an action."""
         if "ActionID" not in event.keys:
             return
-        if event.name == self.__action.until and event.keys["ActionID"] == self.__action_id:
+        if event.name == self.__action.until and event.keys["ActionID"] in self.__pending_action_ids:
             logging.debug(f"Collected success event: {event.name}")
-            self.__finished = True
+            self.__pending_action_ids.discard(event.keys["ActionID"])
 
     def __attach_event_filter(self) -> None:
         """Attaches all event filters of the action to the AMIClient as well as the __on_event callback."""
         for filter in self.__action.filter_list:
-            filter.on_scrape_start(self.__action_id)
+            filter.on_scrape_start(*self.__action_ids)
 
         self.__client.add_event_filter(self.__action.filter_list)
         self.__client.attach_event_listener(self.__on_event)
 
-    def __send_action(self) -> bool:
-        """Sends the action to the AMIClient and evaluates the response.
+    def __send(self, name: str, action_id: str, data: bytes, response_timeout: int) -> Optional[Response]:
+        """Sends a serialized action to the AMIClient and evaluates the response.
+
+        :return: The response on success, None if an error occurred."""
+        start_time = monotonic()
+        future = self.__client.send_action_bytes(action_id, data, response_timeout)
+        # Waits for the response
+        response = future.response
+        self.__response_time = max(self.__response_time, monotonic() - start_time)
+        if response is None:
+            logging.error(f"Action '{name}': Did not receive response after {response_timeout}s")
+            return None
+        # Asterisk before version 14 answers the Command action with the status Follows
+        if response.status not in ("Success", "Follows"):
+            msg = str(response.keys.get("Message", response))
+            logging.error(f"Unable to fetch {name}: action response: {msg}")
+            return None
+
+        return response
+
+    def __send_action(self, action_id: str, entity: Dict[str, str]) -> bool:
+        """Sends an execution of the action for the given entity. The output of a command is processed right away,
+        since it is contained in the response.
 
         :return: True on success, False if an error occurred."""
-        kwargs: Dict[str, str] = {}
-        kwargs["Priority"] = str(self.__action.action_priority)
-        kwargs["Context"] = str(self.__action.action_context)
-        kwargs["CallerID"] = str(self.__action.action_caller_id)
-        kwargs["ActionID"] = str(self.__action_id)
-
-        action = SimpleAction(self.__action.name, **kwargs)
-        self.__client.set_response_timeout(self.__action.response_timeout)
-
-        future = self.__client.send_action(action)
-        if future.response is None:
-            logging.error(
-                f"Action '{self.__action.name}': Did not receive response after {self.__action.response_timeout}s")
-            return False
-        if future.response.status != "Success":
-            msg = str(future.response.keys.get("Message", future.response))
-            logging.error(f"Unable to fetch {self.__action.name}: action response: {msg}")
+        response = self.__send(self.__action.name, action_id, self.__action.headers.serialize(action_id, entity),
+                               self.__action.response_timeout)
+        if response is None:
             return False
 
+        if self.__action.command_parsers is not None:
+            self.__process_command_output(action_id, response)
+            self.__pending_action_ids.discard(action_id)
         return True
 
-    def __collect_events(self) -> bool:
-        """Waits for all expected events to be collected.
+    def __process_command_output(self, action_id: str, response: Response) -> None:
+        """Parses the output of a command line by line and passes every row to the filters of the action."""
+        filter_list = self.__action.filter_list
+        parsers = self.__action.command_parsers or []
+        for line in iter_command_output(response):
+            for parser in parsers:
+                row = parser.parse(line)
+                if row is None:
+                    continue
+                row["ActionID"] = action_id
+                event = Event(parser.event, row)
+                for filter in filter_list:
+                    filter.process_event(event)
+
+    def __discover(self, discovery: Discovery) -> Optional[List[Dict[str, str]]]:
+        """Executes the discovery action and collects the referenced attributes of its events.
+        Entities with the same attributes are only returned once.
+
+        :return: The discovered entities or None if the discovery failed."""
+        action_id = self.__client.get_next_action_id()
+        entities: Dict[Tuple[str, ...], Dict[str, str]] = {}
+        finished = threading.Event()
+
+        def on_event(event: Event, **kwargs) -> None:
+            if event.keys.get("ActionID", None) != action_id:
+                return
+            if event.name == discovery.event:
+                entity = {attribute: event.keys.get(attribute, "") for attribute in discovery.attributes}
+                entities.setdefault(tuple(entity.values()), entity)
+            elif event.name == discovery.until:
+                finished.set()
+
+        self.__client.attach_event_listener(on_event)
+        try:
+            data = discovery.headers.serialize(action_id, {})
+            if self.__send(discovery.name, action_id, data, discovery.response_timeout) is None:
+                return None
+            if not finished.wait(discovery.event_timeout):
+                logging.error(
+                    f"Unable to discover {discovery.name}: reached event timeout of {discovery.event_timeout}s")
+                return None
+        finally:
+            self.__client.detach_event_listener(on_event)
+
+        logging.debug(f"Discovered {len(entities)} entities using {discovery.name}")
+        return list(entities.values())
+
+    def __get_entities(self) -> Optional[List[Dict[str, str]]]:
+        """Returns the entities the action is executed for, discovering them again if due. If a discovery fails,
+        the entities of the last successful discovery are used.
+
+        :return: A single entity without attributes if the action has no discovery, None if no entities
+                 were discovered yet."""
+        discovery = self.__action.discovery
+        if discovery is None:
+            return [{}]
+
+        if discovery.is_due():
+            entities = self.__discover(discovery)
+            if entities is not None:
+                discovery.entities = entities
+                discovery.last_refresh = time()
+            elif discovery.entities is not None:
+                logging.warning(f"Action '{self.__action.name}': Using the {len(discovery.entities)} entities "
+                                "of the last successful discovery")
+        return discovery.entities
+
+    def __collect_events(self, entities: List[Dict[str, str]]) -> bool:
+        """Sends an execution of the action for every entity and waits until all expected events are collected.
+        At most max_concurrency executions wait for their events at a time.
         Should only be called if the __on_event callback has already been attached to the AMIClient.
-        Otherwise the function will run until the event_timeout is reached.
 
-        :return True when every expected event is collected. False is returned if the expected events were
-                not collected in the given event_timeout."""
-        start_time = time()
-        while not self.__finished:
-            if time() > start_time + self.__action.event_timeout:
+        :return True when every expected event is collected. False is returned if an execution failed or its
+                expected events were not collected in the given event_timeout."""
+        start_times: Dict[str, float] = {}
+        next_index = 0
+        while True:
+            while next_index < len(entities) and len(self.__pending_action_ids) < self.__action.max_concurrency:
+                action_id = self.__action_ids[next_index]
+                self.__pending_action_ids.add(action_id)
+                if not self.__send_action(action_id, entities[next_index]):
+                    return False
+                start_times[action_id] = time()
+                next_index += 1
+
+            pending_action_ids = list(self.__pending_action_ids)
+            if len(pending_action_ids) == 0 and next_index == len(entities):
+                return True
+            if any(time() > start_times[action_id] + self.__action.event_timeout
+                   for action_id in pending_action_ids):
                 logging.error(
                     f"Unable to fetch {self.__action.name}: reached event timeout of {self.__action.event_timeout}s")
                 return False
             sleep(self.__wait_sequence_timeout)
-        return True
 
-    def __detach_event_filter(self) -> None:
-        """Detaches any previously attached EventListener, as well as the __on_event callback."""
-        for filter in self.__action.filter_list:
-            filter.on_scrape_end()
+    def __detach_event_filter(self, complete: bool) -> None:
+        """Detaches any previously attached EventListener, as well as the __on_event callback.
+        The filters are detached before they are signaled, so events arriving late after an event timeout
+        do not change the committed values.
 
+        :param complete: Whether every expected event was collected. If not, the values staged by the filters
+                         are discarded instead of published."""
         self.__client.remove_event_filter(self.__action.filter_list)
         self.__client.detach_event_listener(self.__on_event)
-        self.__finished = False
+        self.__pending_action_ids = set()
+
+        for filter in self.__action.filter_list:
+            filter.on_scrape_end(complete)
+
+    def get_last_response_time(self) -> float:
+        """Returns the seconds it took to receive the slowest response of the last executed action."""
+        return self.__response_time
 
-    def exec(self, action: Action) -> None:
-        """Executes the given action and waits until all events and metrics have been collected."""
+    def get_last_duration(self) -> float:
+        """Returns the seconds from sending the last executed action until its last event was collected or it
+        failed. The time of discovering the entities of the action is not included."""
+        return self.__duration
+
+    def exec(self, action: Action) -> bool:
+        """Executes the given action, once per discovered entity if it has a discovery, and waits until all events
+        and metrics have been collected.
+
+        :return: True if every expected event was collected, False if an error occurred."""
         self.__action = action
-        self.__finished = False
-        self.__action_id = self.__client.get_next_action_id()
+        self.__response_time = 0
+        self.__duration = 0
+
+        entities = self.__get_entities()
+        if entities is None:
+            logging.error(f"Unable to fetch {action.name}: no entities discovered")
+            return False
 
-        logging.debug(f"Executing action: '{action.name}', action_id={self.__action_id}")
+        self.__action_ids = [self.__client.get_next_action_id() for _ in entities]
+        self.__pending_action_ids = set()
+
+        logging.debug(f"Executing action: '{action.name}', executions={len(entities)}")
 
         self.__attach_event_filter()
-        result = self.__send_action()
+        start = monotonic()
+        result = self.__collect_events(entities)
+        self.__duration = monotonic() - start
         if result:
-            self.__collect_events()
-        self.__detach_event_filter()
+            action.last_execution = time()
+        self.__detach_event_filter(result)
+
+        logging.debug(f"Finished processing action: {action.name}, executions={len(entities)}")
+        return result
+
+
+class ActionScheduler():
+    """Decides which actions are executed in a scrape process, so the exporter never overloads the Asterisk.
+    An action is skipped if it is not due, if its rate limit is exceeded or while it backs off. A global rate limit
+    spaces the executions of all actions by waiting for a token. Actions back off when they fail or respond
+    slower than their slow_response_time: the backoff factor is doubled up to max_backoff and the action is only
+    executed in every n-th scrape process. Every healthy execution halves the backoff factor again.
+    The effective interval between two executions, the duration of the last execution, the time of the last
+    complete execution and whether the metrics of an action are stale, i.e. still show the values of an earlier
+    execution, are exposed per action."""
+
+    def __init__(self,
+                 action_executer: ActionExecuter,
+                 rate_limiter: Optional[TokenBucket] = None,
+                 registry: CollectorRegistry = REGISTRY) -> None:
+        self.__action_executer: ActionExecuter = action_executer
+        self.__rate_limiter: Optional[TokenBucket] = rate_limiter
+        # Start of the previous execution of each action by its name
+        self.__last_start: Dict[str, float] = {}
+
+        self.__effective_interval = Gauge(
+            "action_effective_interval_seconds",
+            "Seconds between the last two executions of an action",
+            ["action"],
+            registry=registry)
+        self.__duration = Gauge(
+            "action_duration_seconds",
+            "Seconds the last execution of an action took, from sending the action until its last event, "
+            "without discovering the entities of the action",
+            ["action"],
+            registry=registry)
+        self.__last_success = Gauge(
+            "action_last_success_timestamp_seconds",
+            "UNIX timestamp of the last execution of an action that collected every expected event",
+            ["action"],
+            registry=registry)
+        self.__stale = Gauge(
+            "action_stale",
+            "1 if the last execution of an action did not complete and the metrics show the values of the last "
+            "complete execution, otherwise 0",
+            ["action"],
+            registry=registry)
+        self.__backoff = Gauge(
+            "action_backoff_factor",
+            "Factor by which the scrape interval of an action is stretched due to failures or slow responses",
+            ["action"],
+            registry=registry)
+
+    def __should_skip(self, action: Action) -> bool:
+        """Checks whether the action is skipped in the current scrape process due to its backoff or rate limit."""
+        if action.skipped_scrapes + 1 < action.backoff:
+            action.skipped_scrapes += 1
+            logging.debug(f"Action '{action.label}': Skipped due to backoff factor {action.backoff}")
+            return True
+        if action.rate_limiter is not None and not action.rate_limiter.try_acquire():
+            logging.debug(f"Action '{action.label}': Skipped due to rate limit")
+            return True
+        return False
+
+    def __update_backoff(self, action: Action, success: bool) -> None:
+        """Doubles the backoff factor of the action after a failed or slow execution, otherwise halves it."""
+        response_time = self.__action_executer.get_last_response_time()
+        slow = action.slow_response_time is not None and response_time > action.slow_response_time
+        if not success or slow:
+            backoff = min(action.backoff * 2, action.max_backoff)
+            if backoff != action.backoff:
+                logging.warning(f"Action '{action.label}': Backing off to every {backoff}. scrape process "
+                                f"({'failed' if not success else f'slow response after {response_time:.2f}s'})")
+            action.backoff = backoff
+        else:
+            action.backoff = max(action.backoff // 2, 1)
+        action.skipped_scrapes = 0
+        self.__backoff.labels(action.label).set(action.backoff)
+
+    def exec(self, action_list: List[Action]) -> None:
+        """Executes the actions of the list that are due and not throttled."""
+        for action in action_list:
+            if not action.is_due() or self.__should_skip(action):
+                continue
+
+            if self.__rate_limiter is not None:
+                while not self.__rate_limiter.try_acquire():
+                    sleep(self.__rate_limiter.get_wait_time())
+
+            start = monotonic()
+            if action.label in self.__last_start:
+                self.__effective_interval.labels(action.label).set(start - self.__last_start[action.label])
+            self.__last_start[action.label] = start
 
-        logging.debug(f"Finished processing action: {action.name}, action_id={self.__action_id}")
+            success = self.__action_executer.exec(action)
+            self.__duration.labels(action.label).set(self.__action_executer.get_last_duration())
+            self.__update_backoff(action, success)
+            self.__stale.labels(action.label).set(0 if success else 1)
+            if success:
+                self.__last_success.labels(action.label).set(action.last_execution)
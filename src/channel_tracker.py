@@ -0,0 +1,191 @@
+import logging
+import threading
+from time import time
+from typing import Dict, List, Optional, Sequence, Set
+from asterisk.ami import Event
+from prometheus_client import REGISTRY, Histogram
+from metric_values import MetricValue, GaugeCollector
+
+
+def _parse_duration(duration: str) -> float:
+    """Converts a duration of the format HH:MM:SS, as sent in the CoreShowChannel event, to seconds.
+    If the duration can not be converted, 0 is returned."""
+    seconds = 0.0
+    try:
+        for part in duration.split(":"):
+            seconds = seconds * 60 + float(part)
+    except ValueError:
+        return 0
+    return seconds
+
+
+class _Channel():
+    """Entry of the channel index. Uses __slots__, since an entry exists for every live channel."""
+    __slots__ = ("key", "start", "bridged")
+
+    def __init__(self, key: Sequence[str], start: float, bridged: bool) -> None:
+        self.key: Sequence[str] = key
+        self.start: float = start
+        self.bridged: bool = bridged
+
+
+class ChannelTracker(MetricValue):
+    """Tracks the lifecycle of the channels using the Newchannel, Hangup, BridgeEnter and BridgeLeave events and
+    keeps an index of the live channels by their Uniqueid. Exposes the number of active and bridged channels as
+    gauges and the duration of the hung up channels as histogram, by the labels evaluated on the Newchannel event.
+
+    The index is resynced from the CoreShowChannel events of a CoreShowChannels action, which only has to be
+    executed at startup and after a reconnect: the events of the action are staged between on_scrape_start and
+    on_scrape_end and then replace the index."""
+
+    tracked_event_names: List[str] = ["Newchannel", "Hangup", "BridgeEnter", "BridgeLeave"]
+    resync_event_name: str = "CoreShowChannel"
+    # Buckets of the duration histogram in seconds, suited for the duration of calls
+    default_duration_buckets: Sequence[float] = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+
+    def __init__(self,
+                 metric_name: str,
+                 metric_description: str,
+                 metric_labels: Dict[str, str],
+                 duration_buckets: Sequence[float] = default_duration_buckets) -> None:
+        super().__init__(metric_name, metric_description, metric_labels)
+
+        self.__duration_buckets: Sequence[float] = duration_buckets
+        self.__duration: Optional[Histogram] = None
+
+        self.__channels: Dict[str, _Channel] = {}
+        self.__active_values: Dict[Sequence[str], float] = {}
+        self.__bridged_values: Dict[Sequence[str], float] = {}
+
+        # Channels received during a resync and the channels hung up in the meantime
+        self.__staged_channels: Optional[Dict[str, _Channel]] = None
+        self.__resync_hangups: Set[str] = set()
+        self.__resync_start: float = 0
+
+        # Events are processed by the event thread, resyncs are committed by the scrape thread
+        self.__lock: threading.Lock = threading.Lock()
+
+    def init(self) -> None:
+        """Initializes the Prometheus metrics of the tracker."""
+        REGISTRY.register(GaugeCollector(
+            f"{self._metric_name}_active",
+            f"{self._metric_description}: number of active channels",
+            self._metric_label_names,
+            lambda: self.__active_values))
+        REGISTRY.register(GaugeCollector(
+            f"{self._metric_name}_bridged",
+            f"{self._metric_description}: number of channels in a bridge",
+            self._metric_label_names,
+            lambda: self.__bridged_values))
+        self.__duration = Histogram(
+            f"{self._metric_name}_duration_seconds",
+            f"{self._metric_description}: duration of the hung up channels",
+            self._metric_label_names,
+            buckets=self.__duration_buckets)
+
+    def get_channel_count(self) -> int:
+        """Returns the number of live channels in the index."""
+        return len(self.__channels)
+
+    def get_value(self, key: Sequence[str]) -> float:
+        """Returns the number of active channels with the given label values."""
+        return self.__active_values.get(key, 0)
+
+    def get_label_keys(self) -> List[Sequence[str]]:
+        """Returns the label values of every channel count."""
+        return list(self.__active_values)
+
+    def __eval_key(self, event: Event) -> Sequence[str]:
+        """Evaluates the label values of the channel of the given event."""
+        if len(self._metric_labels) == 0:
+            return ()
+        labels = self._eval_labels(event)
+        return tuple(str(labels[label]) for label in self._metric_label_names)
+
+    def __add(self, uniqueid: str, channel: _Channel) -> None:
+        self.__channels[uniqueid] = channel
+        self.__active_values[channel.key] = self.__active_values.get(channel.key, 0) + 1
+        if channel.bridged:
+            self.__bridged_values[channel.key] = self.__bridged_values.get(channel.key, 0) + 1
+
+    def __set_bridged(self, uniqueid: str, bridged: bool) -> None:
+        channel = self.__channels.get(uniqueid, None)
+        if channel is None or channel.bridged == bridged:
+            return
+        channel.bridged = bridged
+        self.__bridged_values[channel.key] = self.__bridged_values.get(channel.key, 0) + (1 if bridged else -1)
+
+    def __hangup(self, uniqueid: str) -> None:
+        if self.__staged_channels is not None:
+            self.__resync_hangups.add(uniqueid)
+
+        channel = self.__channels.pop(uniqueid, None)
+        if channel is None:
+            return
+        self.__active_values[channel.key] -= 1
+        if channel.bridged:
+            self.__bridged_values[channel.key] -= 1
+        if self.__duration is not None:
+            if len(channel.key) == 0:
+                self.__duration.observe(time() - channel.start)
+            else:
+                self.__duration.labels(*channel.key).observe(time() - channel.start)
+
+    def process_event(self, event: Event) -> None:
+        """Updates the channel index with the given lifecycle or resync event.
+
+        :param Event event: The event from which the metrics are evaluated."""
+        uniqueid = event.keys.get("Uniqueid", None)
+        if uniqueid is None:
+            return
+
+        with self.__lock:
+            if event.name == "Newchannel":
+                if uniqueid not in self.__channels:
+                    self.__add(uniqueid, _Channel(self.__eval_key(event), time(), False))
+            elif event.name == "Hangup":
+                self.__hangup(uniqueid)
+            elif event.name == "BridgeEnter":
+                self.__set_bridged(uniqueid, True)
+            elif event.name == "BridgeLeave":
+                self.__set_bridged(uniqueid, False)
+            elif event.name == self.resync_event_name and self.__staged_channels is not None:
+                start = time() - _parse_duration(event.keys.get("Duration", ""))
+                bridged = event.keys.get("BridgeId", "") != ""
+                self.__staged_channels[uniqueid] = _Channel(self.__eval_key(event), start, bridged)
+
+    def on_scrape_start(self) -> None:
+        """Starts staging the channels of a resync."""
+        with self.__lock:
+            self.__staged_channels = {}
+            self.__resync_hangups = set()
+            self.__resync_start = time()
+
+    def on_scrape_end(self) -> None:
+        """Replaces the index with the staged channels of the resync. Channels created during the resync are kept,
+        channels hung up during the resync are removed."""
+        with self.__lock:
+            if self.__staged_channels is None:
+                return
+
+            channels = self.__staged_channels
+            for uniqueid, channel in self.__channels.items():
+                if uniqueid not in channels and channel.start >= self.__resync_start:
+                    channels[uniqueid] = channel
+            for uniqueid in self.__resync_hangups:
+                channels.pop(uniqueid, None)
+
+            self.__channels = {}
+            # Known label values are kept with a count of 0, so the gauges do not disappear
+            self.__active_values = dict.fromkeys(self.__active_values, 0.0)
+            self.__bridged_values = dict.fromkeys(self.__bridged_values, 0.0)
+            for uniqueid, channel in channels.items():
+                self.__add(uniqueid, channel)
+
+            self.__staged_channels = None
+            logging.debug(f"Resynced channel tracker '{self._metric_name}': {len(self.__channels)} channels")
+
+    def on_scrape_abort(self) -> None:
+        """Discards the staged channels of an incomplete resync, keeping the current index."""
+        with self.__lock:
+            self.__staged_channels = None
@@ -1,20 +1,38 @@
 import logging
 import socket
+import threading
 from time import sleep, time
-from typing import List, Any
+from typing import Iterable, List, Any, Optional
 from asterisk.ami import AMIClient, SimpleAction, Event, FutureResponse
 from event_listener import EventListener
 from event_filter import EventFilter
 
 
+class _BlockingAMIClient(AMIClient):
+    """AMIClient whose socket has no timeout once connected, so it is not closed if the AMI sends no events. The
+    connection is validated by the EventListener of the ClientWrapper instead. The timeout is removed before the
+    event thread starts receiving: changing it while the thread receives can make the receive fail, which ends the
+    event thread."""
+
+    def connect(self) -> None:
+        self._socket = socket.create_connection((self._address, self._port), self._timeout)
+        self._socket.settimeout(None)
+        self.finished = threading.Event()
+        self._thread = threading.Thread(target=self.listen)
+        self._thread.daemon = True
+        self._thread.start()
+
+
 class ClientWrapper:
     def __init__(
             self,
             address: str,
             port: int,
             timeout: int,
-            ping_timeout: int) -> None:
-        self.__client: AMIClient = AMIClient(
+            ping_timeout: int,
+            event_mask: Optional[str] = None,
+            event_names: Optional[Iterable[str]] = None) -> None:
+        self.__client: AMIClient = _BlockingAMIClient(
             address=address, port=port, timeout=timeout)
         self.__event_listener: EventListener = EventListener()
         self.__is_login_validated: bool = False
@@ -24,6 +42,13 @@ class ClientWrapper:
 
         self.__ping_timeout = ping_timeout
 
+        # Event mask sent after every login, e.g. "off" for a session that is only used to execute actions.
+        # The events of an action are sent to the session regardless of the mask.
+        self.__event_mask: Optional[str] = event_mask
+        # Names of the events the AMI sends to this client, filtered by Asterisk after every login.
+        # If None, every event is sent.
+        self.__event_names: Optional[List[str]] = sorted(event_names) if event_names is not None else None
+
     def __raise_critical(self, msg: str) -> None:
         """Logs a critical message and raises an exception.
 
@@ -82,10 +107,6 @@ class ClientWrapper:
         except socket.error as e:
             self.__raise_critical(f"Unable to connect to {self.__client._address}:{self.__client._port}, error: {e}")
 
-        # Prevent socket from closing if no events are sent by the AMI. We are validating the
-        # AMI connection using the custom EventListener.
-        self.__client._socket.settimeout(None)
-
         future = self.__client.login(username, secret)
         if future.response.is_error():
             msg = str(future.response.keys.get('Message', future.response))
@@ -105,6 +126,54 @@ class ClientWrapper:
 
             sleep(self.__wait_sequence_timeout)
 
+        if self.__event_mask is not None:
+            self.set_event_mask(self.__event_mask)
+        if self.__event_names is not None:
+            # Without any filter the AMI would send every event, so the events are turned off instead
+            if len(self.__event_names) == 0:
+                self.set_event_mask("off")
+            else:
+                self.add_event_name_filter(self.__event_names)
+
+    def set_event_mask(self, event_mask: str) -> bool:
+        """Sends an Events action to set which events are sent by the AMI to this client.
+
+        :param str event_mask: "on", "off" or a comma separated list of event classes, e.g. "system,call".
+        :return: True if the event mask has been set. Otherwise False is returned."""
+        action = SimpleAction(
+            "Events",
+            ActionID=self.get_next_action_id(),
+            EventMask=event_mask)
+
+        future = self.__client.send_action(action)
+        if future.response is None or future.response.is_error():
+            logging.error(f"Unable to set AMI event mask '{event_mask}': {future.response}")
+            return False
+
+        logging.info(f"Set AMI event mask to '{event_mask}'")
+        return True
+
+    def add_event_name_filter(self, event_names: List[str]) -> bool:
+        """Sends a Filter action for each of the given event names, so the AMI only sends events with these names
+        to this client. The filters are bound to the session and have to be added again after a reconnect.
+        Events sent in response to an action are not filtered by the AMI.
+
+        :return: True if every filter has been added. Otherwise False is returned."""
+        for event_name in event_names:
+            action = SimpleAction(
+                "Filter",
+                ActionID=self.get_next_action_id(),
+                Operation="Add",
+                Filter=f"Event: {event_name}")
+
+            future = self.__client.send_action(action)
+            if future.response is None or future.response.is_error():
+                logging.error(f"Unable to add AMI event filter for '{event_name}': {future.response}")
+                return False
+
+        logging.info("Added AMI event filters, events are sent only for: " + ", ".join(event_names))
+        return True
+
     def logoff(self) -> None:
         """Logs of the client and resets the event filters currently attached to the event listener."""
         self.__client._event_listeners.clear()
@@ -127,6 +196,14 @@ class ClientWrapper:
             return True
         return False
 
+    def is_ready(self) -> bool:
+        """Checks whether the client is logged in, Asterisk is fully booted and the event thread is running.
+
+        :return: True if the client is ready to execute actions. Otherwise False is returned."""
+        if not self.__is_login_validated or not self.__is_asterisk_fully_booted:
+            return False
+        return self.__client._thread is not None and self.__client._thread.is_alive()
+
     def check_ami_connection_health(self) -> bool:
         """Checks the status of the connection to the AMI.
 
@@ -170,3 +247,18 @@ class ClientWrapper:
     def send_action(self, action: SimpleAction) -> FutureResponse:
         """Sends a simple action to the AMI client"""
         return self.__client.send_action(action)
+
+    def send_action_bytes(self, action_id: str, data: bytes, response_timeout: float) -> FutureResponse:
+        """Writes a serialized action, e.g. built by ActionHeaders, directly to the socket of the AMI client.
+        Unlike send_action, no action object is created and serialized for every call.
+
+        :param str action_id: The ActionID contained in the data, used to assign the response.
+        :param float response_timeout: Seconds the returned future waits for the response."""
+        future = FutureResponse(None, response_timeout)
+        self.__client._futures[action_id] = future
+        try:
+            self.__client._socket.sendall(data)
+        except OSError:
+            self.__client._futures.pop(action_id, None)
+            raise
+        return future
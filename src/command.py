@@ -0,0 +1,61 @@
+import re
+from typing import Any, Dict, Iterator, List, Optional, Pattern
+
+
+class CommandParser():
+    """Parses the lines of the output of a CLI command, executed via the Command action, into rows.
+    Every row is processed by the event filters of the action like an event with the given name, whose attributes
+    are the named groups of the regex or the given columns.
+
+    A line is either matched by the regex, or split into the columns by the separator (whitespace if None). The
+    last column receives the rest of the line. In the column mode, only lines matching the optional match regex
+    and with a value for every column are parsed, e.g. to skip the header and the summary of a table."""
+
+    def __init__(self,
+                 event: str,
+                 regex: Optional[str] = None,
+                 columns: Optional[List[str]] = None,
+                 separator: Optional[str] = None,
+                 match: Optional[str] = None) -> None:
+        if (regex is None) == (columns is None):
+            raise Exception(f"Command parser '{event}' requires either a regex or columns")
+
+        self.event: str = event
+        self.__regex: Optional[Pattern[str]] = re.compile(regex) if regex is not None else None
+        if self.__regex is not None and len(self.__regex.groupindex) == 0:
+            raise Exception(f"Command parser '{event}': The regex requires named groups, e.g. (?P<Count>\\d+)")
+        if columns is not None and len(columns) == 0:
+            raise Exception(f"Command parser '{event}' requires at least one column")
+        self.__columns: List[str] = columns or []
+        self.__separator: Optional[str] = separator
+        self.__match: Optional[Pattern[str]] = re.compile(match) if match is not None else None
+
+    def parse(self, line: str) -> Optional[Dict[str, str]]:
+        """Parses the given line of the output.
+
+        :return: The attributes of the row or None if the line is not a row of this parser."""
+        if self.__regex is not None:
+            regex_match = self.__regex.search(line)
+            if regex_match is None:
+                return None
+            return {name: value or "" for name, value in regex_match.groupdict().items()}
+
+        if self.__match is not None and self.__match.search(line) is None:
+            return None
+        values = line.strip().split(self.__separator, len(self.__columns) - 1)
+        if len(values) < len(self.__columns):
+            return None
+        return {column: value.strip() for column, value in zip(self.__columns, values)}
+
+
+def iter_command_output(response: Any) -> Iterator[str]:
+    """Yields the lines of the output of a Command action from its response. Asterisk 14 and later send every line
+    as Output header, older versions send the output after the headers, terminated by --END COMMAND--."""
+    output = response.keys.get("Output", None)
+    if output is not None:
+        yield from output.split("\n")
+        return
+    for line in response.follows or []:
+        if line.startswith("--END COMMAND--"):
+            return
+        yield line
@@ -0,0 +1,75 @@
+import re
+from typing import Any, Callable, Dict, Optional, Tuple
+from asterisk.ami import Event
+
+
+def _to_float(value: str) -> Optional[float]:
+    """Converts the given value to a float. If the value can not be converted, None is returned."""
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class Condition():
+    """Predicate on an attribute of an event, e.g. Context equals "from-trunk".
+    Conditions are compiled once when the configuration is loaded. Equal conditions are shared across filters
+    and cache the result of the last evaluated event, so a shared condition is only evaluated once per event."""
+
+    # Relative cost of each operator. Conditions of an event filter are checked in the order of their cost,
+    # so cheap checks reject events before expensive ones are evaluated.
+    operator_costs: Dict[str, int] = {
+        "equals": 0,
+        "in": 0,
+        "gt": 1,
+        "ge": 1,
+        "lt": 1,
+        "le": 1,
+        "regex": 2,
+    }
+
+    def __init__(self, attribute: str, operator: str, operand: Any) -> None:
+        if operator not in self.operator_costs:
+            raise Exception(f"Invalid condition operator '{operator}'")
+
+        self.attribute: str = attribute
+        self.operator: str = operator
+        self.operand: Any = operand
+        self.cost: int = self.operator_costs[operator]
+
+        self.__check: Callable[[str], bool] = self.__compile(operator, operand)
+        self.__last_result: Tuple[Optional[Event], bool] = (None, False)
+
+    @staticmethod
+    def __compile(operator: str, operand: Any) -> Callable[[str], bool]:
+        """Compiles the check of the attribute value for the given operator and operand."""
+        if operator == "equals":
+            expected = str(operand)
+            return lambda value: value == expected
+        if operator == "in":
+            expected_set = frozenset(str(item) for item in operand)
+            return lambda value: value in expected_set
+        if operator == "regex":
+            pattern = re.compile(operand)
+            return lambda value: pattern.match(value) is not None
+
+        number = float(operand)
+        if operator == "gt":
+            return lambda value: (converted := _to_float(value)) is not None and converted > number
+        if operator == "ge":
+            return lambda value: (converted := _to_float(value)) is not None and converted >= number
+        if operator == "lt":
+            return lambda value: (converted := _to_float(value)) is not None and converted < number
+        return lambda value: (converted := _to_float(value)) is not None and converted <= number
+
+    def matches(self, event: Event) -> bool:
+        """Checks whether the given event matches the condition. If the attribute does not exist
+        in the event, the event does not match."""
+        last_result = self.__last_result
+        if last_result[0] is event:
+            return last_result[1]
+
+        value = event.keys.get(self.attribute, None)
+        result = value is not None and self.__check(str(value))
+        self.__last_result = (event, result)
+        return result
@@ -1,12 +1,25 @@
 from dataclasses import dataclass, field
-from typing import List, Dict, Any
+import math
+from typing import List, Dict, Any, Optional, Set, Tuple
 import yaml
 from event_filter import EventFilter
 from jsonschema import validate
 from pathlib import Path
-from metric_values import MetricValue, MetricValueCounter, MetricValueGauge
-from action import Action
-import logging
+from metric_values import MetricValue, MetricValueCounter, MetricValueGauge, MetricValueGaugeTracker, \
+    MetricValueComputed, LabelMapping, MetricRegistry
+from expression import Expression
+from condition import Condition
+from action import Action, Discovery, TokenBucket
+from channel_tracker import ChannelTracker
+from command import CommandParser
+from event_sink import EventSink, EventSinkOutput, EventSinkOutputFile, EventSinkOutputStdout, EventSinkOutputUDP, \
+    EventSinkOutputTCP
+
+# Every metric loaded so far, deduplicated by its name. Used to resolve the metric references of computed metrics.
+_metric_registry: MetricRegistry = MetricRegistry()
+# Every condition loaded so far. Equal conditions are shared across event filters, so they are only
+# evaluated once per event.
+_loaded_conditions: Dict[Tuple[str, str, str], Condition] = {}
 
 
 def _load_metric_labels(metric_config: Dict[Any, Any]) -> Dict[str, str]:
@@ -17,7 +30,31 @@ def _load_metric_labels(metric_config: Dict[Any, Any]) -> Dict[str, str]:
     labels: Dict[str, str] = {}
     for label in metric_config["labels"]:
         labels[label["name"]] = label["value"]
-    return labels
+
+    # Drop labels before the metric is created, so the values of the metric are aggregated over them.
+    # Counters and incremented gauges sum up, gauges that are set require an aggregation, see _load_metric.
+    label_names = list(labels)
+    if "aggregate_by" in metric_config:
+        for label_name in metric_config["aggregate_by"]:
+            if label_name not in labels:
+                raise Exception(f"Metric '{metric_config['name']}': Unable to aggregate by unknown label "
+                                f"'{label_name}'")
+        label_names = [label_name for label_name in label_names if label_name in metric_config["aggregate_by"]]
+    if "drop_labels" in metric_config:
+        label_names = [label_name for label_name in label_names if label_name not in metric_config["drop_labels"]]
+
+    return {label_name: labels[label_name] for label_name in label_names}
+
+
+def _load_metric_label_mappings(metric_config: Dict[Any, Any]) -> Dict[str, LabelMapping]:
+    """Loads the value mappings of the labels from the given dict. See config_schema.yml for more information."""
+    mappings: Dict[str, LabelMapping] = {}
+    for label in metric_config.get("labels", []):
+        if "map" not in label:
+            continue
+        rules = [(rule["match"], rule["value"]) for rule in label["map"]]
+        mappings[label["name"]] = LabelMapping(rules, label.get("default", None))
+    return mappings
 
 
 def _load_metric_value_counter(value_config: Dict[Any, Any],
@@ -27,9 +64,7 @@ def _load_metric_value_counter(value_config: Dict[Any, Any],
     """Loads the given dict and creates a MetricValueCounter based on it. See config_schema.yml for more information."""
     increment_value = value_config.get("increment_value", "1")
 
-    metric = MetricValueCounter(name, description, labels, increment_value)
-    metric.init()
-    return metric
+    return MetricValueCounter(name, description, labels, increment_value)
 
 
 def _load_metric_value_gauge(value_config: Dict[Any, Any],
@@ -40,35 +75,116 @@ def _load_metric_value_gauge(value_config: Dict[Any, Any],
     set_value = value_config.get("set_value", None)
     increment_value = value_config.get("increment_value", None)
     value_on_scrape_start = value_config.get("value_on_scrape_start", None)
+    aggregate = value_config.get("aggregate", None)
 
-    metric = MetricValueGauge(
+    return MetricValueGauge(
         name,
         description,
         labels,
         set_value,
         increment_value,
-        value_on_scrape_start)
-    metric.init()
-    return metric
+        value_on_scrape_start,
+        aggregate)
+
+
+def _load_metric_value_computed(value_config: Dict[Any, Any],
+                                name: str,
+                                description: str,
+                                labels: Dict[str, str]) -> MetricValueComputed:
+    """Loads the given dict and creates a MetricValueComputed based on it. See config_schema.yml for more
+    information. Referenced metrics must be loaded before the computed metric and use the same labels."""
+    expression = Expression(value_config["expression"])
+    evaluate_on_scrape_end = value_config.get("evaluate", "event") == "scrape_end"
+
+    metric_references: Dict[str, MetricValue] = {}
+    for metric_name in expression.metric_names:
+        metric = _metric_registry.reference(metric_name)
+        if metric is None:
+            raise Exception(f"Metric '{name}': Referenced metric '{metric_name}' does not exist")
+        if list(metric._metric_labels) != list(labels):
+            raise Exception(f"Metric '{name}': Referenced metric '{metric_name}' has different labels")
+        metric_references[metric_name] = metric
+
+    if evaluate_on_scrape_end and len(metric_references) == 0:
+        raise Exception(f"Metric '{name}': Evaluating on scrape end requires at least one referenced metric")
+    if evaluate_on_scrape_end and len(expression.field_names) > 0:
+        raise Exception(f"Metric '{name}': Evaluating on scrape end does not allow event attribute references")
+
+    return MetricValueComputed(
+        name,
+        description,
+        labels,
+        expression,
+        metric_references,
+        evaluate_on_scrape_end)
 
 
 def _load_metric(metric_config: Dict[Any, Any]) -> MetricValue:
-    """Loads the given dict and creates a MetricValue based on it. See config_schema.yml for more information."""
+    """Loads the given dict and creates a MetricValue based on it. See config_schema.yml for more information.
+    A metric whose name is already loaded feeds the series of the loaded metric, if its type and labels match."""
     name = metric_config["name"]
     description = metric_config["description"]
     labels = _load_metric_labels(metric_config)
+    value_config = metric_config["value"]
+    if len(labels) < len(metric_config.get("labels", [])) and value_config["type"] == "gauge" and \
+            "set_value" in value_config and "aggregate" not in value_config:
+        raise Exception(f"Metric '{name}': Dropping labels of a gauge with a set_value requires an aggregate, "
+                        f"otherwise the last event would overwrite the values of the others")
 
+    metric: MetricValue
     if metric_config["value"]["type"] == "counter":
-        return _load_metric_value_counter(
+        metric = _load_metric_value_counter(
             metric_config["value"], name, description, labels)
     elif metric_config["value"]["type"] == "gauge":
-        return _load_metric_value_gauge(
+        metric = _load_metric_value_gauge(
             metric_config["value"], name, description, labels)
+    elif metric_config["value"]["type"] == "computed":
+        metric = _load_metric_value_computed(
+            metric_config["value"], name, description, labels)
+    else:
+        raise Exception("Invalid metric type")
 
-    raise Exception("Invalid metric type")
+    for label_name, mapping in _load_metric_label_mappings(metric_config).items():
+        if label_name in labels:
+            metric.add_label_mapping(label_name, mapping)
 
+    _metric_registry.register(metric)
+    return metric
 
-def _load_event_filter(event_config: Dict[Any, Any]) -> EventFilter:
+
+def _load_conditions(event_config: Dict[Any, Any]) -> List[Condition]:
+    """Loads the conditions of the given event filter config. Equal conditions that have already been loaded
+    are reused. See config_schema.yml for more information."""
+    conditions: List[Condition] = []
+    for condition_config in event_config.get("conditions", []):
+        attribute = condition_config["attribute"]
+        for operator in Condition.operator_costs:
+            if operator not in condition_config:
+                continue
+            key = (attribute, operator, str(condition_config[operator]))
+            if key not in _loaded_conditions:
+                _loaded_conditions[key] = Condition(attribute, operator, condition_config[operator])
+            conditions.append(_loaded_conditions[key])
+    return conditions
+
+
+def _load_metric_tracking(metric_config: Dict[Any, Any], metric: MetricValue) -> List[EventFilter]:
+    """Loads the track list of the given metric config and creates an EventFilter for each entry, which applies
+    the filtered events to the already loaded metric. See config_schema.yml for more information."""
+    if not isinstance(metric, MetricValueGauge):
+        return []
+
+    filter_list: List[EventFilter] = []
+    for track_config in metric_config["value"].get("track", []):
+        tracker = MetricValueGaugeTracker(
+            metric,
+            track_config.get("set_value", None),
+            track_config.get("increment_value", None))
+        filter_list.append(EventFilter(track_config["event"].split("|"), [tracker], _load_conditions(track_config)))
+    return filter_list
+
+
+def _load_event_filter(event_config: Dict[Any, Any], batch_size: int = 1000) -> EventFilter:
     """Loads the given dict and creates an EventFilter based on it. See config_schema.yml for more information."""
     event_names: List[str] = event_config["event"]
     metric_values: List[MetricValue] = []
@@ -80,14 +196,89 @@ def _load_event_filter(event_config: Dict[Any, Any]) -> EventFilter:
         for metric in event_config["metrics"]:
             metric_values.append(_load_metric(metric))
 
-    return EventFilter(event_names, metric_values)
+    return EventFilter(event_names, metric_values, _load_conditions(event_config), batch_size)
+
+
+def _load_event_sink_output(output_config: Dict[Any, Any]) -> EventSinkOutput:
+    """Loads the given dict and creates the output of an EventSink based on it.
+    See config_schema.yml for more information."""
+    output_type = output_config["type"]
+    if output_type == "file":
+        return EventSinkOutputFile(
+            output_config["path"],
+            output_config.get("max_bytes", 0),
+            output_config.get("backup_count", 5))
+    if output_type == "stdout":
+        return EventSinkOutputStdout()
+    if "host" not in output_config or "port" not in output_config:
+        raise Exception(f"Event sink output '{output_type}' requires a host and a port")
+    if output_type == "udp":
+        return EventSinkOutputUDP(output_config["host"], output_config["port"])
+    return EventSinkOutputTCP(output_config["host"], output_config["port"])
+
+
+def _load_event_sink(sink_config: Dict[Any, Any]) -> Tuple[EventFilter, EventSink]:
+    """Loads the given dict and creates an EventSink and the EventFilter selecting its events based on it.
+    See config_schema.yml for more information."""
+    output_config = sink_config["output"]
+    if output_config["type"] == "file" and "path" not in output_config:
+        raise Exception("Event sink output 'file' requires a path")
+
+    sink = EventSink(
+        _load_event_sink_output(output_config),
+        sink_config.get("batch_size", 100),
+        sink_config.get("flush_interval", 1),
+        sink_config.get("queue_size", 10000))
+
+    event_names: List[str] = sink_config["event"].split("|")
+    return EventFilter(event_names, [sink], _load_conditions(sink_config)), sink  # type: ignore
+
+
+def _load_rate_limit(rate_limit_config: Optional[Dict[Any, Any]]) -> Optional[TokenBucket]:
+    """Loads the given dict and creates a TokenBucket based on it. See config_schema.yml for more information."""
+    if rate_limit_config is None:
+        return None
+    return TokenBucket(rate_limit_config["rate"], rate_limit_config.get("burst", 1))
+
+
+def _load_command_parser(parser_config: Dict[Any, Any]) -> CommandParser:
+    """Loads the given dict and creates a CommandParser based on it. See config_schema.yml for more information."""
+    return CommandParser(
+        parser_config["event"],
+        parser_config.get("regex", None),
+        parser_config.get("columns", None),
+        parser_config.get("separator", None),
+        parser_config.get("match", None))
+
+
+def _load_discovery(
+        discovery_config: Dict[Any, Any],
+        parameters: Dict[str, str],
+        response_timeout: int,
+        event_timeout: int) -> Discovery:
+    """Loads the given dict and creates the Discovery of an action with the given parameters based on it.
+    See config_schema.yml for more information."""
+    attributes = list(dict.fromkeys(value[1:] for value in parameters.values() if value.startswith("$")))
+    if len(attributes) == 0:
+        raise Exception(f"Discovery '{discovery_config['name']}' requires a parameter of the action referencing "
+                        "an attribute of the discovered events, e.g. '$Queue'")
+    return Discovery(
+        discovery_config["name"],
+        discovery_config["event"],
+        discovery_config["until"],
+        attributes,
+        discovery_config.get("response_timeout", response_timeout),
+        discovery_config.get("event_timeout", event_timeout),
+        {str(parameter): str(value) for parameter, value in discovery_config.get("parameters", {}).items()},
+        discovery_config.get("refresh_interval", 300))
 
 
 def _load_action(action_config: Dict[Any, Any]) -> Action:
     """Loads the given dict and creates an Action based on it. See config_schema.yml for more information."""
-    name = action_config["name"]
+    command = action_config.get("command", None)
+    name = action_config.get("name", "Command") if command is not None else action_config["name"]
     filter_list: List[EventFilter] = []
-    until = action_config["until"]
+    until = action_config.get("until", "") if command is not None else action_config["until"]
     response_timeout = action_config.get(
         "response_timeout",
         default_config.action_response_timeout)
@@ -99,10 +290,33 @@ def _load_action(action_config: Dict[Any, Any]) -> Action:
         "action_context", default_config.action_context)
     action_caller_id = action_config.get(
         "action_caller_id", default_config.action_caller_id)
+    resync_interval = action_config.get("resync_interval", None)
+    batch_size = action_config.get("batch_size", default_config.action_batch_size)
+    timestamps = action_config.get("timestamps", default_config.action_timestamps)
+    parameters = {str(parameter): str(value) for parameter, value in action_config.get("parameters", {}).items()}
+    track_filter_list: List[EventFilter] = []
+
+    command_parsers = None
+    label = name
+    if command is not None:
+        parameters["Command"] = str(command)
+        command_parsers = [_load_command_parser(parser) for parser in action_config.get("parsers", [])]
+        label = f"{name} {command}"
+
+    discovery = None
+    if "discover" in action_config:
+        discovery = _load_discovery(action_config["discover"], parameters, response_timeout, event_timeout)
+    elif any(value.startswith("$") for value in parameters.values()):
+        raise Exception(f"Action '{name}' references attributes in its parameters, but has no 'discover' section")
 
     if "collect" in action_config:
         for filter in action_config["collect"]:
-            filter_list.append(_load_event_filter(filter))
+            event_filter = _load_event_filter(filter, batch_size)
+            filter_list.append(event_filter)
+            for metric_config, metric in zip(filter.get("metrics", []), event_filter.get_metric_values()):
+                track_filter_list += _load_metric_tracking(metric_config, metric)
+                if timestamps:
+                    metric.expose_timestamps()
 
     return Action(
         name,
@@ -112,7 +326,60 @@ def _load_action(action_config: Dict[Any, Any]) -> Action:
         event_timeout,
         action_priority,
         action_context,
-        action_caller_id)
+        action_caller_id,
+        track_filter_list,
+        resync_interval,
+        rate_limiter=_load_rate_limit(action_config.get("rate_limit", None)),
+        slow_response_time=action_config.get("slow_response_time", None),
+        max_backoff=action_config.get("max_backoff", default_config.action_max_backoff),
+        parameters=parameters,
+        discovery=discovery,
+        max_concurrency=action_config.get("max_concurrency", 1),
+        command_parsers=command_parsers,
+        label=action_config.get("label", label))
+
+
+def get_loaded_metrics() -> Dict[str, MetricValue]:
+    """Returns every loaded metric by its name. Of a metric defined several times, the first definition is
+    returned, which holds the shared series."""
+    return _metric_registry.get_metrics()
+
+
+def get_loaded_event_filters(include_actions: bool = True) -> List[EventFilter]:
+    """Returns every loaded event filter: the runtime filters and the filters of the actions.
+
+    :param bool include_actions: Whether the filters collecting the events of the actions are included. The filters
+                                 tracking the metrics of the actions using incremental events are always included."""
+    filter_list: List[EventFilter] = filter_config.filter_list + sink_config.filter_list + \
+        channel_tracker_config.filter_list
+    for action in scrape_config.action_list:
+        filter_list = filter_list + action.track_filter_list
+        if include_actions:
+            filter_list = filter_list + action.filter_list
+    return filter_list
+
+
+def get_required_event_names(include_actions: bool = True) -> Set[str]:
+    """Returns the names of every event filtered by the loaded configuration, i.e. the minimum set of events
+    the AMI has to send to the exporter.
+
+    :param bool include_actions: Whether the events collected by the actions, their 'until' events and the events
+                                 of their discoveries are included.
+                                 Not required for a client that does not execute the actions."""
+    event_names: Set[str] = set()
+    for filter in get_loaded_event_filters(include_actions=False):
+        event_names.update(filter.get_event_name_set())
+    if include_actions:
+        for action in scrape_config.action_list:
+            if action.discovery is not None:
+                event_names.update((action.discovery.event, action.discovery.until))
+            # The rows of a command are parsed from its response, they are not sent as events
+            if action.command_parsers is not None:
+                continue
+            event_names.add(action.until)
+            for filter in action.filter_list:
+                event_names.update(filter.get_event_name_set())
+    return event_names
 
 
 @dataclass
@@ -121,6 +388,8 @@ class __AMIClientConfig():
     port: int = 0
     username: str = "undefined"
     secret: str = "undefined"
+    separate_action_connection: bool = False
+    server_side_event_filter: bool = False
 
     def load(self, config: Dict[Any, Any]) -> None:
         """Loads the given dict. See config_schema.yml for more information."""
@@ -128,11 +397,16 @@ class __AMIClientConfig():
         self.port = config["port"]
         self.username = config["username"]
         self.secret = config["secret"]
+        self.separate_action_connection = config.get("separate_action_connection", self.separate_action_connection)
+        self.server_side_event_filter = config.get("server_side_event_filter", self.server_side_event_filter)
 
 
 @dataclass
 class __GeneralConfig():
     log_level: str = "INFO"
+    log_format: str = "text"
+    log_rate_limit: int = 10
+    log_rate_limit_interval: float = 60
     login_validation_timeout: int = 10
     fully_booted_validation_timeout: int = 60
     response_timeout: int = 10
@@ -141,6 +415,9 @@ class __GeneralConfig():
     def load(self, config: Dict[Any, Any]) -> None:
         """Loads the given dict. See config_schema.yml for more information."""
         self.log_level = config.get("log_level", self.log_level)
+        self.log_format = config.get("log_format", self.log_format)
+        self.log_rate_limit = config.get("log_rate_limit", self.log_rate_limit)
+        self.log_rate_limit_interval = config.get("log_rate_limit_interval", self.log_rate_limit_interval)
         self.login_validation_timeout = config.get(
             "login_validation_timeout", self.login_validation_timeout)
         self.fully_booted_validation_timeout = config.get(
@@ -150,6 +427,69 @@ class __GeneralConfig():
         self.ping_timeout = config.get("ping_timeout", self.ping_timeout)
 
 
+@dataclass
+class __HTTPServerConfig():
+    max_concurrent_scrapes: int = 2
+    request_timeout: float = 10
+    keep_alive_timeout: float = 60
+    gzip: bool = True
+    debug_endpoints: bool = False
+
+    def load(self, config: Dict[Any, Any]) -> None:
+        """Loads the given dict. See config_schema.yml for more information."""
+        self.max_concurrent_scrapes = config.get("max_concurrent_scrapes", self.max_concurrent_scrapes)
+        self.request_timeout = config.get("request_timeout", self.request_timeout)
+        self.keep_alive_timeout = config.get("keep_alive_timeout", self.keep_alive_timeout)
+        self.gzip = config.get("gzip", self.gzip)
+        self.debug_endpoints = config.get("debug_endpoints", self.debug_endpoints)
+
+
+@dataclass
+class __PushConfig():
+    mode: str = "remote_write"
+    url: str = ""
+    job: str = "asterisk"
+    grouping_key: Dict[str, str] = field(default_factory=dict)
+    flush_interval: float = 5
+    queue_size: int = 10
+    max_retries: int = 5
+    retry_backoff: float = 1
+    max_backoff: float = 30
+    timeout: float = 10
+
+    def load(self, config: Dict[Any, Any]) -> None:
+        """Loads the given dict. See config_schema.yml for more information."""
+        self.mode = config.get("mode", self.mode)
+        self.url = config["url"]
+        self.job = config.get("job", self.job)
+        self.grouping_key = config.get("grouping_key", self.grouping_key)
+        self.flush_interval = config.get("flush_interval", self.flush_interval)
+        self.queue_size = config.get("queue_size", self.queue_size)
+        self.max_retries = config.get("max_retries", self.max_retries)
+        self.retry_backoff = config.get("retry_backoff", self.retry_backoff)
+        self.max_backoff = config.get("max_backoff", self.max_backoff)
+        self.timeout = config.get("timeout", self.timeout)
+
+    def is_enabled(self) -> bool:
+        """Checks whether the metrics are pushed, i.e. a URL is configured."""
+        return self.url != ""
+
+
+@dataclass
+class __SnapshotConfig():
+    path: str = ""
+    interval: float = 60
+
+    def load(self, config: Dict[Any, Any]) -> None:
+        """Loads the given dict. See config_schema.yml for more information."""
+        self.path = config["path"]
+        self.interval = config.get("interval", self.interval)
+
+    def is_enabled(self) -> bool:
+        """Checks whether the values of the metrics are persisted, i.e. a path is configured."""
+        return self.path != ""
+
+
 @dataclass
 class __DefaultConfig():
     scrape_interval: int = 10
@@ -158,6 +498,9 @@ class __DefaultConfig():
     action_priority: int = 1
     action_context: str = "default"
     action_caller_id: str = "python"
+    action_max_backoff: int = 8
+    action_batch_size: int = 1000
+    action_timestamps: bool = False
 
     def load(self, config: Dict[Any, Any]):
         """Loads the given dict. See config_schema.yml for more information."""
@@ -172,6 +515,12 @@ class __DefaultConfig():
         self.action_context = config.get("action_context", self.action_context)
         self.action_caller_id = config.get(
             "action_caller_id", self.action_caller_id)
+        self.action_max_backoff = config.get(
+            "action_max_backoff", self.action_max_backoff)
+        self.action_batch_size = config.get(
+            "action_batch_size", self.action_batch_size)
+        self.action_timestamps = config.get(
+            "action_timestamps", self.action_timestamps)
 
 
 @dataclass
@@ -184,14 +533,62 @@ class __FilterConfig():
             self.filter_list.append(_load_event_filter(filter))
 
 
+@dataclass
+class __SinkConfig():
+    sink_list: List[EventSink] = field(default_factory=list)
+    filter_list: List[EventFilter] = field(default_factory=list)
+
+    def load(self, config: Dict[Any, Any]) -> None:
+        """Loads the given dict. See config_schema.yml for more information."""
+        for sink_config in config:
+            event_filter, sink = _load_event_sink(sink_config)
+            self.filter_list.append(event_filter)
+            self.sink_list.append(sink)
+
+
+@dataclass
+class __ChannelTrackerConfig():
+    tracker: Optional[ChannelTracker] = None
+    filter_list: List[EventFilter] = field(default_factory=list)
+    resync_action: Optional[Action] = None
+
+    def load(self, config: Dict[Any, Any]) -> None:
+        """Loads the given dict. See config_schema.yml for more information."""
+        labels = _load_metric_labels(config)
+        tracker = ChannelTracker(
+            config["name"],
+            config.get("description", "Channels tracked by the exporter"),
+            labels,
+            config.get("duration_buckets", ChannelTracker.default_duration_buckets))
+        for label_name, mapping in _load_metric_label_mappings(config).items():
+            if label_name in labels:
+                tracker.add_label_mapping(label_name, mapping)
+        tracker.init()
+
+        self.tracker = tracker
+        self.filter_list = [EventFilter(ChannelTracker.tracked_event_names, [tracker])]
+        self.resync_action = Action(
+            "CoreShowChannels",
+            [EventFilter([ChannelTracker.resync_event_name], [tracker])],
+            "CoreShowChannelsComplete",
+            default_config.action_response_timeout,
+            config.get("event_timeout", default_config.action_event_timeout),
+            default_config.action_priority,
+            default_config.action_context,
+            default_config.action_caller_id,
+            resync_interval=config.get("resync_interval", math.inf))
+
+
 @dataclass
 class __ScrapeConfig():
     interval = 0
     action_list: List[Action] = field(default_factory=list)
+    rate_limiter: Optional[TokenBucket] = None
 
     def load(self, config: Dict[Any, Any]) -> None:
         """Loads the given dict. See config_schema.yml for more information."""
         self.interval = config.get("interval", default_config.scrape_interval)
+        self.rate_limiter = _load_rate_limit(config.get("rate_limit", None))
         if "actions" in config:
             for action in config["actions"]:
                 self.action_list.append(_load_action(action))
@@ -199,8 +596,13 @@ class __ScrapeConfig():
 
 ami_client_config = __AMIClientConfig()
 general_config = __GeneralConfig()
+http_server_config = __HTTPServerConfig()
+push_config = __PushConfig()
+snapshot_config = __SnapshotConfig()
 default_config = __DefaultConfig()
 filter_config = __FilterConfig()
+sink_config = __SinkConfig()
+channel_tracker_config = __ChannelTrackerConfig()
 scrape_config = __ScrapeConfig()
 
 
@@ -225,14 +627,28 @@ def load_from_file(path: str) -> None:
     if "general" in config:
         general_config.load(config["general"])
 
+    if "http_server" in config:
+        http_server_config.load(config["http_server"])
+
+    if "push" in config:
+        push_config.load(config["push"])
+
+    if "snapshot" in config:
+        snapshot_config.load(config["snapshot"])
+
     if "default" in config:
         default_config.load(config["default"])
 
     if "filter" in config:
         filter_config.load(config["filter"])
 
+    if "sinks" in config:
+        sink_config.load(config["sinks"])
+
     if "scrape" in config:
         scrape_config.load(config["scrape"])
 
-    logging.basicConfig()
-    logging.getLogger().setLevel(general_config.log_level)
+    if "channel_tracker" in config:
+        channel_tracker_config.load(config["channel_tracker"])
+        if channel_tracker_config.resync_action is not None:
+            scrape_config.action_list.append(channel_tracker_config.resync_action)
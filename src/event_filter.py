@@ -1,47 +1,97 @@
 import logging
-from typing import List, Optional
+from typing import List, Optional, FrozenSet
 from asterisk.ami import Event
 from metric_values import MetricValue
+from condition import Condition
 
 
 class EventFilter():
     def __init__(
             self,
             event_names: List[str],
-            metric_values: List[MetricValue]) -> None:
+            metric_values: List[MetricValue],
+            conditions: Optional[List[Condition]] = None,
+            batch_size: int = 1000) -> None:
         self.__event_names: List[str] = event_names
         self.__metric_values: List[MetricValue] = metric_values
+        # Cheap conditions are checked first, so rejected events cost as little as possible
+        self.__conditions: List[Condition] = sorted(conditions or [], key=lambda condition: condition.cost)
 
-        self.__action_id: Optional[str] = None
+        self.__event_name_set: FrozenSet[str] = frozenset(
+            [event_names] if isinstance(event_names, str) else event_names)
+        # ActionIDs of the action whose events are collected, one per execution of a fan-out
+        self.__action_ids: Optional[FrozenSet[str]] = None
+        # Events collected during an action, passed to the metrics at once whenever batch_size events are collected
+        # and at the end of the action. The batch size bounds the memory used by the events of large list actions,
+        # a batch size of 0 processes every event when it is received. Only used if every metric supports batch
+        # processing, metric-like objects such as event sinks do not. Checked per action, since a metric loaded
+        # after the filter may still disable the batch processing of its metrics, see MetricRegistry.reference.
+        self.__batch_size: int = batch_size
+        self.__batch: Optional[List[Event]] = None
 
     def get_event_names(self) -> List[str]:
         return self.__event_names
 
-    def on_scrape_start(self, action_id: str) -> None:
-        """Sets the given action_id and passes the on_scrape_start signal to all metrics."""
-        self.__action_id = action_id
+    def get_event_name_set(self) -> FrozenSet[str]:
+        return self.__event_name_set
+
+    def get_metric_values(self) -> List[MetricValue]:
+        return self.__metric_values
+
+    def on_scrape_start(self, *action_ids: str) -> None:
+        """Sets the given action_ids and passes the on_scrape_start signal to all metrics.
+        If batch processing is supported, the filtered events are collected until the end of the scrape process."""
+        self.__action_ids = frozenset(action_ids)
+        if self.__batch_size > 0 and len(self.__metric_values) > 0 and all(
+                getattr(metric, "supports_batch_processing", False) for metric in self.__metric_values):
+            self.__batch = []
         for metric in self.__metric_values:
             metric.on_scrape_start()
 
-    def on_scrape_end(self) -> None:
-        """Passes the on_scrape_end signal to all metrics."""
+    def on_scrape_end(self, complete: bool = True) -> None:
+        """Passes the collected events and the on_scrape_end signal to all metrics, or the on_scrape_abort signal
+        if the scrape process did not complete. The events of an incomplete scrape process are still passed to the
+        metrics that do not stage their values, e.g. counters, which count every received event like when the
+        events are not batched."""
+        batch = self.__batch
+        self.__batch = None
         for metric in self.__metric_values:
-            metric.on_scrape_end()
+            if complete:
+                if batch:
+                    metric.process_events(batch)
+                metric.on_scrape_end()
+            else:
+                if batch and not getattr(metric, "stages_values", False):
+                    metric.process_events(batch)
+                metric.on_scrape_abort()
 
     def process_event(self, event: Event) -> None:
         """Processes and filters the given event.
-        If the name and, if applicable, the ActionID match, the event is passed to all metrics."""
-        if event.name not in self.__event_names:
+        If the name, if applicable the ActionID and all conditions match, the event is passed to all metrics."""
+        if event.name not in self.__event_name_set:
             return
 
-        if self.__action_id is not None:
-            if event.keys["ActionID"] != self.__action_id:
+        if self.__action_ids is not None:
+            if event.keys["ActionID"] not in self.__action_ids:
+                return
+
+        for condition in self.__conditions:
+            if not condition.matches(event):
                 return
 
-        if self.__action_id is not None:
-            logging.debug(f"Processing action based event: {event.name}")
+        if self.__action_ids is not None:
+            logging.debug("Processing action based event: %s", event.name)
         else:
-            logging.debug(f"Processing event: {event.name}")
+            logging.debug("Processing event: %s", event.name)
+
+        batch = self.__batch
+        if batch is not None:
+            batch.append(event)
+            if len(batch) >= self.__batch_size:
+                self.__batch = []
+                for value in self.__metric_values:
+                    value.process_events(batch)
+            return
 
         for value in self.__metric_values:
             value.process_event(event)
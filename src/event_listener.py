@@ -1,7 +1,6 @@
 import logging
 from time import time
-import traceback
-from typing import List
+from typing import Dict, List
 from asterisk.ami import EventListener as ClientEventListener
 from event_filter import EventFilter
 
@@ -11,6 +10,9 @@ class EventListener(ClientEventListener):
 
     def __init__(self) -> None:
         self.__event_filter: List[EventFilter] = []
+        # Event filters by the event names they filter. Used to only pass an event to the filters
+        # that filter its name.
+        self.__event_filter_index: Dict[str, List[EventFilter]] = {}
 
         # UNIX timestamp when the last event was received. Used to validate the
         # connection to the AMI.
@@ -20,11 +22,21 @@ class EventListener(ClientEventListener):
         """Adds a filter to the filter list, which thus receives all events."""
         logging.debug(f"Attach event filter: {filter.get_event_names()}")
         self.__event_filter.append(filter)
+        # The lists of the index are replaced instead of modified, since they are iterated by the event thread
+        for event_name in filter.get_event_name_set():
+            self.__event_filter_index[event_name] = self.__event_filter_index.get(event_name, []) + [filter]
 
     def remove_event_filter(self, filter: EventFilter) -> None:
         """Deletes an event filter from the event filter list. The filter will therefore
         no longer receive new events."""
         self.__event_filter.remove(filter)
+        for event_name in filter.get_event_name_set():
+            event_filter = list(self.__event_filter_index[event_name])
+            event_filter.remove(filter)
+            if len(event_filter) == 0:
+                del self.__event_filter_index[event_name]
+            else:
+                self.__event_filter_index[event_name] = event_filter
 
     def get_time_of_last_event(self) -> float:
         """Returns the UNIX timestamp of the last received event."""
@@ -38,13 +50,15 @@ class EventListener(ClientEventListener):
     def reset(self) -> None:
         """Resets the event filter currently attached to the event listener."""
         self.__event_filter.clear()
+        self.__event_filter_index.clear()
 
     def on_event(self, event, **kwargs) -> None:
         """Callback used to get each event. Saves the time of the last event received and forwards the event to
-        each event filter. Unhandled exception raised in the event filters are logged here."""
+        each event filter that filters its name. Unhandled exception raised in the event filters are logged here."""
         self.__last_event_received = time()
         try:
-            for filter in self.__event_filter:
+            for filter in self.__event_filter_index.get(event.name, ()):
                 filter.process_event(event)
         except Exception:
-            logging.error(traceback.format_exc())
+            # The traceback is only formatted if the record is logged
+            logging.exception("Unable to process event %s", event.name)
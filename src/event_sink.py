@@ -0,0 +1,200 @@
+import json
+import logging
+import os
+import queue
+import socket
+import sys
+import threading
+from time import time
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+from asterisk.ami import Event
+
+
+class EventSinkOutput():
+    """Parent class for any destination the events of an EventSink are written to."""
+
+    def write(self, data: bytes) -> None:
+        """Function implemented by the child classes, used to write a batch of NDJSON lines.
+        Raises an OSError if the batch could not be written."""
+        ...
+
+    def close(self) -> None:
+        """Function implemented by the child classes, used to release the resources of the output."""
+        ...
+
+
+class EventSinkOutputFile(EventSinkOutput):
+    """Appends the events to a file. If max_bytes is set, the file is rotated before it would exceed the size,
+    keeping backup_count old files with the suffixes .1, .2, ..."""
+
+    def __init__(self, path: str, max_bytes: int = 0, backup_count: int = 5) -> None:
+        self.__path: str = path
+        self.__max_bytes: int = max_bytes
+        self.__backup_count: int = backup_count
+        self.__file: Optional[BinaryIO] = None
+
+    def __rotate(self) -> None:
+        """Closes the file and shifts it and the existing backups by one suffix."""
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+        if self.__backup_count == 0:
+            os.remove(self.__path)
+            return
+        for index in range(self.__backup_count - 1, 0, -1):
+            if os.path.exists(f"{self.__path}.{index}"):
+                os.replace(f"{self.__path}.{index}", f"{self.__path}.{index + 1}")
+        os.replace(self.__path, f"{self.__path}.1")
+
+    def write(self, data: bytes) -> None:
+        if self.__file is None:
+            self.__file = open(self.__path, "ab")
+
+        if self.__max_bytes > 0 and 0 < self.__file.tell() and self.__file.tell() + len(data) > self.__max_bytes:
+            self.__rotate()
+            self.__file = open(self.__path, "ab")
+
+        self.__file.write(data)
+        self.__file.flush()
+
+    def close(self) -> None:
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+
+class EventSinkOutputStdout(EventSinkOutput):
+    """Writes the events to the standard output."""
+
+    def write(self, data: bytes) -> None:
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+
+
+class EventSinkOutputUDP(EventSinkOutput):
+    """Sends the events as UDP datagrams. Lines are packed into datagrams of at most max_datagram_size bytes,
+    a line is never split across datagrams."""
+
+    def __init__(self, host: str, port: int, max_datagram_size: int = 8192) -> None:
+        self.__address: Tuple[str, int] = (host, port)
+        self.__max_datagram_size: int = max_datagram_size
+        self.__socket: socket.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def write(self, data: bytes) -> None:
+        datagram = b""
+        for line in data.splitlines(keepends=True):
+            if len(datagram) > 0 and len(datagram) + len(line) > self.__max_datagram_size:
+                self.__socket.sendto(datagram, self.__address)
+                datagram = b""
+            datagram += line
+        if len(datagram) > 0:
+            self.__socket.sendto(datagram, self.__address)
+
+    def close(self) -> None:
+        self.__socket.close()
+
+
+class EventSinkOutputTCP(EventSinkOutput):
+    """Sends the events over a TCP connection. The connection is established on the first write
+    and again after an error."""
+
+    def __init__(self, host: str, port: int, timeout: float = 5) -> None:
+        self.__address: Tuple[str, int] = (host, port)
+        self.__timeout: float = timeout
+        self.__socket: Optional[socket.socket] = None
+
+    def write(self, data: bytes) -> None:
+        try:
+            if self.__socket is None:
+                self.__socket = socket.create_connection(self.__address, self.__timeout)
+            self.__socket.sendall(data)
+        except OSError:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        if self.__socket is not None:
+            self.__socket.close()
+            self.__socket = None
+
+
+class EventSink():
+    """Writes events as NDJSON to an output, e.g. to ship them to a log pipeline.
+    The sink is passed to an EventFilter in place of a metric value, so its events are selected with the same
+    filter syntax. Processing an event only puts it into a bounded queue; a writer thread serializes the events
+    and writes them in batches, so the event thread is never blocked by the output. If the queue is full,
+    events are dropped."""
+
+    def __init__(self,
+                 output: EventSinkOutput,
+                 batch_size: int = 100,
+                 flush_interval: float = 1,
+                 queue_size: int = 10000) -> None:
+        self.__output: EventSinkOutput = output
+        self.__batch_size: int = batch_size
+        self.__flush_interval: float = flush_interval
+        self.__queue: queue.Queue[Optional[Tuple[float, Event]]] = queue.Queue(queue_size)
+        self.__thread: Optional[threading.Thread] = None
+        self.dropped_events: int = 0
+
+    def start(self) -> None:
+        """Starts the writer thread."""
+        self.__thread = threading.Thread(target=self.__run, name="event-sink", daemon=True)
+        self.__thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Writes the queued events, stops the writer thread and closes the output."""
+        if self.__thread is None:
+            return
+        self.__queue.put(None)
+        self.__thread.join(timeout)
+        self.__thread = None
+        self.__output.close()
+
+    def on_scrape_start(self) -> None:
+        ...
+
+    def on_scrape_end(self) -> None:
+        ...
+
+    def on_scrape_abort(self) -> None:
+        ...
+
+    def process_event(self, event: Event) -> None:
+        """Queues the given event to be written."""
+        try:
+            self.__queue.put_nowait((time(), event))
+        except queue.Full:
+            self.dropped_events += 1
+            if self.dropped_events == 1 or self.dropped_events % 1000 == 0:
+                logging.warning(f"Event sink queue is full, dropped {self.dropped_events} events so far")
+
+    @staticmethod
+    def serialize(timestamp: float, event: Event) -> bytes:
+        """Serializes the given event as NDJSON line."""
+        data: Dict[str, Any] = {"timestamp": timestamp, "event": event.name, "attributes": event.keys}
+        return json.dumps(data, separators=(",", ":"), default=str).encode() + b"\n"
+
+    def __run(self) -> None:
+        """Collects batches from the queue and writes them until the sink is stopped."""
+        stopped = False
+        while not stopped:
+            batch: List[bytes] = []
+            deadline = time() + self.__flush_interval
+            while len(batch) < self.__batch_size:
+                try:
+                    item = self.__queue.get(timeout=max(deadline - time(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopped = True
+                    break
+                batch.append(self.serialize(*item))
+
+            if len(batch) == 0:
+                continue
+            try:
+                self.__output.write(b"".join(batch))
+            except OSError as e:
+                logging.error(f"Unable to write {len(batch)} events of the event sink: {e}")
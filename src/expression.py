@@ -0,0 +1,107 @@
+import ast
+import operator
+import re
+from typing import Any, Callable, Dict, Mapping, Optional, Set, Tuple
+
+# Evaluator of a compiled expression node. Receives the attributes of the filtered event and a function that
+# returns the current value of a referenced metric.
+Evaluator = Callable[[Mapping[str, Any], Callable[[str], float]], float]
+
+_FIELD_REGEX = re.compile(r"\$([A-Za-z0-9_]+)")
+_FIELD_PREFIX = "__field_"
+
+_BINARY_OPERATORS: Dict[type, Callable[[float, float], float]] = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+
+_UNARY_OPERATORS: Dict[type, Callable[[float], float]] = {
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+
+# Supported functions with their minimum and maximum number of arguments, None if unbounded
+_FUNCTIONS: Dict[str, Tuple[Callable[..., float], int, Optional[int]]] = {
+    "min": (min, 2, None),
+    "max": (max, 2, None),
+    "abs": (abs, 1, 1),
+}
+
+
+class Expression():
+    """Arithmetic expression that is compiled once into a tree of closures.
+    Attributes of the filtered event are referenced with a '$', e.g. "$Report0CumulativeLost".
+    Any other name references the value of another metric, e.g. "answered_calls / dialed_calls"."""
+
+    def __init__(self, source: str) -> None:
+        self.source: str = source
+        self.field_names: Set[str] = set()
+        self.metric_names: Set[str] = set()
+
+        try:
+            tree = ast.parse(_FIELD_REGEX.sub(rf"{_FIELD_PREFIX}\1", source), mode="eval")
+        except SyntaxError as e:
+            raise Exception(f"Invalid expression '{source}': {e.msg}")
+
+        self.__evaluator: Evaluator = self.__compile(tree.body)
+
+    def __compile(self, node: ast.AST) -> Evaluator:
+        """Compiles the given syntax tree node into an evaluator.
+        Only numbers, references and the supported operators and functions are allowed."""
+        if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+            constant = float(node.value)
+            return lambda fields, metric: constant
+
+        if isinstance(node, ast.Name):
+            if node.id.startswith(_FIELD_PREFIX):
+                field_name = node.id[len(_FIELD_PREFIX):]
+                self.field_names.add(field_name)
+                return lambda fields, metric: float(fields[field_name])
+
+            metric_name = node.id
+            self.metric_names.add(metric_name)
+            return lambda fields, metric: metric(metric_name)
+
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPERATORS:
+            binary_operator = _BINARY_OPERATORS[type(node.op)]
+            left = self.__compile(node.left)
+            right = self.__compile(node.right)
+            return lambda fields, metric: binary_operator(left(fields, metric), right(fields, metric))
+
+        if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPERATORS:
+            unary_operator = _UNARY_OPERATORS[type(node.op)]
+            operand = self.__compile(node.operand)
+            return lambda fields, metric: unary_operator(operand(fields, metric))
+
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in _FUNCTIONS
+                and len(node.keywords) == 0):
+            function, min_args, max_args = _FUNCTIONS[node.func.id]
+            if len(node.args) < min_args or (max_args is not None and len(node.args) > max_args):
+                expected = str(min_args) if min_args == max_args else f"at least {min_args}"
+                raise Exception(f"Invalid expression '{self.source}': {node.func.id}() takes {expected} "
+                                f"argument{'s' if min_args > 1 else ''}, but got {len(node.args)}")
+            args = [self.__compile(arg) for arg in node.args]
+            if len(args) == 1:
+                arg = args[0]
+                return lambda fields, metric: function(arg(fields, metric))
+            return lambda fields, metric: function(*(arg(fields, metric) for arg in args))
+
+        raise Exception(f"Invalid expression '{self.source}': unsupported syntax '{ast.unparse(node)}'")
+
+    def evaluate(self, fields: Mapping[str, Any], metric: Callable[[str], float]) -> float:
+        """Evaluates the expression.
+
+        :param fields: Attributes of the filtered event, used to resolve references beginning with a '$'.
+        :param metric: Function returning the current value of the metric with the given name.
+        :return: The evaluated value. Raises a KeyError if an attribute does not exist, a ValueError if an attribute
+                 can not be converted to a float or the result is not a real number, e.g. a negative base raised
+                 to a fractional power, a ZeroDivisionError on a division by zero and an OverflowError if a power
+                 exceeds the range of a float."""
+        value = self.__evaluator(fields, metric)
+        if not isinstance(value, (int, float)):
+            raise ValueError(f"Result {value} is not a real number")
+        return value
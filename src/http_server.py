@@ -0,0 +1,258 @@
+import asyncio
+import gzip
+import logging
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Union
+from urllib.parse import parse_qs, urlsplit
+from prometheus_client import REGISTRY, CollectorRegistry
+from prometheus_client.exposition import choose_encoder, gzip_accepted
+
+
+@dataclass
+class HTTPRequest():
+    method: str
+    path: str
+    version: str
+    headers: Dict[str, str] = field(default_factory=dict)
+    params: Dict[str, List[str]] = field(default_factory=dict)
+
+
+@dataclass
+class HTTPResponse():
+    status: str
+    body: bytes
+    headers: List[Tuple[str, str]] = field(default_factory=list)
+
+
+# Handler of a route, either answering the request directly or as coroutine, e.g. if the answer takes a while
+RouteHandler = Callable[[HTTPRequest], Union[HTTPResponse, Awaitable[HTTPResponse]]]
+
+
+class MetricsServer():
+    """Asyncio based HTTP server exposing the metrics of a registry.
+    Connections are kept alive between requests, the metrics are rendered in a thread pool with a limited number
+    of concurrent scrapes and compressed with gzip if the client accepts it. Concurrent scrapes share a rendering
+    that is already in progress.
+    Besides the metrics, the server provides the /healthz and /ready endpoints."""
+
+    # Maximum number of headers accepted per request
+    max_header_count: int = 100
+
+    def __init__(self,
+                 port: int,
+                 registry: CollectorRegistry = REGISTRY,
+                 address: str = "0.0.0.0",
+                 is_ready: Callable[[], bool] = lambda: True,
+                 max_concurrent_scrapes: int = 2,
+                 request_timeout: float = 10,
+                 keep_alive_timeout: float = 60,
+                 gzip_enabled: bool = True) -> None:
+        self.__port: int = port
+        self.__address: str = address
+        self.__registry: CollectorRegistry = registry
+        self.__is_ready: Callable[[], bool] = is_ready
+        self.__max_concurrent_scrapes: int = max_concurrent_scrapes
+        self.__request_timeout: float = request_timeout
+        self.__keep_alive_timeout: float = keep_alive_timeout
+        self.__gzip_enabled: bool = gzip_enabled
+
+        self.__server: Optional[asyncio.Server] = None
+        # Open connections and the tasks answering their requests
+        self.__connections: Dict[asyncio.StreamWriter, asyncio.Task[None]] = {}
+        self.__scrape_semaphore: Optional[asyncio.Semaphore] = None
+        self.__renders_in_progress: Dict[Tuple[str, bool, Tuple[str, ...]], asyncio.Future[HTTPResponse]] = {}
+        self.__routes: Dict[str, RouteHandler] = {
+            "/healthz": self.__handle_healthz,
+            "/ready": self.__handle_ready,
+        }
+
+    def add_route(self, path: str, handler: RouteHandler) -> None:
+        """Adds a handler for the given path. Requests to any other path are answered with the metrics.
+        Handlers returning a coroutine are awaited, so they must not block the event loop."""
+        self.__routes[path] = handler
+
+    def get_port(self) -> int:
+        """Returns the port the server is listening on."""
+        if self.__server is None:
+            return self.__port
+        return self.__server.sockets[0].getsockname()[1]
+
+    async def start(self) -> None:
+        """Starts listening on the configured port."""
+        self.__scrape_semaphore = asyncio.Semaphore(self.__max_concurrent_scrapes)
+        self.__server = await asyncio.start_server(self.__handle_connection, self.__address, self.__port)
+
+    async def stop(self) -> None:
+        """Stops listening, closes the open connections and closes the server."""
+        if self.__server is None:
+            return
+        self.__server.close()
+        # Idle keep-alive connections would otherwise keep the server open until they time out
+        connections = dict(self.__connections)
+        for writer in connections:
+            writer.close()
+        await asyncio.gather(*connections.values(), return_exceptions=True)
+        await self.__server.wait_closed()
+        self.__server = None
+
+    async def __read_request(self, reader: asyncio.StreamReader) -> Optional[HTTPRequest]:
+        """Reads the request line and the headers of the next request.
+
+        :return: The request or None if the connection was closed by the client."""
+        request_line = await asyncio.wait_for(reader.readline(), self.__keep_alive_timeout)
+        if not request_line:
+            return None
+
+        parts = request_line.decode("latin-1").split()
+        if len(parts) != 3:
+            raise ValueError(f"Invalid request line: {request_line!r}")
+        method, target, version = parts
+
+        headers: Dict[str, str] = {}
+        async with asyncio.timeout(self.__request_timeout):
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return None
+                if line in (b"\r\n", b"\n"):
+                    break
+                if len(headers) >= self.max_header_count:
+                    raise ValueError("Too many headers")
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            # Requests to the exporter have no body, but it has to be consumed to keep the connection usable
+            content_length = int(headers.get("content-length", "0"))
+            if content_length > 0:
+                await reader.readexactly(content_length)
+
+        url = urlsplit(target)
+        return HTTPRequest(method, url.path, version, headers, parse_qs(url.query))
+
+    @staticmethod
+    def __is_keep_alive(request: HTTPRequest) -> bool:
+        """Checks whether the connection is kept alive after the request, based on the HTTP version
+        and the Connection header."""
+        connection = request.headers.get("connection", "").lower()
+        if request.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+    def __handle_healthz(self, request: HTTPRequest) -> HTTPResponse:
+        """Liveness endpoint, answered as long as the exporter is running."""
+        return HTTPResponse("200 OK", b"OK\n", [("Content-Type", "text/plain; charset=utf-8")])
+
+    def __handle_ready(self, request: HTTPRequest) -> HTTPResponse:
+        """Readiness endpoint, answered successfully if the exporter is logged in to the AMI."""
+        if self.__is_ready():
+            return HTTPResponse("200 OK", b"OK\n", [("Content-Type", "text/plain; charset=utf-8")])
+        return HTTPResponse("503 Service Unavailable", b"Not ready\n", [("Content-Type", "text/plain; charset=utf-8")])
+
+    def __render_metrics(self, request: HTTPRequest) -> HTTPResponse:
+        """Renders the metrics of the registry. Executed in the thread pool."""
+        encoder, content_type = choose_encoder(request.headers.get("accept", ""))
+        registry = self.__registry
+        if "name[]" in request.params:
+            registry = registry.restricted_registry(request.params["name[]"])
+
+        output = encoder(registry)
+        headers = [("Content-Type", content_type)]
+        if self.__gzip_enabled and gzip_accepted(request.headers.get("accept-encoding", "")):
+            output = gzip.compress(output, compresslevel=6)
+            headers.append(("Content-Encoding", "gzip"))
+        return HTTPResponse("200 OK", output, headers)
+
+    async def __render_metrics_limited(self, request: HTTPRequest) -> HTTPResponse:
+        """Renders the metrics, waiting for a free slot if the maximum number of concurrent scrapes is reached."""
+        if self.__scrape_semaphore is None:
+            raise Exception("Server is not started")
+
+        async with self.__scrape_semaphore:
+            return await asyncio.get_running_loop().run_in_executor(None, self.__render_metrics, request)
+
+    async def __handle_metrics(self, request: HTTPRequest) -> HTTPResponse:
+        """Renders the metrics. Scrapes arriving while metrics with the same format are rendered
+        share the result of that rendering instead of rendering the metrics again."""
+        key = (
+            choose_encoder(request.headers.get("accept", ""))[1],
+            self.__gzip_enabled and gzip_accepted(request.headers.get("accept-encoding", "")),
+            tuple(request.params.get("name[]", [])))
+
+        if key in self.__renders_in_progress:
+            return await asyncio.shield(self.__renders_in_progress[key])
+
+        render = asyncio.ensure_future(self.__render_metrics_limited(request))
+        self.__renders_in_progress[key] = render
+        try:
+            return await asyncio.shield(render)
+        finally:
+            if self.__renders_in_progress.get(key) is render:
+                del self.__renders_in_progress[key]
+
+    async def __handle_request(self, request: HTTPRequest) -> HTTPResponse:
+        """Answers the given request."""
+        if request.method not in ("GET", "HEAD"):
+            return HTTPResponse("405 Method Not Allowed", b"", [("Allow", "GET, HEAD")])
+
+        if request.path in self.__routes:
+            response = self.__routes[request.path](request)
+            if isinstance(response, HTTPResponse):
+                return response
+            return await response
+        if request.path == "/favicon.ico":
+            return HTTPResponse("404 Not Found", b"")
+
+        try:
+            return await asyncio.wait_for(self.__handle_metrics(request), self.__request_timeout)
+        except TimeoutError:
+            logging.error(f"Unable to render metrics: reached request timeout of {self.__request_timeout}s")
+            return HTTPResponse("503 Service Unavailable", b"Request timeout\n")
+
+    @staticmethod
+    def __serialize_response(request: HTTPRequest, response: HTTPResponse, keep_alive: bool) -> bytes:
+        """Serializes the response, including the headers describing the body and the connection."""
+        head = f"HTTP/1.1 {response.status}\r\n"
+        for name, value in response.headers:
+            head += f"{name}: {value}\r\n"
+        head += f"Content-Length: {len(response.body)}\r\n"
+        head += f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+
+        if request.method == "HEAD":
+            return head.encode("latin-1")
+        return head.encode("latin-1") + response.body
+
+    async def __handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Answers the requests of a connection until the connection is closed or times out."""
+        task = asyncio.current_task()
+        if task is not None:
+            self.__connections[writer] = task
+        try:
+            while True:
+                try:
+                    request = await self.__read_request(reader)
+                except (TimeoutError, ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    break
+                if request is None:
+                    break
+
+                keep_alive = self.__is_keep_alive(request)
+                try:
+                    response = await self.__handle_request(request)
+                except Exception:
+                    # E.g. a failing collector or debug handler, the connection is still answered
+                    logging.exception(f"Unable to answer request for '{request.path}'")
+                    response = HTTPResponse("500 Internal Server Error", b"Internal Server Error\n")
+                writer.write(self.__serialize_response(request, response, keep_alive))
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self.__connections.pop(writer, None)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
@@ -0,0 +1,115 @@
+import json
+import logging
+import queue
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from time import monotonic
+from typing import Any, Dict, Tuple
+
+
+class RateLimitFilter(logging.Filter):
+    """Limits the number of warnings and errors logged per call site, i.e. per message key, to rate_limit records
+    per interval, so an error raised at the rate of the events does not flood the log. The number of suppressed
+    records is appended to the next record of the call site that is logged. Records below the given level, e.g.
+    debug records that are enabled on purpose, are not limited. A rate_limit of 0 disables the limit."""
+
+    def __init__(self, rate_limit: int, interval: float = 60, level: int = logging.WARNING) -> None:
+        super().__init__()
+        self.__rate_limit: int = rate_limit
+        self.__interval: float = interval
+        self.__level: int = level
+        # Start of the current interval, number of logged and number of suppressed records by call site
+        self.__windows: Dict[Tuple[str, int], Tuple[float, int, int]] = {}
+        self.__lock: threading.Lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.__rate_limit <= 0 or record.levelno < self.__level:
+            return True
+
+        key = (record.pathname, record.lineno)
+        now = monotonic()
+        with self.__lock:
+            start, logged, suppressed = self.__windows.get(key, (now, 0, 0))
+            if now >= start + self.__interval:
+                start, logged = now, 0
+            if logged >= self.__rate_limit:
+                self.__windows[key] = (start, logged, suppressed + 1)
+                return False
+            self.__windows[key] = (start, logged + 1, 0)
+
+        if suppressed > 0:
+            record.msg = f"{record.getMessage()} (suppressed {suppressed} similar messages)"
+            record.args = None
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats the records as JSON objects, one per line, e.g. to ship them to a log pipeline."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data: Dict[str, Any] = {
+            "timestamp": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """Puts the records into a queue without formatting them. The records are formatted and written by the
+    thread of a QueueListener, so logging never blocks the event thread on the output and records dropped by a
+    filter are never formatted, including their traceback."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Records are dropped rather than blocking the caller
+            pass
+
+
+class DeferredQueueListener(QueueListener):
+    """Writes the records of a DeferredQueueHandler. Stopping waits for a free slot in a full queue."""
+
+    def enqueue_sentinel(self) -> None:
+        self.queue.put(self._sentinel)  # type: ignore
+
+
+def setup_logging(level: str,
+                  log_format: str = "text",
+                  rate_limit: int = 0,
+                  rate_limit_interval: float = 60,
+                  queue_size: int = 10000) -> QueueListener:
+    """Replaces the handlers of the root logger by a queue handler, whose records are written to the standard error
+    by the returned listener. The listener is started and has to be stopped to write the remaining records.
+
+    :param str level: The log level of the root logger.
+    :param str log_format: "text" or "json".
+    :param int rate_limit: Maximum number of warnings and errors per call site and interval, 0 disables the limit."""
+    stream_handler = logging.StreamHandler(sys.stderr)
+    if log_format == "json":
+        stream_handler.setFormatter(JSONFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+
+    log_queue: queue.Queue[logging.LogRecord] = queue.Queue(queue_size)
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(rate_limit, rate_limit_interval))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = DeferredQueueListener(log_queue, stream_handler)
+    listener.start()
+    return listener
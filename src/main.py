@@ -1,11 +1,16 @@
 import asyncio
 import argparse
 import logging
-from time import sleep
+from typing import List
 from client_wrapper import ClientWrapper
-from prometheus_client import start_http_server, Info
+from prometheus_client import Info
 import config
-from action import ActionExecuter
+from action import ActionExecuter, ActionScheduler
+from http_server import MetricsServer
+from log_handler import setup_logging
+from profiling import DebugEndpoints
+from push import Pusher
+from snapshot import MetricSnapshot
 from version import __version__
 
 
@@ -24,9 +29,15 @@ def __shutdown(ami_client: ClientWrapper) -> None:
 
 
 def __reconnect(ami_client: ClientWrapper) -> None:
-    """Disconnects the AMIClient and logs back in again."""
+    """Disconnects the AMIClient and logs back in again.
+    Every action is executed again afterwards, since tracked events may have been lost while disconnected,
+    and the entities of the actions are discovered again."""
     ami_client.disconnect()
     __login(ami_client)
+    for action in config.scrape_config.action_list:
+        action.last_execution = 0
+        if action.discovery is not None:
+            action.discovery.last_refresh = 0
 
 
 def __restart_event_thread(ami_client: ClientWrapper) -> None:
@@ -46,29 +57,40 @@ def __init_version_metric() -> None:
     i.info({'version': __version__})
 
 
-def __scrape(client: ClientWrapper):
-    """Main loop to execute the loaded actions."""
-    action_executer = ActionExecuter(client)
-    try:
-        while True:
-            logging.debug("Starting scrape process")
+def __scrape_once(client_list: List[ClientWrapper], action_scheduler: ActionScheduler) -> None:
+    """Executes a single scrape process. Blocks until every action has been executed."""
+    logging.debug("Starting scrape process")
 
-            logging.debug("Checking health")
-            if not client.check_event_thread_health():
-                __restart_event_thread(client)
-            if not client.check_ami_connection_health():
-                __restart_connection(client)
+    logging.debug("Checking health")
+    for client in client_list:
+        if not client.check_event_thread_health():
+            __restart_event_thread(client)
+        if not client.check_ami_connection_health():
+            __restart_connection(client)
 
-            for action in config.scrape_config.action_list:
-                action_executer.exec(action)
+    action_scheduler.exec(config.scrape_config.action_list)
 
-            logging.debug("Finished scrape process")
-            logging.debug(f"Next scrape in: {config.scrape_config.interval}s")
+    # Signal the end of the scrape process to the runtime event filters, e.g. to evaluate computed metrics.
+    for filter in config.filter_config.filter_list:
+        filter.on_scrape_end()
+
+    logging.debug("Finished scrape process")
+
+
+async def __scrape(client_list: List[ClientWrapper], action_client: ClientWrapper) -> None:
+    """Main loop to execute the loaded actions via the action client. The scrape processes are executed in a thread,
+    so the HTTP server running on the event loop is not blocked."""
+    action_scheduler = ActionScheduler(ActionExecuter(action_client), config.scrape_config.rate_limiter)
+    try:
+        while True:
+            await asyncio.to_thread(__scrape_once, client_list, action_scheduler)
 
-            sleep(config.scrape_config.interval)
+            logging.debug(f"Next scrape in: {config.scrape_config.interval}s")
+            await asyncio.sleep(config.scrape_config.interval)
 
-    except (KeyboardInterrupt, SystemExit):
-        __shutdown(client)
+    except (KeyboardInterrupt, SystemExit, asyncio.CancelledError):
+        for client in client_list:
+            __shutdown(client)
 
 
 def __parse_args():
@@ -91,13 +113,47 @@ async def __main() -> None:
     args = __parse_args()
 
     config.load_from_file(args.config)
+    log_listener = setup_logging(
+        config.general_config.log_level,
+        config.general_config.log_format,
+        config.general_config.log_rate_limit,
+        config.general_config.log_rate_limit_interval)
     logging.info(f"Loaded configuration file: '{args.config}'")
 
+    # Let Asterisk only send the events that are processed by the exporter if configured.
+    event_names = None
+    if config.ami_client_config.server_side_event_filter:
+        event_names = config.get_required_event_names(
+            include_actions=not config.ami_client_config.separate_action_connection)
+
     ami_client = ClientWrapper(
         config.ami_client_config.ip,
         config.ami_client_config.port,
         config.general_config.response_timeout,
-        config.general_config.ping_timeout)
+        config.general_config.ping_timeout,
+        event_names=event_names)
+
+    # The actions are executed via a second session if configured. As its event mask is turned off,
+    # the responses of the actions do not queue behind the events received by the first session.
+    action_client = ami_client
+    if config.ami_client_config.separate_action_connection:
+        action_client = ClientWrapper(
+            config.ami_client_config.ip,
+            config.ami_client_config.port,
+            config.general_config.response_timeout,
+            config.general_config.ping_timeout,
+            event_mask="off")
+    client_list = list(dict.fromkeys([ami_client, action_client]))
+
+    # Restore the persisted values before they are exposed and changed by any event.
+    snapshot = None
+    if config.snapshot_config.is_enabled():
+        snapshot = MetricSnapshot(
+            config.snapshot_config.path,
+            config.get_loaded_metrics(),
+            config.snapshot_config.interval)
+        snapshot.restore()
+        snapshot.start()
 
     logging.debug("Attaching runtime event filters")
 
@@ -106,11 +162,59 @@ async def __main() -> None:
     # These filters are attached to the client until the exporter is stopped.
     ami_client.add_event_filter(config.filter_config.filter_list)
 
-    __login(ami_client)
-    start_http_server(args.port)
+    # Attach the event filters of the channel tracker. Its index is resynced by an action added to the scrape actions.
+    ami_client.add_event_filter(config.channel_tracker_config.filter_list)
+
+    # Attach the event filters of the event sinks, which write their events in their own threads.
+    for sink in config.sink_config.sink_list:
+        sink.start()
+    ami_client.add_event_filter(config.sink_config.filter_list)
+
+    # Attach the event filters that keep the metrics of resynced actions up to date.
+    for action in config.scrape_config.action_list:
+        ami_client.add_event_filter(action.track_filter_list)
+
+    server = MetricsServer(
+        args.port,
+        is_ready=lambda: all(client.is_ready() for client in client_list),
+        max_concurrent_scrapes=config.http_server_config.max_concurrent_scrapes,
+        request_timeout=config.http_server_config.request_timeout,
+        keep_alive_timeout=config.http_server_config.keep_alive_timeout,
+        gzip_enabled=config.http_server_config.gzip)
+    if config.http_server_config.debug_endpoints:
+        DebugEndpoints(config.get_loaded_event_filters()).add_routes(server)
+        logging.warning("Enabled the debug endpoints /debug/profile, /debug/memory and /debug/cpu")
+    await server.start()
     logging.info(f"Started server on port {args.port}")
     __init_version_metric()
-    __scrape(ami_client)
+
+    pusher = None
+    if config.push_config.is_enabled():
+        pusher = Pusher(
+            config.push_config.mode,
+            config.push_config.url,
+            job=config.push_config.job,
+            grouping_key=config.push_config.grouping_key,
+            flush_interval=config.push_config.flush_interval,
+            queue_size=config.push_config.queue_size,
+            max_retries=config.push_config.max_retries,
+            retry_backoff=config.push_config.retry_backoff,
+            max_backoff=config.push_config.max_backoff,
+            timeout=config.push_config.timeout)
+        pusher.start()
+        logging.info(f"Pushing metrics to '{config.push_config.url}' every {config.push_config.flush_interval}s")
+
+    for client in client_list:
+        await asyncio.to_thread(__login, client)
+    await __scrape(client_list, action_client)
+    if pusher is not None:
+        pusher.stop()
+    for sink in config.sink_config.sink_list:
+        sink.stop()
+    if snapshot is not None:
+        snapshot.stop()
+    await server.stop()
+    log_listener.stop()
 
 
 if __name__ == "__main__":
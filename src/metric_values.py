@@ -1,24 +1,114 @@
-from typing import List, Dict, Optional, Sequence
+from typing import Callable, Iterable, List, Dict, Optional, Sequence, Set, Tuple, Pattern
 from asterisk.ami import Event
-from prometheus_client import Counter, Gauge
+from prometheus_client import Counter, Gauge, REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.metrics_core import Metric
+from prometheus_client.registry import Collector
+from expression import Expression
+from time import monotonic, time
+import collections
 import logging
+import re
+
+
+# Values of event attributes that are most common, pre-converted so they do not have to be parsed
+_SMALL_INTEGERS: Dict[str, float] = {str(number): float(number) for number in range(-1, 1024)}
+
+_conversion_errors = Counter(
+    "metric_value_conversion_errors",
+    "Number of evaluated values that could not be converted to a number, by metric",
+    ["metric"])
+
+
+class LabelMapping():
+    """Maps evaluated label values to a bucket, e.g. the user agent "Zoiper rv2.10.20.2" to the family "zoiper".
+    This reduces the number of series created for a metric."""
+
+    # Maximum number of mapped values that are cached
+    max_cache_size: int = 10000
+
+    def __init__(self, rules: List[Tuple[str, str]], default: Optional[str]) -> None:
+        self.__rules: List[Tuple[Pattern[str], str]] = [(re.compile(pattern), value) for pattern, value in rules]
+        self.__default: Optional[str] = default
+
+        self.__cache: Dict[str, str] = {}
+
+    def map(self, value: str) -> str:
+        """Maps the given value using the first rule whose regex matches the beginning of the value.
+        Groups of the regex can be referenced in the mapped value, e.g. "\\1".
+
+        :return: The mapped value. If no rule matches, the default value or, if not set, the value itself
+                 is returned."""
+        if value in self.__cache:
+            return self.__cache[value]
+
+        result = value if self.__default is None else self.__default
+        for pattern, mapped_value in self.__rules:
+            match = pattern.match(value)
+            if match is not None:
+                result = match.expand(mapped_value)
+                break
+
+        if len(self.__cache) >= self.max_cache_size:
+            self.__cache.clear()
+        self.__cache[value] = result
+        return result
 
 
 class MetricValue():
     """Parent class for any wrapper of a Prometheus metric type."""
 
+    # Minimum seconds between two logged conversion errors of a metric, so a misconfigured value does not flood
+    # the log at the rate of the events. Every error is counted in metric_value_conversion_errors_total.
+    conversion_error_log_interval: float = 60
+
+    # Whether the events collected by an action are passed to the metric at once via process_events at the end
+    # of the action. Metrics whose values depend on the order in which the metrics of a filter process an event,
+    # e.g. computed metrics referencing other metrics, process every event on its own. So do metrics referenced
+    # by computed metrics, see disable_batch_processing.
+    supports_batch_processing: bool = False
+    # Whether the values collected by an action are staged and discarded by on_scrape_abort. Metrics that are not
+    # staged, e.g. counters, apply every event of an action, also if the action does not complete.
+    stages_values: bool = False
+
     def __init__(self, metric_name: str, metric_description: str,
                  metric_labels: Dict[str, str]) -> None:
         self._metric_name = metric_name
         self._metric_description = metric_description
         self._metric_labels = metric_labels
         self._metric_label_names: List[str] = list(metric_labels)
+        self._metric_label_mappings: Dict[str, LabelMapping] = {}
+
+        # Evaluators of the numeric values of the metric, compiled once per value
+        self.__number_evaluators: Dict[str, Callable[[Event], float]] = {}
+        self.__conversion_error_count: int = 0
+        self.__conversion_error_log_time: float = float("-inf")
+
+    def add_label_mapping(self, label_name: str, mapping: LabelMapping) -> None:
+        """Adds a mapping that is applied to the evaluated value of the given label."""
+        self._metric_label_mappings[label_name] = mapping
 
     def init(self) -> None:
         """Function implemented by the child classes, used to initialize the Prometheus metric.
         This function may only be called once per metric. Otherwise an exception is thrown."""
         ...
 
+    def share_series(self, owner: "MetricValue") -> None:
+        """Function implemented by the child classes, used to feed the series of an already initialized definition
+        of the same metric instead of initializing an own Prometheus metric. See MetricRegistry."""
+        raise Exception(f"Metric '{self._metric_name}' is already defined and can not be shared")
+
+    def disable_batch_processing(self) -> None:
+        """Processes every event on its own instead of in batches, e.g. because a computed metric in another filter
+        references the value of the metric and has to read it up to date after every event."""
+        self.supports_batch_processing = False
+
+    def expose_timestamps(self) -> None:
+        """Function implemented by the child classes, used to expose the values collected by an action with the
+        time of their collection instead of the time Prometheus scrapes them. Metrics that can not carry a timestamp
+        ignore it."""
+        ...
+
     def on_scrape_start(self) -> None:
         """Function implemented by the child classes, used to send a signal to the metrics that they can
         reset values if necessary."""
@@ -29,6 +119,12 @@ class MetricValue():
         update the metric values."""
         ...
 
+    def on_scrape_abort(self) -> None:
+        """Function implemented by the child classes, used to send a signal to the metrics that the scrape process
+        did not complete, e.g. because the event timeout of the action was reached. Values staged since
+        on_scrape_start should be discarded."""
+        ...
+
     def process_event(self, event: Event):
         """Function implemented by the child classes, used to process the given event and extract the
         expected values.
@@ -36,6 +132,37 @@ class MetricValue():
         :param Event event: The event to process"""
         ...
 
+    def process_events(self, events: List[Event]) -> None:
+        """Processes the given events at once, e.g. the events collected by an action. Child classes may
+        implement it faster than processing every event on its own.
+
+        :param events: The events to process, in the order they were received."""
+        for event in events:
+            self.process_event(event)
+
+    def get_value(self, key: Sequence[str]) -> float:
+        """Function implemented by the child classes, used to get the current value of the metric.
+
+        :param key: The label values of the metric, in the order of the label names.
+        :return: The current value. 0 is returned if no value exists for the given label values."""
+        return 0
+
+    def get_label_keys(self) -> List[Sequence[str]]:
+        """Function implemented by the child classes, used to get the label values of every existing value."""
+        return []
+
+    def get_published_values(self) -> Dict[Sequence[str], float]:
+        """Returns the values exposed to Prometheus by their label values. Metrics that stage their values during
+        an action return the values of the last completed action instead of the staged ones."""
+        return {key: self.get_value(key) for key in self.get_label_keys()}
+
+    def restore_value(self, key: Sequence[str], value: float) -> None:
+        """Function implemented by the child classes, used to restore a value persisted before a restart.
+
+        :param key: The label values of the metric, in the order of the label names.
+        :param value: The persisted value."""
+        ...
+
     def _eval_value(self, event: Event, value: str) -> str:
         """Evaluates a specific value. If the value begins with a '$', the value is looked up in the given event.
 
@@ -49,8 +176,8 @@ class MetricValue():
             key = value[1:]
             if key not in event.keys:
                 logging.error(
-                    f"Unable to eval reference: Attribute '{key}' does not exist in event "
-                    f"with name '{event.name}'")
+                    "Unable to eval reference: Attribute '%s' does not exist in event with name '%s'",
+                    key, event.name)
                 return value
             return str(event.keys[value[1:]])  # type: ignore
 
@@ -63,17 +190,106 @@ class MetricValue():
         :param Event event: The event in which the values are looked up.
         :return: Dict of the evaluated labels. If the label value begins with a "$", the searched value of the
                  specified event is used.
-                 Otherwise, the value itself is used."""
+                 Otherwise, the value itself is used. Label mappings are applied to the evaluated values."""
         result: Dict[str, str] = {}
         for key in self._metric_labels:
-            value = self._metric_labels[key]
-            result[key] = self._eval_value(event, value)
+            value = self._eval_value(event, self._metric_labels[key])
+            if key in self._metric_label_mappings:
+                value = self._metric_label_mappings[key].map(value)
+            result[key] = value
         return result
 
+    def _convert_number(self, value: str) -> float:
+        """Converts the given value to a float. Errors are counted and logged at most once per
+        conversion_error_log_interval. If an error occurred, 0 is returned."""
+        number = _SMALL_INTEGERS.get(value, None)
+        if number is not None:
+            return number
+        try:
+            return float(value)
+        except ValueError:
+            pass
+
+        _conversion_errors.labels(self._metric_name).inc()
+        self.__conversion_error_count += 1
+        if monotonic() >= self.__conversion_error_log_time + self.conversion_error_log_interval:
+            self.__conversion_error_log_time = monotonic()
+            logging.error(
+                f"metric_name: {self._metric_name}: Unable to convert value {value} to a type of float "
+                f"({self.__conversion_error_count} errors since the last message)")
+            self.__conversion_error_count = 0
+        return 0
+
+    def __compile_number(self, value: str) -> Callable[[Event], float]:
+        """Compiles an evaluator of the given value, which returns the value as number for an event.
+        Constant values are converted once, referenced attributes are looked up and converted per event."""
+        if len(value) == 0 or value[0] != "$":
+            number = self._convert_number(value)
+            return lambda event: number
+
+        attribute_name = value[1:]
+
+        def evaluate(event: Event) -> float:
+            attribute = event.keys.get(attribute_name, None)
+            if attribute is None:
+                return self._convert_number(self._eval_value(event, value))
+            return self._convert_number(attribute)
+        return evaluate
+
+    def _compile_number(self, value: Optional[str]) -> None:
+        """Compiles the evaluator of the given value in advance, e.g. when the metric is loaded, so errors of
+        constant values are reported at startup."""
+        if value is not None and value not in self.__number_evaluators:
+            self.__number_evaluators[value] = self.__compile_number(value)
+
+    def _eval_number(self, event: Event, value: str) -> float:
+        """Evaluates a specific value like _eval_value and converts it to a number, using the compiled evaluator
+        of the value."""
+        evaluator = self.__number_evaluators.get(value, None)
+        if evaluator is None:
+            evaluator = self.__compile_number(value)
+            self.__number_evaluators[value] = evaluator
+        return evaluator(event)
+
+    def _eval_column(self, events: List[Event], value: str) -> List[str]:
+        """Evaluates a specific value for each of the given events, like _eval_value. The referenced attribute
+        is looked up once per event instead of evaluating the value again for every event."""
+        if len(value) == 0 or value[0] != "$":
+            return [value] * len(events)
+
+        attribute_name = value[1:]
+        column: List[str] = []
+        for event in events:
+            attribute = event.keys.get(attribute_name, None)
+            column.append(self._eval_value(event, value) if attribute is None else str(attribute))
+        return column
+
+    def _eval_numbers(self, events: List[Event], value: str) -> List[float]:
+        """Evaluates a specific value for each of the given events and converts it to a number."""
+        self._compile_number(value)
+        evaluator = self.__number_evaluators[value]
+        return [evaluator(event) for event in events]
+
+    def _eval_keys(self, events: List[Event]) -> List[Sequence[str]]:
+        """Evaluates the label values of each of the given events, in the order of the label names.
+        The labels are evaluated column by column and the label mappings are applied."""
+        if len(self._metric_labels) == 0:
+            return [()] * len(events)
+
+        columns: List[List[str]] = []
+        for label_name in self._metric_label_names:
+            column = self._eval_column(events, self._metric_labels[label_name])
+            if label_name in self._metric_label_mappings:
+                column = [self._metric_label_mappings[label_name].map(value) for value in column]
+            columns.append(column)
+        return list(zip(*columns))
+
 
 class MetricValueCounter(MetricValue):
     """Wrapper above the Prometheus Counter metric type."""
 
+    supports_batch_processing: bool = True
+
     def __init__(self,
                  metric_name: str,
                  metric_description: str,
@@ -83,15 +299,11 @@ class MetricValueCounter(MetricValue):
 
         self.__counter: Optional[Counter] = None
         self.__increment_value: str = increment_value
+        self._compile_number(increment_value)
 
-    def __convert_value(self, value: str) -> float:
-        """Converts the given value to a float and logs any errors that occur. If an error occurred, 0 is returned."""
-        try:
-            return float(value)
-        except ValueError:
-            logging.error(
-                f"metric_name: {self._metric_name}: Unable to convert value {value} to a type of float")
-            return 0
+        self.__label_values: Dict[Sequence[str], float] = {}
+        # Definition owning the Prometheus Counter and the totals, another one if the series are shared
+        self.__owner: MetricValueCounter = self
 
     def init(self) -> None:
         """Initializes the Prometheus Counter metric."""
@@ -100,28 +312,132 @@ class MetricValueCounter(MetricValue):
             self._metric_description,
             self._metric_label_names)
 
+    def share_series(self, owner: MetricValue) -> None:
+        """Increments the counters of the given definition instead of initializing an own Prometheus Counter."""
+        if not isinstance(owner, MetricValueCounter):
+            raise Exception(f"Metric '{self._metric_name}' is already defined with a different type")
+        self.__owner = owner
+
     def process_event(self, event: Event) -> None:
         """Processes the given event and evaluates the expected metrics from it.
 
         :param Event event: The event from which the metrics are evaluated."""
-        if self.__counter is None:
+        owner = self.__owner
+        if owner.__counter is None:
             raise Exception("Metric is not initialized")
 
         if len(self._metric_labels) == 0:
-            self.__counter.inc(
-                self.__convert_value(
-                    self._eval_value(
-                        event,
-                        self.__increment_value)))
+            value = self._eval_number(event, self.__increment_value)
+            owner.__counter.inc(value)
+            owner.__label_values[()] = owner.__label_values.get((), 0) + value
             return
 
         labels = self._eval_labels(event)
-        self.__counter.labels(
-            **labels).inc(self.__convert_value(self._eval_value(event, self.__increment_value)))
+        value = self._eval_number(event, self.__increment_value)
+        owner.__counter.labels(
+            **labels).inc(value)
+        key = tuple(str(labels[label]) for label in self._metric_label_names)
+        owner.__label_values[key] = owner.__label_values.get(key, 0) + value
+
+    def process_events(self, events: List[Event]) -> None:
+        """Processes the given events at once. The increments are summed up by label values first,
+        so every counter is only incremented once.
+
+        :param events: The events from which the metrics are evaluated."""
+        owner = self.__owner
+        if owner.__counter is None:
+            raise Exception("Metric is not initialized")
+
+        totals: collections.Counter[Sequence[str]] = collections.Counter()
+        for key, value in zip(self._eval_keys(events),
+                              self._eval_numbers(events, self.__increment_value)):
+            totals[key] += value
+
+        for key, total in totals.items():
+            if len(self._metric_labels) == 0:
+                owner.__counter.inc(total)
+            else:
+                owner.__counter.labels(*key).inc(total)
+            owner.__label_values[key] = owner.__label_values.get(key, 0) + total
+
+    def get_value(self, key: Sequence[str]) -> float:
+        """Returns the total of the counter with the given label values."""
+        return self.__owner.__label_values.get(key, 0)
+
+    def get_label_keys(self) -> List[Sequence[str]]:
+        """Returns the label values of every counter that has been incremented."""
+        return list(self.__owner.__label_values)
+
+    def restore_value(self, key: Sequence[str], value: float) -> None:
+        """Increments the counter with the given label values by the persisted total."""
+        owner = self.__owner
+        if owner.__counter is None:
+            raise Exception("Metric is not initialized")
+
+        if len(self._metric_labels) == 0:
+            owner.__counter.inc(value)
+        else:
+            owner.__counter.labels(*key).inc(value)
+        owner.__label_values[key] = owner.__label_values.get(key, 0) + value
+
+
+class GaugeCollector(Collector):
+    """Prometheus collector exposing the values returned by the given function as a gauge.
+    The values are read when the metrics are collected, so they do not have to be copied into a Prometheus Gauge
+    whenever they change. If get_timestamp is set and returns a timestamp, every value is exposed with it."""
+
+    def __init__(self,
+                 name: str,
+                 documentation: str,
+                 label_names: List[str],
+                 get_values: Callable[[], Dict[Sequence[str], float]],
+                 get_timestamp: Optional[Callable[[], Optional[float]]] = None) -> None:
+        self.__name: str = name
+        self.__documentation: str = documentation
+        self.__label_names: List[str] = label_names
+        self.__get_values: Callable[[], Dict[Sequence[str], float]] = get_values
+        self.__get_timestamp: Optional[Callable[[], Optional[float]]] = get_timestamp
+
+    def describe(self) -> Iterable[Metric]:
+        """Describes the gauge, used by the registry to detect duplicate metric names."""
+        return [GaugeMetricFamily(self.__name, self.__documentation, labels=self.__label_names)]
+
+    def collect(self) -> Iterable[Metric]:
+        """Collects the current values of the gauge."""
+        family = GaugeMetricFamily(self.__name, self.__documentation, labels=self.__label_names)
+        timestamp = None if self.__get_timestamp is None else self.__get_timestamp()
+        # The items are copied at once, since the values may be changed by the event thread while collecting
+        for key, value in list(self.__get_values().items()):
+            family.add_metric(list(key), value, timestamp)
+        return [family]
 
 
 class MetricValueGauge(MetricValue):
-    """Wrapper above the Prometheus Gauge metric type."""
+    """Wrapper above the Prometheus Gauge metric type.
+    The values of a gauge collected by an action are double buffered: at the start of the action, a back buffer is
+    staged from the front buffer and the events of the action update it. If the action completes, the back buffer
+    replaces the front buffer at once, otherwise it is discarded and the previous values are kept. Prometheus only
+    reads the front buffer and therefore never observes a partially collected state.
+
+    Several definitions of a gauge, e.g. in the filters of different actions, can share the buffers of the first
+    definition. The value on scrape start of a shared gauge only resets the values collected by the same
+    definition, so the actions do not reset the values of each other.
+
+    If aggregate is set, the values set by several events with the same label values, e.g. because labels are
+    dropped, are combined by the aggregation instead of the last event winning. The values are combined per scrape
+    process: for gauges collected by an action over the events of the action, otherwise over the events received
+    since the end of the last scrape process."""
+
+    supports_batch_processing: bool = True
+    stages_values: bool = True
+
+    # Aggregations combining the values set with the same label values, by the state (sum, count, min, max)
+    aggregations: Dict[str, Callable[[Tuple[float, int, float, float]], float]] = {
+        "sum": lambda state: state[0],
+        "avg": lambda state: state[0] / state[1],
+        "min": lambda state: state[2],
+        "max": lambda state: state[3],
+    }
 
     def __init__(self,
                  metric_name: str,
@@ -129,99 +445,444 @@ class MetricValueGauge(MetricValue):
                  metric_labels: Dict[str, str],
                  set_value: Optional[str],
                  increment_value: Optional[str],
-                 value_on_scrape_start: Optional[float]) -> None:
+                 value_on_scrape_start: Optional[float],
+                 aggregate: Optional[str] = None) -> None:
         super().__init__(metric_name, metric_description, metric_labels)
+        if aggregate is not None and aggregate not in self.aggregations:
+            raise Exception(f"Metric '{metric_name}': Unknown aggregation '{aggregate}'")
+        if aggregate is not None and set_value is None:
+            raise Exception(f"Metric '{metric_name}': An aggregation requires a set_value")
 
-        self.__gauge: Optional[Gauge] = None
+        self.__gauge: Optional[GaugeCollector] = None
         self.__set_value: Optional[str] = set_value
         self.__increment_value: Optional[str] = increment_value
         self.__value_on_scrape_start: Optional[float] = value_on_scrape_start
-
-        self.__value: float = 0
+        self.__aggregate: Optional[Callable[[Tuple[float, int, float, float]], float]] = \
+            None if aggregate is None else self.aggregations[aggregate]
+        # Sum, count, minimum and maximum of the values set per label values in the current scrape process
+        self.__aggregate_states: Dict[Sequence[str], Tuple[float, int, float, float]] = {}
+        self._compile_number(set_value)
+        self._compile_number(increment_value)
+
+        # Back buffer updated by the events. A gauge without labels only has the value with the key ().
         self.__label_values: Dict[Sequence[str], float] = {}
+        if len(self._metric_labels) == 0:
+            self.__label_values[()] = 0
+        # Front buffer read by Prometheus, only used if the gauge is collected by an action
+        self.__published_label_values: Dict[Sequence[str], float] = dict(self.__label_values)
         self.__scrape_metric: bool = False
-
-    def __convert_value(self, value: str) -> float:
-        """Converts the given value to a float and logs any errors that occur. If an error occurred, 0 is returned."""
-        try:
-            return float(value)
-        except ValueError:
-            logging.error(
-                f"metric_name: {self._metric_name}: Unable to convert value {value} to a type of float")
-            return 0
+        # UNIX timestamps of the start of the scrape process of both buffers, exposed if __timestamps is set
+        self.__timestamps: bool = False
+        self.__timestamp: Optional[float] = None
+        self.__published_timestamp: Optional[float] = None
+
+        # Definition owning the buffers, another one if the series are shared
+        self.__owner: MetricValueGauge = self
+        # Label values updated by this definition in the current and in the last completed scrape process,
+        # only tracked if the series are shared
+        self.__keys: Optional[Set[Sequence[str]]] = None
+        self.__collected_keys: Optional[Set[Sequence[str]]] = None
 
     def __set_on_scrape_start_value(self) -> None:
-        """If __value_on_scrape_start is set, the function sets all already created metrics of
-        the gauge with the respective labels to the __value_on_scrape_start value"""
-        if self.__value_on_scrape_start is None:
+        """Stages a new back buffer from the published values. If __value_on_scrape_start is set, every already
+        created metric of the gauge with the respective labels is set to the __value_on_scrape_start value."""
+        owner = self.__owner
+        if self.__collected_keys is None:
+            if self.__value_on_scrape_start is None:
+                owner.__label_values = dict(owner.__published_label_values)
+            else:
+                owner.__label_values = dict.fromkeys(owner.__published_label_values, self.__value_on_scrape_start)
             return
 
-        if len(self._metric_labels) == 0:
-            self.__value = self.__value_on_scrape_start
-            return
+        # A back buffer already staged by another definition in the same scrape process is kept
+        if owner.__label_values is owner.__published_label_values:
+            owner.__label_values = dict(owner.__published_label_values)
+        if self.__value_on_scrape_start is not None:
+            owner.__label_values.update(dict.fromkeys(self.__collected_keys, self.__value_on_scrape_start))
+
+    def __get_published_label_values(self) -> Dict[Sequence[str], float]:
+        """Returns the values read by Prometheus. Gauges collected by an action expose the front buffer,
+        any other gauge exposes its current values."""
+        if self.__scrape_metric:
+            return self.__published_label_values
+        return self.__label_values
+
+    def __get_published_timestamp(self) -> Optional[float]:
+        """Returns the timestamp exposed with the published values: the start of the scrape process that collected
+        them, if timestamps are exposed. Values not collected by an action yet are exposed without a timestamp."""
+        if not self.__timestamps or not self.__scrape_metric:
+            return None
+        return self.__published_timestamp
+
+    def __publish(self) -> None:
+        """Publishes the back buffer by replacing the front buffer with it at once. The back buffer is not copied;
+        both buffers are the same until the next scrape process stages a new back buffer."""
+        owner = self.__owner
+        if owner.__gauge is None:
+            raise Exception("Metric is not initialized")
 
-        for key in self.__label_values:
-            self.__label_values[key] = self.__value_on_scrape_start
+        owner.__published_label_values = owner.__label_values
+        owner.__published_timestamp = owner.__timestamp
 
-    def __update_gauge(self) -> None:
-        """Updates the gauge with the custom value types."""
-        if self.__gauge is None:
-            raise Exception("Metric is not initialized")
+    def __aggregate_value(self, key: Sequence[str], value: float) -> float:
+        """Adds the given value set for the label values to the values set for them in the current scrape process.
 
-        if len(self._metric_labels) == 0:
-            self.__gauge.set(self.__value)
-            return
+        :return: The value the gauge is set to: the given value, or the aggregated value if aggregate is set."""
+        if self.__aggregate is None:
+            return value
+        state = self.__aggregate_states.get(key, None)
+        if state is None:
+            state = (value, 1, value, value)
+        else:
+            state = (state[0] + value, state[1] + 1, min(state[2], value), max(state[3], value))
+        self.__aggregate_states[key] = state
+        return self.__aggregate(state)
 
-        for key in self.__label_values:
-            self.__gauge.labels(*key).set(self.__label_values[key])
+    def __track_keys(self) -> None:
+        """Starts tracking the label values updated by this definition, once its series are shared."""
+        if self.__collected_keys is None:
+            self.__keys = set()
+            self.__collected_keys = set()
 
     def init(self) -> None:
         """Initializes the Prometheus Gauge metric."""
-        self.__gauge = Gauge(
+        self.__gauge = GaugeCollector(
             self._metric_name,
             self._metric_description,
-            self._metric_label_names)
+            self._metric_label_names,
+            self.__get_published_label_values,
+            self.__get_published_timestamp)
+        REGISTRY.register(self.__gauge)
+
+    def share_series(self, owner: MetricValue) -> None:
+        """Updates the buffers of the given definition instead of initializing an own Prometheus Gauge."""
+        if not isinstance(owner, MetricValueGauge):
+            raise Exception(f"Metric '{self._metric_name}' is already defined with a different type")
+        self.__owner = owner
+        self.__track_keys()
+        owner.__track_keys()
+
+    def expose_timestamps(self) -> None:
+        """Exposes the values collected by an action with the UNIX timestamp of the start of the action, i.e. when
+        Asterisk created the state the values were collected from, instead of the time Prometheus scrapes them."""
+        self.__owner.__timestamps = True
 
     def on_scrape_start(self) -> None:
         """The function should be called at the beginning of a scraping process.
         If necessary, the function resets the metrics that have already been created."""
-        if self.__gauge is None:
+        owner = self.__owner
+        if owner.__gauge is None:
             return
 
-        self.__scrape_metric = True
+        owner.__scrape_metric = True
+        owner.__timestamp = time()
         self.__set_on_scrape_start_value()
+        self.__aggregate_states = {}
+        if self.__keys is not None:
+            self.__keys = set()
 
     def on_scrape_end(self) -> None:
         """The function should be called at the end of a scraping process.
-        Used to update the gauge metrics to the values evaluated by the scrape process."""
-        self.__update_gauge()
+        Used to publish the values evaluated by the scrape process."""
+        self.__publish()
+        self.__aggregate_states = {}
+        if self.__keys is not None:
+            self.__collected_keys = self.__keys
+            self.__keys = set()
+
+    def on_scrape_abort(self) -> None:
+        """The function should be called if a scraping process did not complete.
+        Discards the values evaluated by the scrape process, so the previously published values are kept."""
+        owner = self.__owner
+        owner.__label_values = owner.__published_label_values
+        owner.__timestamp = owner.__published_timestamp
+        self.__aggregate_states = {}
+        if self.__keys is not None:
+            self.__keys = set()
+
+    def __apply_event(self,
+                      event: Event,
+                      set_value: Optional[str],
+                      increment_value: Optional[str],
+                      label_values_list: List[Dict[Sequence[str], float]],
+                      aggregate: bool = False) -> Sequence[str]:
+        """Evaluates the given set and increment values for the event and updates the given buffers.
+
+        :param Event event: The event from which the metrics are evaluated.
+        :param set_value: Value the metric is set to, None if the metric is not set.
+        :param increment_value: Value the metric is incremented by, None if the metric is not incremented.
+        :param label_values_list: The buffers that are updated.
+        :param aggregate: Whether the set value is aggregated with the values set before, see __aggregate_value.
+        :return: The label values of the updated value."""
+        key: Sequence[str] = ()
+        if len(self._metric_labels) > 0:
+            labels = self._eval_labels(event)
+            key = tuple(str(labels[label]) for label in self._metric_label_names)
+
+        set_number = None if set_value is None else self._eval_number(event, set_value)
+        if set_number is not None and aggregate:
+            set_number = self.__aggregate_value(key, set_number)
+        increment_number = None if increment_value is None else self._eval_number(event, increment_value)
+
+        for label_values in label_values_list:
+            if set_number is not None:
+                label_values[key] = set_number
+            if increment_number is not None:
+                label_values[key] = label_values.get(key, 0) + increment_number
+            if key not in label_values:
+                label_values[key] = 0
+        return key
+
+    def process_event(self, event: Event) -> None:
+        """Processes the given event, evaluates the expected metrics and updates the back buffer.
+        For gauges collected by an action, the values are published at the end of the scrape process.
+
+        :param Event event: The event from which the metrics are evaluated."""
+        key = self.__apply_event(
+            event, self.__set_value, self.__increment_value, [self.__owner.__label_values], aggregate=True)
+        if self.__keys is not None:
+            self.__keys.add(key)
+
+    def process_events(self, events: List[Event]) -> None:
+        """Processes the given events at once and updates the back buffer. The values are evaluated column by
+        column and grouped by label values, so every value of the buffer is only updated once.
+
+        :param events: The events from which the metrics are evaluated."""
+        # Setting and incrementing by the same event depends on the order of the events
+        if self.__set_value is not None and self.__increment_value is not None:
+            super().process_events(events)
+            return
+
+        keys = self._eval_keys(events)
+        label_values = self.__owner.__label_values
+        if self.__set_value is not None and self.__aggregate is not None:
+            for key, value in zip(keys, self._eval_numbers(events, self.__set_value)):
+                label_values[key] = self.__aggregate_value(key, value)
+        elif self.__set_value is not None:
+            # The last event of the label values wins, like when processing the events one by one
+            label_values.update(zip(keys, self._eval_numbers(events, self.__set_value)))
+        elif self.__increment_value is not None:
+            totals: collections.Counter[Sequence[str]] = collections.Counter()
+            for key, value in zip(keys, self._eval_numbers(events, self.__increment_value)):
+                totals[key] += value
+            for key, total in totals.items():
+                label_values[key] = label_values.get(key, 0) + total
+        else:
+            for key in keys:
+                if key not in label_values:
+                    label_values[key] = 0
+        if self.__keys is not None:
+            self.__keys.update(keys)
+
+    def get_value(self, key: Sequence[str]) -> float:
+        """Returns the current value of the gauge with the given label values."""
+        return self.__owner.__label_values.get(key, 0)
+
+    def get_label_keys(self) -> List[Sequence[str]]:
+        """Returns the label values of every value of the gauge."""
+        return list(self.__owner.__label_values)
+
+    def get_published_values(self) -> Dict[Sequence[str], float]:
+        """Returns a copy of the values read by Prometheus, without the values staged by a running action."""
+        return dict(self.__owner.__get_published_label_values())
+
+    def restore_value(self, key: Sequence[str], value: float) -> None:
+        """Sets the gauge with the given label values to the persisted value in both buffers."""
+        owner = self.__owner
+        owner.__label_values[key] = value
+        owner.__published_label_values[key] = value
+        # A restored value of a shared gauge is reset like a value collected by the owner
+        if owner.__collected_keys is not None:
+            owner.__collected_keys.add(key)
+
+    def process_tracked_event(self, event: Event, set_value: Optional[str], increment_value: Optional[str]) -> None:
+        """Processes an incremental event that changes the state collected by the action of the gauge.
+        Unlike process_event, the change is published immediately, since the action itself is only
+        executed to resync the state.
+
+        While a resync is running, the change only updates the published values and is dropped when the staged
+        values replace them: the staged values are collected from the state of Asterisk, which already contains
+        the change if it happened before the state was listed, so applying it to them could count it twice.
+
+        :param Event event: The event from which the metrics are evaluated.
+        :param set_value: Value the metric is set to, None if the metric is not set.
+        :param increment_value: Value the metric is incremented by, None if the metric is not incremented."""
+        owner = self.__owner
+        self.__apply_event(event, set_value, increment_value, [owner.__get_published_label_values()])
+        # The tracked values are up to date, so they are exposed with the time of the event
+        if owner.__published_timestamp is not None:
+            owner.__published_timestamp = time()
+
+
+class MetricValueGaugeTracker(MetricValue):
+    """Keeps a MetricValueGauge up to date between two executions of its action by applying
+    incremental events to it, e.g. QueueMemberAdded and QueueMemberRemoved for a gauge collected by QueueStatus."""
+
+    def __init__(self,
+                 gauge: MetricValueGauge,
+                 set_value: Optional[str],
+                 increment_value: Optional[str]) -> None:
+        super().__init__(gauge._metric_name, gauge._metric_description, gauge._metric_labels)
+
+        self.__gauge: MetricValueGauge = gauge
+        self.__set_value: Optional[str] = set_value
+        self.__increment_value: Optional[str] = increment_value
+        gauge._compile_number(set_value)
+        gauge._compile_number(increment_value)
 
     def process_event(self, event: Event) -> None:
-        """Processes the given event, evaluates the expected metrics and updates the custom value types.
-        The Prometheus Gauge must then be updated manually using the __update_gauge function.
-        Otherwise the changes will not have any effect.
+        """Applies the given event to the tracked gauge.
 
         :param Event event: The event from which the metrics are evaluated."""
+        self.__gauge.process_tracked_event(event, self.__set_value, self.__increment_value)
+
+
+class MetricValueComputed(MetricValue):
+    """Wrapper above the Prometheus Gauge metric type. The value is computed by an expression, which can reference
+    attributes of the filtered event as well as the values of other metrics with the same labels."""
+
+    def __init__(self,
+                 metric_name: str,
+                 metric_description: str,
+                 metric_labels: Dict[str, str],
+                 expression: Expression,
+                 metric_references: Dict[str, MetricValue],
+                 evaluate_on_scrape_end: bool) -> None:
+        super().__init__(metric_name, metric_description, metric_labels)
+
+        self.__gauge: Optional[Gauge] = None
+        self.__expression: Expression = expression
+        self.__metric_references: Dict[str, MetricValue] = metric_references
+        self.__evaluate_on_scrape_end: bool = evaluate_on_scrape_end
+
+        self.__label_values: Dict[Sequence[str], float] = {}
+
+    def __evaluate(self, fields: Dict[str, str], key: Sequence[str]) -> Optional[float]:
+        """Evaluates the expression for the given event attributes and label values and logs any errors
+        that occur. If an error occurred, None is returned."""
+        try:
+            return self.__expression.evaluate(
+                fields, lambda name: self.__metric_references[name].get_value(key))
+        except KeyError as e:
+            logging.error(
+                "metric_name: %s: Unable to evaluate expression '%s': Attribute %s does not exist in event",
+                self._metric_name, self.__expression.source, e)
+        except ValueError as e:
+            logging.error(
+                "metric_name: %s: Unable to evaluate expression '%s': %s",
+                self._metric_name, self.__expression.source, e)
+        except ZeroDivisionError:
+            logging.debug(
+                "metric_name: %s: Skipped expression '%s': division by zero",
+                self._metric_name, self.__expression.source)
+        except (ArithmeticError, TypeError) as e:
+            logging.error(
+                "metric_name: %s: Unable to evaluate expression '%s': %s",
+                self._metric_name, self.__expression.source, e)
+        return None
+
+    def __set(self, key: Sequence[str], value: float) -> None:
+        """Sets the gauge with the given label values to the given value."""
+        if self.__gauge is None:
+            raise Exception("Metric is not initialized")
+
+        self.__label_values[key] = value
         if len(self._metric_labels) == 0:
-            if self.__set_value is not None:
-                self.__value = self.__convert_value(
-                    self._eval_value(event, self.__set_value))
-            if self.__increment_value is not None:
-                self.__value += self.__convert_value(
-                    self._eval_value(event, self.__increment_value))
+            self.__gauge.set(value)
         else:
-            labels = self._eval_labels(event)
-            key = tuple(str(labels[label]) for label in self._metric_label_names)
+            self.__gauge.labels(*key).set(value)
 
-            if key not in self.__label_values:
-                self.__label_values[key] = 0
+    def init(self) -> None:
+        """Initializes the Prometheus Gauge metric."""
+        self.__gauge = Gauge(
+            self._metric_name,
+            self._metric_description,
+            self._metric_label_names)
+
+    def on_scrape_end(self) -> None:
+        """If the metric is evaluated on scrape end, the expression is evaluated for the label values
+        of every value of the referenced metrics."""
+        if not self.__evaluate_on_scrape_end:
+            return
+
+        keys: Dict[Sequence[str], None] = {}
+        for metric in self.__metric_references.values():
+            keys.update(dict.fromkeys(metric.get_label_keys()))
 
-            if self.__set_value is not None:
-                self.__label_values[key] = self.__convert_value(
-                    self._eval_value(event, self.__set_value))
-            if self.__increment_value is not None:
-                self.__label_values[key] += self.__convert_value(
-                    self._eval_value(event, self.__increment_value))
+        for key in keys:
+            value = self.__evaluate({}, key)
+            if value is not None:
+                self.__set(key, value)
+
+    def process_event(self, event: Event) -> None:
+        """Evaluates the expression for the given event, unless the metric is evaluated on scrape end.
+
+        :param Event event: The event from which the metrics are evaluated."""
+        if self.__evaluate_on_scrape_end:
+            return
+
+        labels = self._eval_labels(event)
+        key = tuple(str(labels[label]) for label in self._metric_label_names)
+        value = self.__evaluate(event.keys, key)
+        if value is not None:
+            self.__set(key, value)
+
+    def get_value(self, key: Sequence[str]) -> float:
+        """Returns the last computed value with the given label values."""
+        return self.__label_values.get(key, 0)
+
+    def get_label_keys(self) -> List[Sequence[str]]:
+        """Returns the label values of every computed value."""
+        return list(self.__label_values)
+
+
+class MetricRegistry():
+    """Deduplicates the metric definitions of the configuration by their name. The first definition of a name
+    initializes the Prometheus metric. Further definitions with the same type and label names, e.g. a gauge
+    collected from QueueParams and from QueueSummary events, feed the series of the first definition instead of
+    registering the name again."""
+
+    def __init__(self) -> None:
+        self.__metrics: Dict[str, MetricValue] = {}
+        # Every definition by the name of the metric, and the names of the metrics referenced by computed metrics
+        self.__definitions: Dict[str, List[MetricValue]] = {}
+        self.__referenced_names: Set[str] = set()
+
+    def register(self, metric: MetricValue) -> None:
+        """Initializes the given metric or, if its name is already registered, shares the series of the registered
+        definition. The label names of the metric are ordered like those of the registered definition.
+
+        :raises Exception: If the registered definition has a different type or different label names."""
+        if metric._metric_name in self.__referenced_names:
+            metric.disable_batch_processing()
+        owner = self.__metrics.get(metric._metric_name, None)
+        if owner is None:
+            metric.init()
+            self.__metrics[metric._metric_name] = metric
+            self.__definitions[metric._metric_name] = [metric]
+            return
 
-        if not self.__scrape_metric:
-            self.__update_gauge()
+        if set(metric._metric_label_names) != set(owner._metric_label_names):
+            raise Exception(f"Metric '{metric._metric_name}' is already defined with the labels "
+                            f"{owner._metric_label_names}, but has the labels {metric._metric_label_names}")
+        if type(metric) is not type(owner):
+            raise Exception(f"Metric '{metric._metric_name}' is already defined with a different type")
+        metric._metric_label_names = list(owner._metric_label_names)
+        metric.share_series(owner)
+        self.__definitions[metric._metric_name].append(metric)
+
+    def reference(self, name: str) -> Optional[MetricValue]:
+        """Returns the first definition of the given metric for a computed metric referencing it, None if the
+        metric is not registered. Every definition of the metric, including further ones, processes the events of
+        an action on its own instead of in batches, so the computed metric never reads the values of the previous
+        action while the events of a batch are still pending."""
+        if name not in self.__metrics:
+            return None
+        self.__referenced_names.add(name)
+        for metric in self.__definitions[name]:
+            metric.disable_batch_processing()
+        return self.__metrics[name]
+
+    def get_metrics(self) -> Dict[str, MetricValue]:
+        """Returns the first definition of every registered metric by its name."""
+        return self.__metrics
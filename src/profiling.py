@@ -0,0 +1,257 @@
+import asyncio
+import os
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from time import monotonic, sleep, thread_time
+from types import FrameType
+from typing import Any, Dict, List, Optional, Tuple
+from asterisk.ami import Event
+from event_filter import EventFilter
+from http_server import HTTPRequest, HTTPResponse, MetricsServer
+
+
+def _collapse_stack(thread_name: str, frame: Optional[FrameType]) -> str:
+    """Converts the stack of the given frame to a line of the collapsed stack format, root first."""
+    frames: List[str] = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    frames.append(thread_name)
+    return ";".join(reversed(frames))
+
+
+def sample_stacks(duration: float, interval: float = 0.01) -> Counter[str]:
+    """Samples the stacks of every thread except the calling one every interval for the given duration.
+
+    :return: The number of samples by stack in the collapsed stack format, as used by flamegraph.pl."""
+    own_thread_id = threading.get_ident()
+    stacks: Counter[str] = Counter()
+    end = monotonic() + duration
+    while monotonic() < end:
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id != own_thread_id:
+                stacks[_collapse_stack(thread_names.get(thread_id, str(thread_id)), frame)] += 1
+        sleep(interval)
+    return stacks
+
+
+def format_collapsed_stacks(stacks: Counter[str]) -> str:
+    """Formats the sampled stacks as collapsed stacks, one stack and its number of samples per line."""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def format_top_functions(stacks: Counter[str], limit: int = 50) -> str:
+    """Formats the sampled stacks as table of the functions with the most samples, by the samples
+    in the function itself (own) and in the function including its callees (cumulative)."""
+    own: Counter[str] = Counter()
+    cumulative: Counter[str] = Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")[1:]
+        if len(frames) == 0:
+            continue
+        own[frames[-1]] += count
+        for function in set(frames):
+            cumulative[function] += count
+
+    total = max(sum(stacks.values()), 1)
+    lines = [f"{'own':>7} {'cumul':>7}  function\n"]
+    for function, count in own.most_common(limit):
+        lines.append(f"{count / total:>7.1%} {cumulative[function] / total:>7.1%}  {function}\n")
+    return "".join(lines)
+
+
+class CPUAccounting():
+    """Measures the CPU time spent per event filter and per metric.
+    While enabled, the methods processing the events of the filters and metrics are replaced by timed wrappers,
+    so the accounting costs nothing while disabled."""
+
+    def __init__(self, filter_list: List[EventFilter]) -> None:
+        self.__filter_list: List[EventFilter] = filter_list
+        self.__wrapped: List[Any] = []
+        # CPU seconds and number of events by kind ("filter" or "metric") and name
+        self.__cpu_seconds: Dict[Tuple[str, str], float] = {}
+        self.__event_counts: Dict[Tuple[str, str], int] = {}
+
+    def is_enabled(self) -> bool:
+        return len(self.__wrapped) > 0
+
+    def __wrap(self, target: Any, key: Tuple[str, str]) -> None:
+        """Replaces the process_event and process_events methods of the given filter or metric by timed
+        wrappers."""
+        # Metrics referenced by multiple filters are only wrapped once
+        if "process_event" in vars(target):
+            return
+        process_event = target.process_event
+
+        def timed_process_event(event: Event) -> None:
+            start = thread_time()
+            try:
+                process_event(event)
+            finally:
+                self.__add(key, thread_time() - start, 1)
+
+        target.process_event = timed_process_event
+        self.__wrapped.append(target)
+
+        # Metrics process the events collected by an action at once
+        process_events = getattr(target, "process_events", None)
+        if process_events is None:
+            return
+
+        def timed_process_events(events: List[Event]) -> None:
+            start = thread_time()
+            try:
+                process_events(events)
+            finally:
+                self.__add(key, thread_time() - start, len(events))
+
+        target.process_events = timed_process_events
+
+    def __add(self, key: Tuple[str, str], seconds: float, event_count: int) -> None:
+        self.__cpu_seconds[key] = self.__cpu_seconds.get(key, 0) + seconds
+        self.__event_counts[key] = self.__event_counts.get(key, 0) + event_count
+
+    def enable(self) -> None:
+        """Starts measuring the CPU time of the filters and metrics."""
+        if self.is_enabled():
+            return
+        for filter in self.__filter_list:
+            self.__wrap(filter, ("filter", "|".join(sorted(filter.get_event_name_set()))))
+            for metric in filter.get_metric_values():
+                self.__wrap(metric, ("metric", getattr(metric, "_metric_name", type(metric).__name__)))
+
+    def disable(self) -> None:
+        """Stops measuring and restores the original process_event methods. The measured times are kept."""
+        for target in self.__wrapped:
+            del target.process_event
+            if "process_events" in vars(target):
+                del target.process_events
+        self.__wrapped = []
+
+    def reset(self) -> None:
+        """Resets the measured times."""
+        self.__cpu_seconds = {}
+        self.__event_counts = {}
+
+    def get_cpu_seconds(self) -> Dict[Tuple[str, str], Tuple[float, int]]:
+        """Returns the CPU seconds and the number of processed events by kind and name."""
+        cpu_seconds = dict(self.__cpu_seconds)
+        event_counts = dict(self.__event_counts)
+        return {key: (seconds, event_counts.get(key, 0)) for key, seconds in cpu_seconds.items()}
+
+
+class MemoryTracer():
+    """Traces the memory allocations using tracemalloc and compares them to a baseline snapshot,
+    to find the code whose allocations grow."""
+
+    def __init__(self, frame_count: int = 1) -> None:
+        self.__frame_count: int = frame_count
+        self.__baseline: Optional[tracemalloc.Snapshot] = None
+
+    def is_tracing(self) -> bool:
+        return self.__baseline is not None
+
+    @staticmethod
+    def __take_snapshot() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+    def start(self) -> None:
+        """Starts tracing and takes the baseline snapshot."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.__frame_count)
+        self.__baseline = self.__take_snapshot()
+
+    def stop(self) -> None:
+        """Stops tracing and releases the traces."""
+        tracemalloc.stop()
+        self.__baseline = None
+
+    def diff(self, limit: int = 25) -> List[tracemalloc.StatisticDiff]:
+        """Returns the source lines whose allocations changed the most since the baseline snapshot."""
+        if self.__baseline is None:
+            raise Exception("Memory tracing is not started")
+        return self.__take_snapshot().compare_to(self.__baseline, "lineno")[:limit]
+
+
+class DebugEndpoints():
+    """Endpoints to profile the running exporter, added to the metrics server if enabled:
+
+    - /debug/profile?seconds=10&format=collapsed|top: samples the stacks of every thread, e.g. for a flamegraph
+    - /debug/memory: starts tracing the memory allocations, further requests show the growth since the start
+    - /debug/cpu: starts measuring the CPU time per event filter and metric, further requests show the times
+
+    The measurement of the memory and CPU endpoints is restarted by ?action=reset and stopped by ?action=stop."""
+
+    # Maximum duration of a profile in seconds
+    max_profile_seconds: float = 60
+
+    def __init__(self, filter_list: List[EventFilter]) -> None:
+        self.__cpu_accounting: CPUAccounting = CPUAccounting(filter_list)
+        self.__memory_tracer: MemoryTracer = MemoryTracer()
+        self.__profile_lock: asyncio.Lock = asyncio.Lock()
+
+    def add_routes(self, server: MetricsServer) -> None:
+        """Adds the debug endpoints to the given server."""
+        server.add_route("/debug/profile", self.__handle_profile)
+        server.add_route("/debug/memory", self.__handle_memory)
+        server.add_route("/debug/cpu", self.__handle_cpu)
+
+    @staticmethod
+    def __text_response(body: str, status: str = "200 OK") -> HTTPResponse:
+        return HTTPResponse(status, body.encode(), [("Content-Type", "text/plain; charset=utf-8")])
+
+    async def __handle_profile(self, request: HTTPRequest) -> HTTPResponse:
+        """Samples the stacks in a thread for the requested duration. Only one profile runs at a time."""
+        try:
+            seconds = float(request.params.get("seconds", ["10"])[0])
+        except ValueError:
+            return self.__text_response("Invalid seconds\n", "400 Bad Request")
+        if not 0 < seconds <= self.max_profile_seconds:
+            return self.__text_response(
+                f"Seconds must be between 0 and {self.max_profile_seconds}\n", "400 Bad Request")
+        output_format = request.params.get("format", ["collapsed"])[0]
+        if output_format not in ("collapsed", "top"):
+            return self.__text_response("Format must be 'collapsed' or 'top'\n", "400 Bad Request")
+
+        if self.__profile_lock.locked():
+            return self.__text_response("A profile is already running\n", "409 Conflict")
+        async with self.__profile_lock:
+            stacks = await asyncio.to_thread(sample_stacks, seconds)
+
+        if output_format == "top":
+            return self.__text_response(format_top_functions(stacks))
+        return self.__text_response(format_collapsed_stacks(stacks))
+
+    def __handle_memory(self, request: HTTPRequest) -> HTTPResponse:
+        """Starts tracing the memory allocations or shows the growth since the start."""
+        action = request.params.get("action", [""])[0]
+        if action == "stop":
+            self.__memory_tracer.stop()
+            return self.__text_response("Stopped tracing memory allocations\n")
+        if not self.__memory_tracer.is_tracing() or action == "reset":
+            self.__memory_tracer.start()
+            return self.__text_response("Started tracing memory allocations, request again to show the growth\n")
+
+        return self.__text_response("".join(f"{statistic}\n" for statistic in self.__memory_tracer.diff()))
+
+    def __handle_cpu(self, request: HTTPRequest) -> HTTPResponse:
+        """Starts measuring the CPU time of the event filters and metrics or shows the measured times."""
+        action = request.params.get("action", [""])[0]
+        if action == "stop":
+            self.__cpu_accounting.disable()
+            return self.__text_response("Stopped measuring CPU time\n")
+        if action == "reset":
+            self.__cpu_accounting.reset()
+        if not self.__cpu_accounting.is_enabled():
+            self.__cpu_accounting.enable()
+            return self.__text_response("Started measuring CPU time, request again to show the times\n")
+
+        cpu_seconds = sorted(self.__cpu_accounting.get_cpu_seconds().items(), key=lambda item: -item[1][0])
+        lines = [f"{'seconds':>10} {'events':>10} {'us/event':>10}  kind    name\n"]
+        for (kind, name), (seconds, count) in cpu_seconds:
+            lines.append(f"{seconds:>10.3f} {count:>10} {seconds / max(count, 1) * 1e6:>10.1f}  {kind:<7} {name}\n")
+        return self.__text_response("".join(lines))
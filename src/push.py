@@ -0,0 +1,236 @@
+import logging
+import struct
+import threading
+from collections import deque
+from time import time
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+from urllib.error import HTTPError, URLError
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+from prometheus_client import REGISTRY, CollectorRegistry, generate_latest
+from prometheus_client.exposition import CONTENT_TYPE_LATEST
+
+try:
+    import snappy
+except ImportError:
+    snappy = None
+
+# Sample of a time series: labels including the metric name as __name__, value and timestamp in milliseconds
+Sample = Tuple[Dict[str, str], float, int]
+
+
+def _encode_varint(value: int) -> bytes:
+    """Encodes the given unsigned integer as protobuf varint."""
+    encoded = bytearray()
+    while value > 0x7f:
+        encoded.append((value & 0x7f) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def _encode_length_delimited(field_number: int, data: bytes) -> bytes:
+    """Encodes the given bytes as length delimited protobuf field."""
+    return _encode_varint(field_number << 3 | 2) + _encode_varint(len(data)) + data
+
+
+def encode_write_request(samples: Iterable[Sample]) -> bytes:
+    """Encodes the given samples as protobuf WriteRequest of the Prometheus remote-write protocol.
+    Every sample is sent as its own time series."""
+    request = bytearray()
+    for labels, value, timestamp in samples:
+        series = bytearray()
+        for name, label_value in sorted(labels.items()):
+            series += _encode_length_delimited(
+                1, _encode_length_delimited(1, name.encode()) + _encode_length_delimited(2, label_value.encode()))
+        # Sample: double value (field 1, fixed 64 bit) and int64 timestamp (field 2, varint)
+        sample = b"\x09" + struct.pack("<d", value) + b"\x10" + _encode_varint(timestamp & 0xffffffffffffffff)
+        series += _encode_length_delimited(2, sample)
+        request += _encode_length_delimited(1, bytes(series))
+    return bytes(request)
+
+
+def snappy_compress(data: bytes) -> bytes:
+    """Compresses the given data in the snappy block format. If python-snappy is not installed,
+    the data is stored as uncompressed literals, which every snappy decoder accepts."""
+    if snappy is not None:
+        return snappy.compress(data)
+
+    compressed = bytearray(_encode_varint(len(data)))
+    for offset in range(0, len(data), 65536):
+        chunk = data[offset:offset + 65536]
+        length = len(chunk) - 1
+        if length < 60:
+            compressed.append(length << 2)
+        elif length < 0x100:
+            compressed += bytes((60 << 2, length))
+        else:
+            compressed += bytes((61 << 2,)) + struct.pack("<H", length)
+        compressed += chunk
+    return bytes(compressed)
+
+
+def collect_samples(registry: CollectorRegistry, timestamp: int) -> List[Sample]:
+    """Collects the current samples of the given registry. Samples without a timestamp get the given one."""
+    samples: List[Sample] = []
+    for metric in registry.collect():
+        for sample in metric.samples:
+            labels = {"__name__": sample.name}
+            labels.update(sample.labels)
+            sample_timestamp = timestamp if sample.timestamp is None else int(float(sample.timestamp) * 1000)
+            samples.append((labels, sample.value, sample_timestamp))
+    return samples
+
+
+class PushError(Exception):
+    """Error while pushing a batch.
+
+    :param retryable: Whether sending the batch again may succeed."""
+
+    def __init__(self, message: str, retryable: bool) -> None:
+        super().__init__(message)
+        self.retryable: bool = retryable
+
+
+class Pusher():
+    """Pushes the metrics of a registry to a Prometheus remote-write endpoint or a Pushgateway.
+    The samples are collected every flush interval and put as batch into a bounded send queue. If the queue is
+    full, the oldest batch is dropped. A second thread sends the batches in order and retries failed batches
+    with an exponential backoff."""
+
+    modes = ("remote_write", "pushgateway")
+
+    def __init__(self,
+                 mode: str,
+                 url: str,
+                 registry: CollectorRegistry = REGISTRY,
+                 job: str = "asterisk",
+                 grouping_key: Optional[Dict[str, str]] = None,
+                 flush_interval: float = 5,
+                 queue_size: int = 10,
+                 max_retries: int = 5,
+                 retry_backoff: float = 1,
+                 max_backoff: float = 30,
+                 timeout: float = 10) -> None:
+        if mode not in self.modes:
+            raise Exception(f"Invalid push mode '{mode}'")
+
+        self.__mode: str = mode
+        self.__url: str = url
+        self.__registry: CollectorRegistry = registry
+        self.__flush_interval: float = flush_interval
+        self.__max_retries: int = max_retries
+        self.__retry_backoff: float = retry_backoff
+        self.__max_backoff: float = max_backoff
+        self.__timeout: float = timeout
+
+        if mode == "pushgateway":
+            self.__url = url.rstrip("/") + f"/metrics/job/{quote(job, safe='')}"
+            for name, value in (grouping_key or {}).items():
+                self.__url += f"/{quote(name, safe='')}/{quote(value, safe='')}"
+
+        self.__queue: Deque[bytes] = deque(maxlen=queue_size)
+        self.__queue_condition: threading.Condition = threading.Condition()
+        self.__stopped: threading.Event = threading.Event()
+        self.__threads: List[threading.Thread] = []
+        self.dropped_batches: int = 0
+
+    def start(self) -> None:
+        """Starts the threads collecting and sending the batches."""
+        self.__stopped.clear()
+        self.__threads = [
+            threading.Thread(target=self.__run_flush_loop, name="push-flush", daemon=True),
+            threading.Thread(target=self.__run_send_loop, name="push-send", daemon=True),
+        ]
+        for thread in self.__threads:
+            thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stops the threads. Batches remaining in the queue are discarded."""
+        self.__stopped.set()
+        with self.__queue_condition:
+            self.__queue_condition.notify_all()
+        for thread in self.__threads:
+            thread.join(timeout)
+        self.__threads = []
+
+    def get_queue_length(self) -> int:
+        """Returns the number of batches waiting to be sent."""
+        return len(self.__queue)
+
+    def flush(self) -> None:
+        """Collects the current samples and puts them as batch into the send queue."""
+        if self.__mode == "remote_write":
+            batch = snappy_compress(encode_write_request(collect_samples(self.__registry, int(time() * 1000))))
+        else:
+            batch = generate_latest(self.__registry)
+
+        with self.__queue_condition:
+            if len(self.__queue) == self.__queue.maxlen:
+                self.dropped_batches += 1
+                logging.warning("Push queue is full, dropping the oldest batch")
+            self.__queue.append(batch)
+            self.__queue_condition.notify()
+
+    def send(self, batch: bytes) -> None:
+        """Sends a single batch. Raises a PushError if the batch could not be sent."""
+        if self.__mode == "remote_write":
+            request = Request(self.__url, batch, method="POST", headers={
+                "Content-Encoding": "snappy",
+                "Content-Type": "application/x-protobuf",
+                "X-Prometheus-Remote-Write-Version": "0.1.0",
+            })
+        else:
+            request = Request(self.__url, batch, method="PUT", headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+        try:
+            with urlopen(request, timeout=self.__timeout) as response:
+                response.read()
+        except HTTPError as e:
+            # Client errors except rate limiting will fail again, see the remote-write specification
+            raise PushError(f"Received status {e.code} from '{self.__url}'", e.code >= 500 or e.code == 429)
+        except (URLError, OSError) as e:
+            raise PushError(f"Unable to connect to '{self.__url}': {e}", True)
+
+    def __run_flush_loop(self) -> None:
+        """Collects a batch every flush interval until the pusher is stopped."""
+        while not self.__stopped.wait(self.__flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Unable to collect the samples to push: {e}")
+
+    def __run_send_loop(self) -> None:
+        """Sends the queued batches in order until the pusher is stopped."""
+        while not self.__stopped.is_set():
+            with self.__queue_condition:
+                while len(self.__queue) == 0 and not self.__stopped.is_set():
+                    self.__queue_condition.wait()
+                if self.__stopped.is_set():
+                    return
+                batch = self.__queue[0]
+
+            self.__send_with_retry(batch)
+
+            with self.__queue_condition:
+                # The batch may have been dropped already while it was sent
+                if len(self.__queue) > 0 and self.__queue[0] is batch:
+                    self.__queue.popleft()
+
+    def __send_with_retry(self, batch: bytes) -> None:
+        """Sends the batch, retrying with an exponential backoff until it was sent, the maximum number of retries
+        is reached or the error is not retryable."""
+        backoff = self.__retry_backoff
+        for attempt in range(self.__max_retries + 1):
+            try:
+                self.send(batch)
+                return
+            except PushError as e:
+                if not e.retryable or attempt == self.__max_retries:
+                    logging.error(f"Dropping batch after {attempt + 1} attempts: {e}")
+                    return
+                logging.warning(f"Unable to push batch, retrying in {backoff}s: {e}")
+
+            if self.__stopped.wait(backoff):
+                return
+            backoff = min(backoff * 2, self.__max_backoff)
@@ -0,0 +1,127 @@
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+from metric_values import MetricValue, MetricValueCounter, MetricValueGauge
+
+
+class MetricSnapshot():
+    """Persists the values of counters and gauges in a local file, so they survive a restart of the exporter.
+    The file is append-only: every snapshot only appends the values that changed since the previous snapshot,
+    one JSON array [metric name, labels, value] per line, and the last line of a value wins on restore.
+    Once the file holds more than compact_ratio times as many lines as there are values, it is rewritten with
+    only the current values. Snapshots are written by their own thread and only read the values, so the event
+    thread is never blocked."""
+
+    def __init__(self,
+                 path: str,
+                 metrics: Dict[str, MetricValue],
+                 interval: float = 60,
+                 compact_ratio: int = 4) -> None:
+        self.__path: str = path
+        # Only counters and gauges hold state, any other metric is derived from them
+        self.__metrics: Dict[str, MetricValue] = {
+            name: metric for name, metric in metrics.items()
+            if isinstance(metric, (MetricValueCounter, MetricValueGauge))}
+        self.__interval: float = interval
+        self.__compact_ratio: int = compact_ratio
+
+        # Values as written to the file, used to only append changed values
+        self.__written_values: Dict[Tuple[str, Sequence[str]], float] = {}
+        self.__line_count: int = 0
+        self.__lock: threading.Lock = threading.Lock()
+        self.__stopped: threading.Event = threading.Event()
+        self.__thread: Optional[threading.Thread] = None
+
+    def restore(self) -> int:
+        """Restores the values of the file into the metrics. Must be called before any event is processed.
+        Lines that can not be parsed, e.g. a line torn by a crash, and values of metrics whose name or labels
+        changed are skipped.
+
+        :return: The number of restored values."""
+        if not os.path.exists(self.__path):
+            return 0
+
+        values: Dict[Tuple[str, Sequence[str]], float] = {}
+        with open(self.__path, "r") as file:
+            for line in file:
+                self.__line_count += 1
+                try:
+                    name, labels, value = json.loads(line)
+                    metric = self.__metrics[name]
+                    key = tuple(labels[label_name] for label_name in metric._metric_label_names)
+                    if len(labels) != len(key):
+                        continue
+                    values[(name, key)] = float(value)
+                except (ValueError, TypeError, KeyError):
+                    continue
+
+        for (name, key), value in values.items():
+            self.__metrics[name].restore_value(key, value)
+        self.__written_values = values
+        logging.info(f"Restored {len(values)} values from snapshot '{self.__path}'")
+        return len(values)
+
+    def start(self) -> None:
+        """Starts the thread writing a snapshot every interval."""
+        self.__stopped.clear()
+        self.__thread = threading.Thread(target=self.__run, name="snapshot", daemon=True)
+        self.__thread.start()
+
+    def stop(self) -> None:
+        """Stops the thread and writes a final snapshot."""
+        self.__stopped.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        self.write()
+
+    def __collect_values(self) -> Dict[Tuple[str, Sequence[str]], float]:
+        """Returns the published values of every metric. Values staged by a running action are not written, since
+        the action may still reset them or not complete."""
+        values: Dict[Tuple[str, Sequence[str]], float] = {}
+        for name, metric in self.__metrics.items():
+            for key, value in metric.get_published_values().items():
+                values[(name, key)] = value
+        return values
+
+    def __serialize(self, name: str, key: Sequence[str], value: float) -> str:
+        labels = dict(zip(self.__metrics[name]._metric_label_names, key))
+        return json.dumps([name, labels, value], separators=(",", ":")) + "\n"
+
+    def write(self) -> None:
+        """Appends the changed values to the file, or rewrites the file if it grew too large."""
+        with self.__lock:
+            values = self.__collect_values()
+            changed: List[str] = [
+                self.__serialize(name, key, value) for (name, key), value in values.items()
+                if self.__written_values.get((name, key)) != value]
+            if len(changed) == 0:
+                return
+
+            if self.__line_count + len(changed) > self.__compact_ratio * max(len(values), 1):
+                self.__compact(values)
+            else:
+                with open(self.__path, "a") as file:
+                    file.writelines(changed)
+                self.__line_count += len(changed)
+            self.__written_values = values
+
+    def __compact(self, values: Dict[Tuple[str, Sequence[str]], float]) -> None:
+        """Replaces the file at once with a file containing only the given values."""
+        temporary_path = f"{self.__path}.tmp"
+        with open(temporary_path, "w") as file:
+            file.writelines(self.__serialize(name, key, value) for (name, key), value in values.items())
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, self.__path)
+        self.__line_count = len(values)
+
+    def __run(self) -> None:
+        """Writes a snapshot every interval until the snapshot is stopped."""
+        while not self.__stopped.wait(self.__interval):
+            try:
+                self.write()
+            except OSError as e:
+                logging.error(f"Unable to write snapshot '{self.__path}': {e}")
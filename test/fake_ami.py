@@ -0,0 +1,350 @@
+"""Deterministic fake of the Asterisk Manager Interface (AMI), speaking its wire protocol on a local TCP port.
+Used by the integration tests and the benchmarks to exercise the real socket, threading and timeout code paths of
+the ClientWrapper and the ActionExecuter, without an Asterisk.
+
+The server answers the Login, Logoff, Ping, Events and Filter actions like Asterisk. Any other action is answered
+as scripted by FakeAMIServer.script, e.g. with a list of events. Latency and jitter delay every answer, the jitter
+is drawn from a seeded random generator per connection, so a test run is reproducible. Events can be flooded to
+every logged in client, honoring the event mask and the filters of its session, connections can be dropped and
+the output can be split into partial frames."""
+import random
+import socket
+import threading
+from dataclasses import dataclass, field
+from time import monotonic, sleep
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Union
+
+# Headers of an action, a response or an event. A value with several lines is sent as repeated header, e.g. the
+# Output of a Command action.
+Frame = Dict[str, str]
+
+
+def encode_frame(frame: Frame) -> bytes:
+    """Serializes the given headers as AMI frame, terminated by an empty line."""
+    lines = [f"{key}: {line}\r\n" for key, value in frame.items() for line in str(value).split("\n")]
+    return ("".join(lines) + "\r\n").encode()
+
+
+def decode_frame(data: bytes) -> Frame:
+    """Parses the headers of an AMI frame without the terminating empty line."""
+    frame: Frame = {}
+    for line in data.decode(errors="replace").split("\r\n"):
+        key, separator, value = line.partition(":")
+        if separator:
+            frame[key.strip()] = value.strip()
+    return frame
+
+
+@dataclass
+class ScriptedAction():
+    """Answer of the fake server to an action with the given name.
+
+    :param response: Headers of the response, None to never respond, e.g. to test response timeouts.
+    :param events: Events sent after the response, or a function returning them for the headers of the action.
+    :param add_action_id: Whether the ActionID of the action is added to every event that has none.
+    :param disconnect: Whether the connection is closed after the answer.
+    :param truncate: If set, only the given number of bytes of the answer are sent before the connection is
+                     closed, so the last frame is incomplete."""
+    response: Optional[Frame] = field(default_factory=lambda: {"Response": "Success"})
+    events: Union[Iterable[Frame], Callable[[Frame], Iterable[Frame]]] = ()
+    add_action_id: bool = True
+    disconnect: bool = False
+    truncate: Optional[int] = None
+
+
+class FakeAMIConnection():
+    """Session of a client connected to the fake server. Written by the thread of the connection and by the
+    thread flooding events, so every write holds the lock."""
+
+    def __init__(self, server: "FakeAMIServer", sock: socket.socket, seed: int) -> None:
+        self.__server: FakeAMIServer = server
+        self.__socket: socket.socket = sock
+        self.__lock: threading.Lock = threading.Lock()
+        self.__random: random.Random = random.Random(seed)
+
+        self.logged_in: bool = False
+        self.closed: bool = False
+        # Unsolicited events are only sent if the event mask is not off and, if filters are added, their name has
+        # a filter
+        self.event_mask: str = "on"
+        self.event_filter: List[str] = []
+
+    def accepts_event(self, name: str) -> bool:
+        """Checks whether the session receives an unsolicited event with the given name."""
+        if not self.logged_in or self.event_mask == "off":
+            return False
+        return len(self.event_filter) == 0 or name in self.event_filter
+
+    def send(self, data: bytes) -> None:
+        """Writes the given data, split into chunks of the chunk_size of the server if set. Errors of a connection
+        closed by the client are ignored."""
+        chunk_size = self.__server.chunk_size or len(data) or 1
+        with self.__lock:
+            try:
+                for offset in range(0, len(data), chunk_size):
+                    self.__socket.sendall(data[offset:offset + chunk_size])
+                    if self.__server.chunk_size > 0 and self.__server.chunk_delay > 0:
+                        sleep(self.__server.chunk_delay)
+            except OSError:
+                self.closed = True
+
+    def close(self) -> None:
+        """Closes the connection, the client receives an EOF."""
+        self.closed = True
+        try:
+            self.__socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.__socket.close()
+
+    def __delay(self) -> None:
+        """Waits the latency of the server plus a jitter drawn from the generator of the connection."""
+        jitter = self.__random.uniform(-self.__server.jitter, self.__server.jitter) if self.__server.jitter else 0
+        delay = self.__server.latency + jitter
+        if delay > 0:
+            sleep(delay)
+
+    def __answer(self, action: Frame) -> bool:
+        """Answers the given action.
+
+        :return: False if the connection has been closed by the answer."""
+        name = action.get("Action", "")
+        scripted = self.__server.get_script(name)
+        if scripted is None:
+            scripted = self.__answer_builtin(name, action)
+
+        self.__delay()
+        frames = self.__encode_answer(scripted, action)
+        if scripted.truncate is not None:
+            self.send(b"".join(frames)[:scripted.truncate])
+            self.close()
+            return False
+
+        # Long lists are written in batches, so they are never held in memory at once
+        batch: List[bytes] = []
+        for frame in frames:
+            batch.append(frame)
+            if len(batch) >= self.__server.batch_size:
+                self.send(b"".join(batch))
+                batch = []
+        if len(batch) > 0:
+            self.send(b"".join(batch))
+        if scripted.disconnect:
+            self.close()
+            return False
+        return True
+
+    @staticmethod
+    def __encode_answer(scripted: ScriptedAction, action: Frame) -> Iterator[bytes]:
+        """Yields the frames of the answer to the given action."""
+        action_id = action.get("ActionID", "")
+        if scripted.response is not None:
+            yield encode_frame({**scripted.response, "ActionID": action_id})
+        events = scripted.events(action) if callable(scripted.events) else scripted.events
+        for event in events:
+            if scripted.add_action_id and "ActionID" not in event:
+                event = {**event, "ActionID": action_id}
+            yield encode_frame(event)
+
+    def __answer_builtin(self, name: str, action: Frame) -> ScriptedAction:
+        """Returns the answer of Asterisk to the built-in actions."""
+        if name == "Login":
+            if (action.get("Username"), action.get("Secret")) != (self.__server.username, self.__server.secret):
+                return ScriptedAction({"Response": "Error", "Message": "Authentication failed"}, disconnect=True)
+            self.logged_in = True
+            events = [{"Event": "SuccessfulAuth", "Privilege": "security,all"}]
+            if self.__server.fully_booted:
+                events.append({"Event": "FullyBooted", "Privilege": "system,all", "Status": "Fully Booted"})
+            return ScriptedAction({"Response": "Success", "Message": "Authentication accepted"}, events,
+                                  add_action_id=False)
+        if not self.logged_in:
+            return ScriptedAction({"Response": "Error", "Message": "Authentication Required"})
+        if name == "Logoff":
+            return ScriptedAction({"Response": "Goodbye", "Message": "Thanks for all the fish."}, disconnect=True)
+        if name == "Ping":
+            return ScriptedAction({"Response": "Success", "Ping": "Pong"})
+        if name == "Events":
+            self.event_mask = action.get("EventMask", "on").lower()
+            return ScriptedAction({"Response": "Success", "Events": self.event_mask.capitalize()})
+        if name == "Filter":
+            self.event_filter.append(action.get("Filter", "").removeprefix("Event: "))
+            return ScriptedAction({"Response": "Success", "Message": "Filter Added Successfully"})
+        return ScriptedAction({"Response": "Error", "Message": "Invalid/unknown command"})
+
+    def serve(self) -> None:
+        """Sends the greeting and answers the actions of the client until the connection is closed."""
+        self.send(b"Asterisk Call Manager/5.0.0\r\n")
+        data = b""
+        try:
+            while not self.closed:
+                recv = self.__socket.recv(4096)
+                if recv == b"":
+                    break
+                data += recv
+                while b"\r\n\r\n" in data:
+                    pack, data = data.split(b"\r\n\r\n", 1)
+                    action = decode_frame(pack)
+                    self.__server.record_action(action)
+                    if not self.__answer(action):
+                        return
+        except OSError:
+            pass
+        finally:
+            self.closed = True
+            self.__server.remove_connection(self)
+
+
+class FakeAMIServer():
+    """Local fake AMI server, see the module description. The server is started by start() or as context manager
+    and listens on a free port of 127.0.0.1.
+
+    :param latency: Seconds every answer to an action is delayed.
+    :param jitter: Maximum seconds by which the latency is randomly varied in both directions.
+    :param chunk_size: If set, the output is written in chunks of this number of bytes, so frames are split across
+                       several segments, waiting chunk_delay seconds between them.
+    :param batch_size: Number of frames of an answer or a flood written at once.
+    :param seed: Seed of the jitter generators, the connection number is added per connection."""
+
+    def __init__(self,
+                 username: str = "admin",
+                 secret: str = "secret",
+                 latency: float = 0,
+                 jitter: float = 0,
+                 chunk_size: int = 0,
+                 chunk_delay: float = 0.001,
+                 fully_booted: bool = True,
+                 batch_size: int = 100,
+                 seed: int = 0) -> None:
+        self.username: str = username
+        self.secret: str = secret
+        self.latency: float = latency
+        self.jitter: float = jitter
+        self.chunk_size: int = chunk_size
+        self.chunk_delay: float = chunk_delay
+        self.fully_booted: bool = fully_booted
+        self.batch_size: int = batch_size
+        self.__seed: int = seed
+
+        self.__scripts: Dict[str, ScriptedAction] = {}
+        self.__connections: List[FakeAMIConnection] = []
+        self.__connection_count: int = 0
+        self.__actions: List[Frame] = []
+        self.__lock: threading.Lock = threading.Lock()
+        self.__socket: Optional[socket.socket] = None
+        self.port: int = 0
+
+    def __enter__(self) -> "FakeAMIServer":
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def start(self) -> int:
+        """Starts accepting clients in a background thread.
+
+        :return: The port the server listens on."""
+        self.__socket = socket.create_server(("127.0.0.1", 0))
+        self.port = self.__socket.getsockname()[1]
+        threading.Thread(target=self.__accept, args=(self.__socket,), daemon=True).start()
+        return self.port
+
+    def stop(self) -> None:
+        """Stops accepting clients and closes every connection."""
+        if self.__socket is not None:
+            self.__socket.close()
+            self.__socket = None
+        self.disconnect_clients()
+
+    def __accept(self, server_socket: socket.socket) -> None:
+        while True:
+            try:
+                sock, _ = server_socket.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self.__lock:
+                connection = FakeAMIConnection(self, sock, self.__seed + self.__connection_count)
+                self.__connection_count += 1
+                self.__connections.append(connection)
+            threading.Thread(target=connection.serve, daemon=True).start()
+
+    def script(self, name: str, scripted: ScriptedAction) -> None:
+        """Answers every further action with the given name as scripted, replacing a built-in answer or an
+        earlier script."""
+        self.__scripts[name] = scripted
+
+    def get_script(self, name: str) -> Optional[ScriptedAction]:
+        return self.__scripts.get(name, None)
+
+    def record_action(self, action: Frame) -> None:
+        with self.__lock:
+            self.__actions.append(action)
+
+    def remove_connection(self, connection: FakeAMIConnection) -> None:
+        with self.__lock:
+            if connection in self.__connections:
+                self.__connections.remove(connection)
+
+    def get_actions(self, name: Optional[str] = None) -> List[Frame]:
+        """Returns the headers of every received action, or of the actions with the given name, in the order they
+        were received."""
+        with self.__lock:
+            return [action for action in self.__actions if name is None or action.get("Action") == name]
+
+    def get_connection_count(self) -> int:
+        """Returns the number of open connections."""
+        with self.__lock:
+            return len(self.__connections)
+
+    def wait_for_connections(self, count: int, timeout: float = 5) -> bool:
+        """Waits until the given number of connections is open.
+
+        :return: False if the timeout is reached."""
+        end = monotonic() + timeout
+        while self.get_connection_count() != count:
+            if monotonic() > end:
+                return False
+            sleep(0.01)
+        return True
+
+    def flood(self, events: Iterable[Frame]) -> int:
+        """Sends the given unsolicited events to every logged in client whose session receives them. The events are
+        written in batches, so a flood is not limited by the number of writes.
+
+        :return: The number of flooded events."""
+        with self.__lock:
+            connections = list(self.__connections)
+        count = 0
+        batches: Dict[FakeAMIConnection, List[bytes]] = {connection: [] for connection in connections}
+        for event in events:
+            count += 1
+            data = encode_frame(event)
+            for connection in connections:
+                if connection.accepts_event(event.get("Event", "")):
+                    batches[connection].append(data)
+                    if len(batches[connection]) >= self.batch_size:
+                        connection.send(b"".join(batches[connection]))
+                        batches[connection] = []
+        for connection, batch in batches.items():
+            if len(batch) > 0:
+                connection.send(b"".join(batch))
+        return count
+
+    def send_event(self, event: Frame) -> None:
+        """Sends a single unsolicited event, see flood."""
+        self.flood([event])
+
+    def send_raw(self, data: bytes) -> None:
+        """Writes the given bytes as they are to every client, e.g. a partial frame."""
+        with self.__lock:
+            connections = list(self.__connections)
+        for connection in connections:
+            connection.send(data)
+
+    def disconnect_clients(self) -> None:
+        """Closes every connection, as if Asterisk was restarted."""
+        with self.__lock:
+            connections = list(self.__connections)
+        for connection in connections:
+            connection.close()
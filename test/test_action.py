@@ -1,7 +1,11 @@
+import math
 from dataclasses import dataclass
 from typing import Dict
 import unittest
-from action import ActionExecuter, Action
+from time import monotonic, sleep, time
+from prometheus_client import CollectorRegistry
+from command import CommandParser
+from action import ActionExecuter, ActionHeaders, ActionScheduler, Action, Discovery, TokenBucket
 
 
 @dataclass
@@ -21,6 +25,23 @@ class FutureResponseMock():
     response: ResponseMock
 
 
+class DelayedFutureResponseMock():
+    def __init__(self, response: ResponseMock, delay: float) -> None:
+        self.__response = response
+        self.__delay = delay
+
+    @property
+    def response(self) -> ResponseMock:
+        sleep(self.__delay)
+        return self.__response
+
+
+@dataclass
+class ActionMock():
+    name: str
+    keys: Dict[str, str]
+
+
 class ClientMock():
     def __init__(self) -> None:
         self.event_filter = []
@@ -51,18 +72,36 @@ class ClientMock():
         self.last_action_received = action
         return self.send_action_result
 
+    def send_action_bytes(self, action_id, data, response_timeout) -> None:
+        self.response_timeout = response_timeout
+        lines = data.decode().split("\r\n")
+        self.assertEqual(lines[-2:], ["", ""])
+        keys = dict(line.split(": ", 1) for line in lines[1:-2])
+        self.assertEqual(keys["ActionID"], action_id)
+        return self.send_action(ActionMock(lines[0].split(": ", 1)[1], keys))
+
+    def assertEqual(self, first, second) -> None:
+        if first != second:
+            raise AssertionError(f"{first} != {second}")
+
 
 class FilterMock():
     def __init__(self) -> None:
         self.run_on_scrape_start = False
         self.action_id = ""
+        self.processed_events = []
 
-    def on_scrape_start(self, action_id: str):
+    def on_scrape_start(self, *action_ids: str):
         self.run_on_scrape_start = True
-        self.action_id = action_id
+        self.action_id = action_ids[0]
+        self.action_ids = action_ids
 
-    def on_scrape_end(self):
+    def on_scrape_end(self, complete: bool = True):
         self.action_id = None
+        self.complete = complete
+
+    def process_event(self, event):
+        self.processed_events.append(event)
 
 
 class TestActionExecuter(unittest.TestCase):
@@ -76,7 +115,8 @@ class TestActionExecuter(unittest.TestCase):
         self.__f2 = FilterMock()
 
         self.__ae = ActionExecuter(self.__client_mock)
-        self.__ae._ActionExecuter__action_id = "1"
+        self.__ae._ActionExecuter__action_ids = ["1"]
+        self.__ae._ActionExecuter__pending_action_ids = {"1"}
         self.__ae._ActionExecuter__action = Action("ExpectedEvent",
                                                    [self.__f1,
                                                     self.__f2],
@@ -90,20 +130,20 @@ class TestActionExecuter(unittest.TestCase):
     def test__on_event(self) -> None:
         self.__ae._ActionExecuter__on_event(
             EventMock("TestEvent", {"ActionID": "1"}))
-        self.assertFalse(
-            self.__ae._ActionExecuter__finished,
+        self.assertEqual(
+            self.__ae._ActionExecuter__pending_action_ids, {"1"},
             "Expected ActionExecuter to not be finished")
 
         self.__ae._ActionExecuter__on_event(
             EventMock("ExpectedEndEvent", {"ActionID": "2"}))
-        self.assertFalse(
-            self.__ae._ActionExecuter__finished,
+        self.assertEqual(
+            self.__ae._ActionExecuter__pending_action_ids, {"1"},
             "Expected ActionExecuter to not be finished")
 
         self.__ae._ActionExecuter__on_event(
             EventMock("ExpectedEndEvent", {"ActionID": "1"}))
-        self.assertTrue(
-            self.__ae._ActionExecuter__finished,
+        self.assertEqual(
+            self.__ae._ActionExecuter__pending_action_ids, set(),
             "Expected ActionExecuter to be finished")
 
     def test__attach_event_filter(self) -> None:
@@ -136,18 +176,18 @@ class TestActionExecuter(unittest.TestCase):
         # Test general AMI error
         self.__client_mock.send_action_result = FutureResponseMock(
             ResponseMock("error", {"Message": "Some error"}))
-        result = self.__ae._ActionExecuter__send_action()
+        result = self.__ae._ActionExecuter__send_action("1", {})
         self.assertFalse(result, "Expected result to be false")
 
         # Test timeout
         self.__client_mock.send_action_result = FutureResponseMock(None)
-        result = self.__ae._ActionExecuter__send_action()
+        result = self.__ae._ActionExecuter__send_action("1", {})
         self.assertFalse(result, "Expected result to be false")
 
         # Test successful action
         self.__client_mock.send_action_result = FutureResponseMock(
             ResponseMock("Success", {"Message": "Success"}))
-        result = self.__ae._ActionExecuter__send_action()
+        result = self.__ae._ActionExecuter__send_action("1", {})
         self.assertTrue(result, "Expected result to be true")
 
         self.assertEqual(
@@ -161,25 +201,39 @@ class TestActionExecuter(unittest.TestCase):
         self.assertEqual(
             self.__client_mock.last_action_received.keys["ActionID"], "1")
 
+        # The response time includes waiting for the response
+        self.__client_mock.send_action_result = DelayedFutureResponseMock(
+            ResponseMock("Success", {"Message": "Success"}), 0.05)
+        self.assertTrue(self.__ae._ActionExecuter__send_action("1", {}))
+        self.assertGreaterEqual(self.__ae.get_last_response_time(), 0.05)
+
     def test__collect_event(self) -> None:
-        e1 = EventMock("Event1", {})
-        e2 = EventMock("Event2", {})
-        e3 = EventMock("ExpectedEndEvent", {"ActionID": "1"})
+        self.__ae._ActionExecuter__wait_sequence_timeout = 0
+        self.__ae._ActionExecuter__pending_action_ids = set()
+        self.__client_mock.send_action_result = FutureResponseMock(
+            ResponseMock("Success", {"Message": "Success"}))
 
-        self.__ae._ActionExecuter__on_event(e1)
-        self.__ae._ActionExecuter__on_event(e2)
-        self.__ae._ActionExecuter__on_event(e3)
+        def send_action(action):
+            self.__ae._ActionExecuter__on_event(EventMock("Event1", {}))
+            self.__ae._ActionExecuter__on_event(EventMock("ExpectedEndEvent", {"ActionID": action.keys["ActionID"]}))
+            return self.__client_mock.send_action_result
 
+        self.__client_mock.send_action = send_action
         self.assertTrue(
-            self.__ae._ActionExecuter__collect_events(),
-            "Expected action executer to already finished collecting every event")
+            self.__ae._ActionExecuter__collect_events([{}]),
+            "Expected action executer to finish collecting every event")
+
+        # Executions whose 'until' event is missing reach the event timeout
+        self.__ae._ActionExecuter__action.event_timeout = 0
+        self.__client_mock.send_action = lambda action: self.__client_mock.send_action_result
+        self.assertFalse(self.__ae._ActionExecuter__collect_events([{}]))
 
     def test__detach_event_filter(self) -> None:
         self.__client_mock.add_event_filter([self.__f1, self.__f2])
         self.__client_mock.attach_event_listener(
             self.__ae._ActionExecuter__on_event)
 
-        self.__ae._ActionExecuter__detach_event_filter()
+        self.__ae._ActionExecuter__detach_event_filter(False)
 
         self.assertEqual(len(self.__client_mock.event_filter), 0,
                          "Expected no event filter to be attached to the client.")
@@ -187,5 +241,232 @@ class TestActionExecuter(unittest.TestCase):
         self.assertEqual(len(self.__client_mock.event_listener), 0,
                          "Expected no event listener to be attached to the client.")
 
-        self.assertFalse(self.__ae._ActionExecuter__finished,
-                         "Expected action executer to not be finished anymore")
+        self.assertEqual(self.__ae._ActionExecuter__pending_action_ids, set(),
+                         "Expected action executer to not wait for any execution anymore")
+
+        self.assertFalse(self.__f1.complete, "Expected filters to be signaled that the action did not complete")
+
+    def test_exec(self) -> None:
+        self.__ae._ActionExecuter__wait_sequence_timeout = 0
+        action = self.__ae._ActionExecuter__action
+        action.event_timeout = 0
+
+        self.__client_mock.get_next_action_id = lambda: "1"
+        self.__client_mock.send_action_result = FutureResponseMock(None)
+        self.assertFalse(self.__ae.exec(action))
+        self.assertFalse(self.__f1.complete)
+        self.assertEqual(action.last_execution, 0,
+                         "Expected last execution to not be updated on failure")
+
+        self.__client_mock.send_action_result = FutureResponseMock(
+            ResponseMock("Success", {"Message": "Success"}))
+        self.__client_mock.send_action = lambda a: (
+            self.__ae._ActionExecuter__on_event(EventMock("ExpectedEndEvent", {"ActionID": "1"})),
+            self.__client_mock.send_action_result)[1]
+        self.assertTrue(self.__ae.exec(action))
+        self.assertTrue(self.__f1.complete)
+        self.assertAlmostEqual(action.last_execution, time(), delta=1,
+                               msg="Expected last execution to be updated")
+
+    def test_exec_discovery(self) -> None:
+        self.__ae._ActionExecuter__wait_sequence_timeout = 0
+        action = Action("ExpectedEvent", [self.__f1, self.__f2], "ExpectedEndEvent", 1, 1, 1, "default", "python",
+                        parameters={"Queue": "$Queue", "Member": "fixed"},
+                        discovery=Discovery("QueueSummary", "QueueSummary", "QueueSummaryComplete", ["Queue"], 1, 1),
+                        max_concurrency=2)
+
+        action_ids = iter(str(i) for i in range(100))
+        self.__client_mock.get_next_action_id = lambda: next(action_ids)
+        sent_actions = []
+        max_pending = [0]
+
+        def send_action(sent):
+            sent_actions.append(sent)
+            on_event = self.__client_mock.event_listener[-1]
+            action_id = sent.keys["ActionID"]
+            if sent.name == "QueueSummary":
+                sleep(0.1)
+                for queue in ["q1", "q2", "q1", "q3"]:
+                    on_event(EventMock("QueueSummary", {"ActionID": action_id, "Queue": queue}))
+                on_event(EventMock("QueueSummaryComplete", {"ActionID": action_id}))
+            else:
+                max_pending[0] = max(max_pending[0], len(self.__ae._ActionExecuter__pending_action_ids))
+                # The end event of the first execution arrives after the other executions were sent
+                if sent.keys["Queue"] != "q1":
+                    self.__ae._ActionExecuter__on_event(EventMock("ExpectedEndEvent", {"ActionID": action_id}))
+                if sent.keys["Queue"] == "q3":
+                    self.__ae._ActionExecuter__on_event(EventMock("ExpectedEndEvent", {"ActionID": "1"}))
+            return FutureResponseMock(ResponseMock("Success", {}))
+
+        self.__client_mock.send_action = send_action
+        self.assertTrue(self.__ae.exec(action))
+        self.assertEqual([(sent.name, sent.keys.get("Queue", None)) for sent in sent_actions],
+                         [("QueueSummary", None), ("ExpectedEvent", "q1"), ("ExpectedEvent", "q2"),
+                          ("ExpectedEvent", "q3")])
+        self.assertEqual(sent_actions[1].keys["Member"], "fixed")
+        self.assertEqual(max_pending[0], 2, "Expected at most max_concurrency executions to wait at a time")
+        self.assertEqual(self.__f1.action_ids, ("1", "2", "3"),
+                         "Expected the filters to collect the events of every execution")
+        self.assertEqual(action.discovery.entities, [{"Queue": "q1"}, {"Queue": "q2"}, {"Queue": "q3"}])
+        self.assertEqual(self.__client_mock.event_listener, [], "Expected the discovery listener to be detached")
+        self.assertLess(self.__ae.get_last_duration(), 0.1, "Expected the duration to not include the discovery")
+
+        # The discovered entities are cached until the refresh interval has passed
+        sent_actions.clear()
+        action.event_timeout = 0
+        self.assertFalse(action.discovery.is_due())
+        self.assertFalse(self.__ae.exec(action), "Expected the first execution to miss its end event")
+        self.assertNotIn("QueueSummary", [sent.name for sent in sent_actions])
+
+        # A failed discovery keeps the entities of the last successful one
+        action.discovery.last_refresh = 0
+        self.__client_mock.send_action = lambda sent: FutureResponseMock(None)
+        self.assertFalse(self.__ae.exec(action))
+        self.assertEqual(len(action.discovery.entities), 3)
+
+    def test_exec_command(self) -> None:
+        self.__ae._ActionExecuter__wait_sequence_timeout = 0
+        action = Action("Command", [self.__f1], "", 1, 1, 1, "default", "python",
+                        parameters={"Command": "core show calls"},
+                        command_parsers=[CommandParser("ActiveCalls", regex=r"^(?P<Count>\d+) active calls?"),
+                                         CommandParser("ProcessedCalls", regex=r"^(?P<Count>\d+) calls? processed")])
+        self.__client_mock.get_next_action_id = lambda: "1"
+        self.__client_mock.send_action_result = FutureResponseMock(
+            ResponseMock("Success", {"Output": "3 active calls\n10 calls processed"}))
+        self.assertTrue(self.__ae.exec(action), "Expected a command to complete with its response")
+        self.assertEqual(self.__client_mock.last_action_received.keys["Command"], "core show calls")
+        self.assertEqual([(event.name, event.keys) for event in self.__f1.processed_events],
+                         [("ActiveCalls", {"Count": "3", "ActionID": "1"}),
+                          ("ProcessedCalls", {"Count": "10", "ActionID": "1"})])
+        self.assertTrue(self.__f1.complete)
+
+
+class ActionExecuterMock():
+    def __init__(self) -> None:
+        self.executed = []
+        self.result = True
+        self.response_time = 0
+
+    def exec(self, action) -> bool:
+        self.executed.append(action.name)
+        return self.result
+
+    def get_last_response_time(self) -> float:
+        return self.response_time
+
+    def get_last_duration(self) -> float:
+        return 0.5
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_try_acquire(self) -> None:
+        bucket = TokenBucket(0.001, 2)
+        self.assertTrue(bucket.try_acquire())
+        self.assertTrue(bucket.try_acquire())
+        self.assertFalse(bucket.try_acquire(), "Expected bucket to be empty after the burst")
+        self.assertAlmostEqual(bucket.get_wait_time(), 1000, delta=1)
+
+        bucket = TokenBucket(1000, 1)
+        self.assertTrue(bucket.try_acquire())
+        self.assertLessEqual(bucket.get_wait_time(), 0.001)
+
+    def test_init(self) -> None:
+        self.assertRaisesRegex(Exception, "rate must be greater than 0", TokenBucket, 0)
+        self.assertRaisesRegex(Exception, "rate must be greater than 0", TokenBucket, -1)
+        self.assertRaisesRegex(Exception, "burst must be at least 1", TokenBucket, 1, 0)
+
+
+class TestActionScheduler(unittest.TestCase):
+    def setUp(self) -> None:
+        self.__executer = ActionExecuterMock()
+        self.__registry = CollectorRegistry()
+
+    def test_exec(self) -> None:
+        scheduler = ActionScheduler(self.__executer, registry=self.__registry)
+        action_1 = Action("Action1", [], "EndEvent", 1, 1, 1, "default", "python")
+        action_2 = Action("Action2", [], "EndEvent", 1, 1, 1, "default", "python", resync_interval=60,
+                          last_execution=time())
+        scheduler.exec([action_1, action_2])
+        scheduler.exec([action_1, action_2])
+        self.assertEqual(self.__executer.executed, ["Action1", "Action1"], "Expected only due actions to be executed")
+        self.assertIsNotNone(
+            self.__registry.get_sample_value("action_effective_interval_seconds", {"action": "Action1"}))
+        self.assertEqual(self.__registry.get_sample_value("action_stale", {"action": "Action1"}), 0)
+        self.assertIsNotNone(
+            self.__registry.get_sample_value("action_last_success_timestamp_seconds", {"action": "Action1"}))
+        self.assertEqual(self.__registry.get_sample_value("action_duration_seconds", {"action": "Action1"}), 0.5)
+
+        self.__executer.result = False
+        scheduler.exec([action_1])
+        self.assertEqual(self.__registry.get_sample_value("action_stale", {"action": "Action1"}), 1)
+
+    def test_rate_limit(self) -> None:
+        scheduler = ActionScheduler(self.__executer, registry=self.__registry)
+        action = Action("Action", [], "EndEvent", 1, 1, 1, "default", "python", rate_limiter=TokenBucket(0.001))
+        for _ in range(3):
+            scheduler.exec([action])
+        self.assertEqual(len(self.__executer.executed), 1, "Expected action exceeding the rate limit to be skipped")
+
+    def test_global_rate_limit(self) -> None:
+        scheduler = ActionScheduler(self.__executer, TokenBucket(20), self.__registry)
+        action_list = [Action(f"Action{i}", [], "EndEvent", 1, 1, 1, "default", "python") for i in range(3)]
+        start = monotonic()
+        scheduler.exec(action_list)
+        self.assertEqual(len(self.__executer.executed), 3)
+        self.assertGreaterEqual(monotonic() - start, 0.09, "Expected actions to wait for the global rate limit")
+
+    def test_backoff(self) -> None:
+        scheduler = ActionScheduler(self.__executer, registry=self.__registry)
+        action = Action("Action", [], "EndEvent", 1, 1, 1, "default", "python", max_backoff=4)
+
+        # Failed executions double the backoff up to max_backoff
+        self.__executer.result = False
+        for _ in range(7):
+            scheduler.exec([action])
+        self.assertEqual(len(self.__executer.executed), 3)
+        self.assertEqual(action.backoff, 4)
+        self.assertEqual(self.__registry.get_sample_value("action_backoff_factor", {"action": "Action"}), 4)
+
+        # Healthy executions halve it again
+        self.__executer.result = True
+        for _ in range(4):
+            scheduler.exec([action])
+        self.assertEqual(action.backoff, 2)
+
+        # Slow responses back off like failures
+        action.slow_response_time = 1
+        self.__executer.response_time = 2
+        for _ in range(2):
+            scheduler.exec([action])
+        self.assertEqual(action.backoff, 4)
+
+
+class TestAction(unittest.TestCase):
+    def test_is_due(self) -> None:
+        action = Action("Action", [], "EndEvent", 1, 1, 1, "default", "python")
+        self.assertTrue(action.is_due(), "Expected action without resync interval to always be due")
+
+        action.resync_interval = 60
+        self.assertTrue(action.is_due(), "Expected action to be due before the first execution")
+
+        action.last_execution = time()
+        self.assertFalse(action.is_due(), "Expected action to not be due within the resync interval")
+
+        action.last_execution = time() - 61
+        self.assertTrue(action.is_due(), "Expected action to be due after the resync interval")
+
+        action.resync_interval = math.inf
+        self.assertFalse(action.is_due(), "Expected action with infinite resync interval to not be due")
+        action.last_execution = 0
+        self.assertTrue(action.is_due(), "Expected action with infinite resync interval to be due after a reconnect")
+
+    def test_headers(self) -> None:
+        action = Action("QueueStatus", [], "EndEvent", 1, 1, 1, "default", "python",
+                        parameters={"Queue": "$Queue", "Member": "PJSIP/100"})
+        self.assertEqual(action.headers.serialize("7", {"Queue": "support"}),
+                         b"Action: QueueStatus\r\nPriority: 1\r\nContext: default\r\nCallerID: python\r\n"
+                         b"Member: PJSIP/100\r\nQueue: support\r\nActionID: 7\r\n\r\n")
+        self.assertIn(b"Queue: \r\n", action.headers.serialize("8", {}))
+
+        with self.assertRaises(Exception):
+            ActionHeaders("QueueStatus", {"Queue": "support\r\nAction: Originate"})
@@ -0,0 +1,82 @@
+import unittest
+from asterisk.ami import Event
+from prometheus_client import REGISTRY
+from channel_tracker import ChannelTracker, _parse_duration
+from metric_values import LabelMapping
+
+
+def new_channel(uniqueid: str, channel: str) -> Event:
+    return Event("Newchannel", {"Uniqueid": uniqueid, "Channel": channel})
+
+
+class TestChannelTracker(unittest.TestCase):
+    def test_parse_duration(self):
+        self.assertEqual(_parse_duration("01:02:03"), 3723)
+        self.assertEqual(_parse_duration("invalid"), 0)
+
+    def test_lifecycle(self):
+        tracker = ChannelTracker("test_channel_tracker_lifecycle", "Channels", {"trunk": "$Channel"})
+        tracker.add_label_mapping("trunk", LabelMapping([(r"PJSIP/(trunk\d+)-", r"\1")], "internal"))
+        tracker.init()
+
+        tracker.process_event(new_channel("1", "PJSIP/trunk1-0001"))
+        tracker.process_event(new_channel("2", "PJSIP/trunk1-0002"))
+        tracker.process_event(new_channel("3", "PJSIP/100-0003"))
+        tracker.process_event(new_channel("3", "PJSIP/100-0003"))
+        self.assertEqual(tracker.get_channel_count(), 3)
+        self.assertEqual(tracker.get_value(("trunk1",)), 2)
+        self.assertEqual(tracker.get_value(("internal",)), 1)
+
+        tracker.process_event(Event("BridgeEnter", {"Uniqueid": "1"}))
+        tracker.process_event(Event("BridgeEnter", {"Uniqueid": "1"}))
+        self.assertEqual(
+            REGISTRY.get_sample_value("test_channel_tracker_lifecycle_bridged", {"trunk": "trunk1"}), 1)
+        tracker.process_event(Event("BridgeLeave", {"Uniqueid": "1"}))
+        self.assertEqual(
+            REGISTRY.get_sample_value("test_channel_tracker_lifecycle_bridged", {"trunk": "trunk1"}), 0)
+
+        tracker.process_event(Event("Hangup", {"Uniqueid": "1"}))
+        tracker.process_event(Event("Hangup", {"Uniqueid": "unknown"}))
+        self.assertEqual(tracker.get_channel_count(), 2)
+        self.assertEqual(
+            REGISTRY.get_sample_value("test_channel_tracker_lifecycle_active", {"trunk": "trunk1"}), 1)
+        self.assertEqual(
+            REGISTRY.get_sample_value("test_channel_tracker_lifecycle_duration_seconds_count", {"trunk": "trunk1"}), 1)
+
+    def test_resync(self):
+        tracker = ChannelTracker("test_channel_tracker_resync", "Channels", {})
+        tracker.init()
+        tracker.process_event(new_channel("lost", "PJSIP/100-0001"))
+        tracker.process_event(new_channel("kept", "PJSIP/100-0002"))
+
+        tracker.on_scrape_start()
+        tracker.process_event(Event("CoreShowChannel", {"Uniqueid": "kept", "Duration": "00:01:00", "BridgeId": "b"}))
+        tracker.process_event(Event("CoreShowChannel", {"Uniqueid": "hungup", "Duration": "00:00:10"}))
+        tracker.process_event(new_channel("new", "PJSIP/100-0003"))
+        tracker.process_event(Event("Hangup", {"Uniqueid": "hungup"}))
+        self.assertEqual(tracker.get_channel_count(), 3, "Expected index to be unchanged until the resync ends")
+
+        tracker.on_scrape_end()
+        self.assertEqual(tracker.get_channel_count(), 2)
+        self.assertEqual(tracker.get_value(()), 2)
+        self.assertEqual(REGISTRY.get_sample_value("test_channel_tracker_resync_bridged"), 1)
+
+        # The start of resynced channels is derived from their duration
+        tracker.process_event(Event("Hangup", {"Uniqueid": "kept"}))
+        self.assertGreaterEqual(REGISTRY.get_sample_value("test_channel_tracker_resync_duration_seconds_sum"), 60)
+
+        # CoreShowChannel events outside of a resync are ignored
+        tracker.process_event(Event("CoreShowChannel", {"Uniqueid": "other", "Duration": "00:00:10"}))
+        tracker.on_scrape_end()
+        self.assertEqual(tracker.get_channel_count(), 1)
+
+        # An incomplete resync keeps the current index
+        tracker.on_scrape_start()
+        tracker.process_event(Event("CoreShowChannel", {"Uniqueid": "partial", "Duration": "00:00:10"}))
+        tracker.on_scrape_abort()
+        tracker.on_scrape_end()
+        self.assertEqual(tracker.get_channel_count(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -49,10 +49,14 @@ class EventFilterMock():
 class SocketMock():
     def __init__(self) -> None:
         self.timeout = -1
+        self.sent_data = []
 
     def settimeout(self, val):
         self.timeout = val
 
+    def sendall(self, data):
+        self.sent_data.append(data)
+
 
 class ThreadMock():
     def __init__(self) -> None:
@@ -65,6 +69,7 @@ class ThreadMock():
 class AMIClientMock():
     def __init__(self, address, port, timeout) -> None:
         self.send_action_last_action = None
+        self.sent_actions = []
         self.send_action_response = None
         self.action_count = 0
         self.connected = False
@@ -74,6 +79,7 @@ class AMIClientMock():
         self.login_response = None
 
         self._event_listeners = []
+        self._futures = {}
         self._timeout = 10
         self._socket = SocketMock()
         self._thread = ThreadMock()
@@ -89,6 +95,7 @@ class AMIClientMock():
 
     def send_action(self, action):
         self.send_action_last_action = action
+        self.sent_actions.append(action)
         return self.send_action_response
 
     def next_action_id(self) -> int:
@@ -143,10 +150,56 @@ class TestClientWrapper(unittest.TestCase):
 
         self.assertEqual(self.__ami_client.logged_in_username, "<username>")
         self.assertEqual(self.__ami_client.logged_in_secret, "<secret>")
-        self.assertEqual(
-            self.__ami_client._socket.timeout,
-            None,
-            "Expected socket timeout to be set to None")
+
+    def test_login_event_mask(self):
+        self.__client._ClientWrapper__event_mask = "off"
+        self.__ami_client.login_response = FutureResponseMock(ResponseMock("Success", False))
+        self.__ami_client.send_action_response = FutureResponseMock(ResponseMock("Success", False))
+        self.__client._ClientWrapper__is_login_validated = True
+        self.__client._ClientWrapper__is_asterisk_fully_booted = True
+        self.__client.login("<username>", "<secret>", 0, 0)
+
+        action = self.__ami_client.send_action_last_action
+        self.assertEqual(action.name, "Events")
+        self.assertEqual(action.keys["EventMask"], "off", "Expected event mask to be set after login")
+
+    def test_set_event_mask(self):
+        self.__ami_client.send_action_response = FutureResponseMock(ResponseMock("Success", False))
+        self.assertTrue(self.__client.set_event_mask("system,call"))
+        self.assertEqual(self.__ami_client.send_action_last_action.keys["EventMask"], "system,call")
+
+        self.__ami_client.send_action_response = FutureResponseMock(ResponseMock("Error", True))
+        self.assertFalse(self.__client.set_event_mask("off"))
+
+    def test_login_event_names(self):
+        self.__ami_client.login_response = FutureResponseMock(ResponseMock("Success", False))
+        self.__ami_client.send_action_response = FutureResponseMock(ResponseMock("Success", False))
+        self.__client._ClientWrapper__is_login_validated = True
+        self.__client._ClientWrapper__is_asterisk_fully_booted = True
+
+        self.__client._ClientWrapper__event_names = ["Hangup", "Newchannel"]
+        self.__client.login("<username>", "<secret>", 0, 0)
+        self.assertEqual([action.keys["Filter"] for action in self.__ami_client.sent_actions],
+                         ["Event: Hangup", "Event: Newchannel"])
+
+        self.__ami_client.sent_actions.clear()
+        self.__client._ClientWrapper__event_names = []
+        self.__client.login("<username>", "<secret>", 0, 0)
+        self.assertEqual(self.__ami_client.sent_actions[0].name, "Events",
+                         "Expected events to be turned off without any event name")
+
+    def test_add_event_name_filter(self):
+        self.__ami_client.send_action_response = FutureResponseMock(ResponseMock("Success", False))
+        self.assertTrue(self.__client.add_event_name_filter(["Hangup"]))
+        action = self.__ami_client.send_action_last_action
+        self.assertEqual(action.name, "Filter")
+        self.assertEqual(action.keys["Operation"], "Add")
+        self.assertEqual(action.keys["Filter"], "Event: Hangup")
+
+        self.__ami_client.send_action_response = FutureResponseMock(ResponseMock("Error", True))
+        self.assertFalse(self.__client.add_event_name_filter(["Hangup", "Newchannel"]))
+        self.assertEqual(self.__ami_client.send_action_last_action.keys["Filter"], "Event: Hangup",
+                         "Expected no further filter to be sent after an error")
 
     def test_logoff(self):
         self.__ami_client._event_listeners.append(
@@ -186,6 +239,18 @@ class TestClientWrapper(unittest.TestCase):
             self.__client.check_event_thread_health(),
             "Expected thread to not be alive")
 
+    def test_is_ready(self):
+        self.__client._ClientWrapper__is_login_validated = False
+        self.__client._ClientWrapper__is_asterisk_fully_booted = True
+        self.__ami_client._thread.alive = True
+        self.assertFalse(self.__client.is_ready(), "Expected client to not be ready before login")
+
+        self.__client._ClientWrapper__is_login_validated = True
+        self.assertTrue(self.__client.is_ready(), "Expected client to be ready")
+
+        self.__ami_client._thread.alive = False
+        self.assertFalse(self.__client.is_ready(), "Expected client to not be ready without event thread")
+
     def test_add_event_filter(self):
         f1 = EventFilterMock()
         f2 = EventFilterMock()
@@ -246,3 +311,11 @@ class TestClientWrapper(unittest.TestCase):
         self.assertEqual(self.__ami_client.send_action_last_action,
                          action,
                          "Expected action to be send to the ami client")
+
+    def test_send_action_bytes(self):
+        data = b"Action: Ping\r\nActionID: 5\r\n\r\n"
+        future = self.__client.send_action_bytes("5", data, 3)
+        self.assertEqual(self.__ami_client._socket.sent_data, [data])
+        self.assertIs(self.__ami_client._futures["5"], future,
+                      "Expected the response to be assigned to the returned future")
+        self.assertEqual(future._timeout, 3)
@@ -0,0 +1,53 @@
+import unittest
+from dataclasses import dataclass, field
+from typing import Dict, List
+from command import CommandParser, iter_command_output
+
+
+@dataclass
+class ResponseMock():
+    keys: Dict[str, str]
+    follows: List[str] = field(default_factory=list)
+
+
+class TestCommandParser(unittest.TestCase):
+    def test_parse_regex(self):
+        parser = CommandParser("ActiveCalls", regex=r"^(?P<Count>\d+) active calls?(?P<Unused> none)?")
+        self.assertEqual(parser.parse("3 active calls"), {"Count": "3", "Unused": ""})
+        self.assertEqual(parser.parse("1 active call"), {"Count": "1", "Unused": ""})
+        self.assertIsNone(parser.parse("10 calls processed"))
+
+    def test_parse_columns(self):
+        parser = CommandParser("Peer", columns=["Name", "Host", "Status"], match=r"^\d+/")
+        self.assertEqual(parser.parse("100/100   10.0.0.1   OK (12 ms)"),
+                         {"Name": "100/100", "Host": "10.0.0.1", "Status": "OK (12 ms)"})
+        self.assertIsNone(parser.parse("Name/username   Host   Status"), "Expected the header to be skipped")
+        self.assertIsNone(parser.parse("101/101   (Unspecified)"), "Expected incomplete lines to be skipped")
+
+        parser = CommandParser("Row", columns=["A", "B"], separator=",")
+        self.assertEqual(parser.parse("x, y,z"), {"A": "x", "B": "y,z"})
+
+    def test_invalid(self):
+        with self.assertRaises(Exception):
+            CommandParser("Row")
+        with self.assertRaises(Exception):
+            CommandParser("Row", regex=r"(?P<A>\d+)", columns=["A"])
+        with self.assertRaises(Exception):
+            CommandParser("Row", regex=r"\d+ active calls")
+        with self.assertRaisesRegex(Exception, "at least one column"):
+            CommandParser("Row", columns=[])
+
+
+class TestIterCommandOutput(unittest.TestCase):
+    def test_output_headers(self):
+        response = ResponseMock({"Output": "3 active calls\n10 calls processed"})
+        self.assertEqual(list(iter_command_output(response)), ["3 active calls", "10 calls processed"])
+
+    def test_follows(self):
+        response = ResponseMock({}, ["3 active calls", "10 calls processed", "--END COMMAND--"])
+        self.assertEqual(list(iter_command_output(response)), ["3 active calls", "10 calls processed"])
+        self.assertEqual(list(iter_command_output(ResponseMock({}, None))), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+from typing import Dict
+from dataclasses import dataclass
+from condition import Condition
+
+
+@dataclass
+class EventMock():
+    name: str
+    keys: Dict[str, str]
+
+
+class TestCondition(unittest.TestCase):
+    def test_matches(self):
+        event = EventMock("Newchannel", {"Context": "from-trunk",
+                                         "Channel": "PJSIP/tenant1-00000001",
+                                         "Duration": "15",
+                                         "Invalid": "invalid"})
+
+        self.assertTrue(Condition("Context", "equals", "from-trunk").matches(event))
+        self.assertFalse(Condition("Context", "equals", "from-internal").matches(event))
+        self.assertTrue(Condition("Context", "in", ["from-internal", "from-trunk"]).matches(event))
+        self.assertFalse(Condition("Context", "in", ["from-internal"]).matches(event))
+        self.assertTrue(Condition("Channel", "regex", "PJSIP/tenant1-.*").matches(event))
+        self.assertFalse(Condition("Channel", "regex", "tenant1").matches(event),
+                         "Expected regex to match the beginning of the attribute")
+
+        self.assertTrue(Condition("Duration", "gt", 10).matches(event))
+        self.assertFalse(Condition("Duration", "gt", 15).matches(event))
+        self.assertTrue(Condition("Duration", "ge", 15).matches(event))
+        self.assertTrue(Condition("Duration", "lt", 20).matches(event))
+        self.assertFalse(Condition("Duration", "lt", 15).matches(event))
+        self.assertTrue(Condition("Duration", "le", 15).matches(event))
+        self.assertFalse(Condition("Invalid", "gt", 0).matches(event),
+                         "Expected non numeric attribute to not match")
+
+        self.assertFalse(Condition("Missing", "equals", "").matches(event),
+                         "Expected missing attribute to not match")
+        self.assertRaisesRegex(Exception, "Invalid condition operator", Condition, "Context", "undefined", "")
+
+    def test_matches_cache(self):
+        condition = Condition("Context", "equals", "from-trunk")
+        event = EventMock("Newchannel", {"Context": "from-trunk"})
+        self.assertTrue(condition.matches(event))
+
+        # The result of the last event is reused
+        event.keys["Context"] = "from-internal"
+        self.assertTrue(condition.matches(event))
+
+        self.assertFalse(condition.matches(EventMock("Newchannel", {"Context": "from-internal"})))
@@ -1,5 +1,13 @@
+import math
 import unittest
+import yaml
+from pathlib import Path
+from jsonschema import ValidationError, validate
 import config
+from action import Discovery
+from metric_values import MetricValueGauge
+from event_sink import EventSinkOutputUDP
+from test.test_metric_values import EventMock
 
 
 class TestConfig(unittest.TestCase):
@@ -21,6 +29,35 @@ class TestConfig(unittest.TestCase):
             "label_2_value",
             "Expected label 2 to be correctly loaded")
 
+    def test__load_metric_labels_aggregation(self):
+        c = {"name": "metric_name",
+             "labels": [
+                 {"name": "label_1", "value": "$a"},
+                 {"name": "label_2", "value": "$b"},
+                 {"name": "label_3", "value": "$c"}],
+             "aggregate_by": ["label_1", "label_2"]}
+        self.assertEqual(config._load_metric_labels(c), {"label_1": "$a", "label_2": "$b"})
+
+        c["drop_labels"] = ["label_1"]
+        self.assertEqual(config._load_metric_labels(c), {"label_2": "$b"})
+
+        del c["aggregate_by"]
+        self.assertEqual(config._load_metric_labels(c), {"label_2": "$b", "label_3": "$c"})
+
+        c["aggregate_by"] = ["undefined"]
+        self.assertRaisesRegex(Exception, "unknown label", config._load_metric_labels, c)
+
+    def test__load_metric_label_mappings(self):
+        c = {"labels": [
+            {"name": "label_1", "value": "$a"},
+            {"name": "label_2", "value": "$b",
+             "map": [{"match": "(?i)zoiper", "value": "zoiper"}],
+             "default": "other"}]}
+        mappings = config._load_metric_label_mappings(c)
+        self.assertEqual(list(mappings), ["label_2"])
+        self.assertEqual(mappings["label_2"].map("Zoiper 5"), "zoiper")
+        self.assertEqual(mappings["label_2"].map("Linphone"), "other")
+
     def test__load_metric_value_counter(self):
         c = {"type": "counter",
              "increment_value": "inc_val"}
@@ -41,6 +78,36 @@ class TestConfig(unittest.TestCase):
         self.assertEqual(result._MetricValueGauge__increment_value, "inc_val")
         self.assertEqual(result._MetricValueGauge__value_on_scrape_start, "5")
 
+    def test__load_metric_value_computed(self):
+        c = {"type": "computed", "expression": "$lost / $expected"}
+        result = config._load_metric_value_computed(c, "computed", "test computed", {"label_1": "value"})
+        self.assertEqual(result._MetricValueComputed__expression.source, "$lost / $expected")
+        self.assertFalse(result._MetricValueComputed__evaluate_on_scrape_end)
+
+        config._load_metric({"name": "computed_reference", "description": "reference",
+                             "labels": [{"name": "label_1", "value": "value"}],
+                             "value": {"type": "gauge", "set_value": "1"}})
+        c = {"type": "computed", "expression": "computed_reference * 2", "evaluate": "scrape_end"}
+        result = config._load_metric_value_computed(c, "computed_scrape_end", "test computed", {"label_1": "value"})
+        self.assertTrue(result._MetricValueComputed__evaluate_on_scrape_end)
+        self.assertEqual(list(result._MetricValueComputed__metric_references), ["computed_reference"])
+
+        self.assertRaisesRegex(
+            Exception, "has different labels", config._load_metric_value_computed,
+            c, "computed_invalid", "test computed", {})
+        c = {"type": "computed", "expression": "undefined_reference * 2"}
+        self.assertRaisesRegex(
+            Exception, "does not exist", config._load_metric_value_computed,
+            c, "computed_invalid", "test computed", {})
+        c = {"type": "computed", "expression": "$lost", "evaluate": "scrape_end"}
+        self.assertRaisesRegex(
+            Exception, "requires at least one referenced metric", config._load_metric_value_computed,
+            c, "computed_invalid", "test computed", {})
+        c = {"type": "computed", "expression": "max($lost)"}
+        self.assertRaisesRegex(
+            Exception, "takes at least 2 arguments", config._load_metric_value_computed,
+            c, "computed_invalid", "test computed", {})
+
     def test__load_metric(self):
         c = {"name": "metric name",
              "description": "metric description",
@@ -66,6 +133,61 @@ class TestConfig(unittest.TestCase):
                 "label_1": "value 1", "label_2": "value 2"})
         self.assertEqual(metric._metric_label_names, ["label_1", "label_2"])
 
+        # A metric defined again feeds the series of the first definition
+        c["labels"].reverse()
+        shared = config._load_metric(c)
+        self.assertIsNot(shared, metric)
+        self.assertIs(config.get_loaded_metrics()["metric_name"], metric)
+        self.assertEqual(shared._metric_label_names, ["label_1", "label_2"])
+        c["labels"].pop()
+        self.assertRaisesRegex(Exception, "already defined with the labels", config._load_metric, c)
+
+        # Values set by events collapsing into the same series after dropping labels require an aggregation
+        c = {"name": "metric_name_aggregate", "description": "metric description",
+             "labels": [{"name": "trunk", "value": "$Trunk"}, {"name": "endpoint", "value": "$EndpointName"}],
+             "drop_labels": ["endpoint"],
+             "value": {"type": "gauge", "set_value": "$FractionLost"}}
+        self.assertRaisesRegex(Exception, "requires an aggregate", config._load_metric, c)
+        c["value"]["aggregate"] = "max"
+        metric = config._load_metric(c)
+        self.assertEqual(metric._metric_label_names, ["trunk"])
+        self.assertEqual(metric._MetricValueGauge__aggregate, MetricValueGauge.aggregations["max"])
+
+    def test__load_metric_tracking(self):
+        c = {"name": "metric_name",
+             "description": "metric description",
+             "value": {"type": "counter", "increment_value": "1",
+                       "track": [{"event": "Event1", "increment_value": "1"}]}}
+        metric = config._load_metric_value_counter(c["value"], "tracking_counter", "test counter", {})
+        self.assertEqual(config._load_metric_tracking(c, metric), [],
+                         "Expected counter metrics to not be tracked")
+
+        c["value"]["type"] = "gauge"
+        metric = config._load_metric_value_gauge(c["value"], "tracking_gauge", "test gauge", {})
+        filter_list = config._load_metric_tracking(c, metric)
+        self.assertEqual(len(filter_list), 1)
+        self.assertEqual(filter_list[0].get_event_names(), ["Event1"])
+
+        c["value"]["track"] = [{"event": "Event1|Event2", "increment_value": "1"},
+                               {"event": "Event3", "set_value": "0"}]
+        filter_list = config._load_metric_tracking(c, metric)
+        self.assertEqual(len(filter_list), 2)
+        self.assertEqual(filter_list[0].get_event_names(), ["Event1", "Event2"])
+        self.assertEqual(filter_list[1].get_event_names(), ["Event3"])
+
+    def test__load_conditions(self):
+        c = {"event": "Event1",
+             "conditions": [{"attribute": "Context", "equals": "from-trunk"},
+                            {"attribute": "Duration", "gt": 10}]}
+        conditions = config._load_conditions(c)
+        self.assertEqual([(condition.attribute, condition.operator, condition.operand) for condition in conditions],
+                         [("Context", "equals", "from-trunk"), ("Duration", "gt", 10)])
+        self.assertIs(config._load_conditions(c)[0], conditions[0],
+                      "Expected equal conditions to be shared")
+
+        event_filter = config._load_event_filter(c)
+        self.assertEqual(len(event_filter._EventFilter__conditions), 2)
+
     def test__load_event_filter(self):
         c = {"event": "event1|event2"}
         event_filter = config._load_event_filter(c)
@@ -77,6 +199,24 @@ class TestConfig(unittest.TestCase):
         event_filter = config._load_event_filter(c)
         self.assertEqual(event_filter._EventFilter__event_names, "event1")
 
+    def test__load_event_sink(self):
+        c = {"event": "Cel|Hangup",
+             "conditions": [{"attribute": "Context", "equals": "from-trunk"}],
+             "output": {"type": "udp", "host": "127.0.0.1", "port": 514},
+             "batch_size": 10}
+        event_filter, sink = config._load_event_sink(c)
+        self.assertEqual(event_filter.get_event_name_set(), frozenset(["Cel", "Hangup"]))
+        self.assertEqual(event_filter.get_metric_values(), [sink])
+        self.assertEqual(len(event_filter._EventFilter__conditions), 1)
+        self.assertIsInstance(sink._EventSink__output, EventSinkOutputUDP)
+        self.assertEqual(sink._EventSink__batch_size, 10)
+        sink._EventSink__output.close()
+
+        with self.assertRaises(Exception):
+            config._load_event_sink({"event": "Cel", "output": {"type": "tcp"}})
+        with self.assertRaises(Exception):
+            config._load_event_sink({"event": "Cel", "output": {"type": "file"}})
+
     def test__load_action(self):
         c = {"name": "ActionName",
              "until": "EventName",
@@ -93,6 +233,52 @@ class TestConfig(unittest.TestCase):
         self.assertEqual(action.action_priority, 5)
         self.assertEqual(action.action_context, "context")
         self.assertEqual(action.action_caller_id, "caller_id")
+        self.assertEqual(action.resync_interval, None)
+        self.assertEqual(action.track_filter_list, [])
+
+        c = {"name": "ActionName",
+             "until": "EventName",
+             "resync_interval": 3600,
+             "collect": [{"event": "Event1", "metrics": [
+                 {"name": "tracked_action_gauge",
+                  "description": "gauge",
+                  "value": {"type": "gauge", "increment_value": "1",
+                            "track": [{"event": "Event2", "increment_value": "1"}]}}]}]}
+        action = config._load_action(c)
+        self.assertEqual(action.resync_interval, 3600)
+        self.assertEqual(len(action.track_filter_list), 1)
+        self.assertEqual(action.track_filter_list[0].get_event_names(), ["Event2"])
+
+        c = {"name": "ActionName",
+             "until": "EventName",
+             "rate_limit": {"rate": 0.5, "burst": 2},
+             "slow_response_time": 1.5,
+             "max_backoff": 4,
+             "batch_size": 0,
+             "collect": [{"event": "Event1"}]}
+        action = config._load_action(c)
+        self.assertEqual(action.rate_limiter.rate, 0.5)
+        self.assertEqual(action.rate_limiter.burst, 2)
+        self.assertEqual(action.slow_response_time, 1.5)
+        self.assertEqual(action.max_backoff, 4)
+        self.assertEqual(action.filter_list[0]._EventFilter__batch_size, 0)
+
+        # A rate or burst of 0 is rejected by the schema and when the rate limit is loaded
+        with open(Path(config.__file__).parent / "config_schema.yml", "r") as stream:
+            rate_limit_schema = yaml.safe_load(stream)["$def"]["rate_limit_template"]
+        for rate_limit in ({"rate": 0}, {"rate": 1, "burst": 0}):
+            self.assertRaises(ValidationError, validate, rate_limit, rate_limit_schema)
+            self.assertRaises(Exception, config._load_rate_limit, rate_limit)
+        validate({"rate": 0.1, "burst": 1}, rate_limit_schema)
+
+        c = {"name": "ActionName",
+             "until": "EventName",
+             "timestamps": True,
+             "collect": [{"event": "Event1", "metrics": [
+                 {"name": "timestamped_action_gauge", "description": "gauge",
+                  "value": {"type": "gauge", "set_value": "1"}}]}]}
+        action = config._load_action(c)
+        self.assertTrue(action.filter_list[0].get_metric_values()[0]._MetricValueGauge__timestamps)
 
         # Test default values
         c = {"name": "ActionName",
@@ -111,6 +297,115 @@ class TestConfig(unittest.TestCase):
         self.assertEqual(
             action.action_caller_id,
             config.default_config.action_caller_id)
+        self.assertEqual(action.rate_limiter, None)
+        self.assertEqual(action.max_backoff, config.default_config.action_max_backoff)
+        self.assertEqual(action.parameters, {})
+        self.assertEqual(action.discovery, None)
+        self.assertEqual(action.max_concurrency, 1)
+
+    def test__load_action_computed_reference(self):
+        # The computed metric reads the gauge of another filter of the same action
+        c = {"name": "QueueStatus",
+             "until": "QueueStatusComplete",
+             "collect": [
+                 {"event": "QueueParams", "metrics": [
+                     {"name": "referenced_queue_calls", "description": "Calls",
+                      "labels": [{"name": "queue", "value": "$Queue"}],
+                      "value": {"type": "gauge", "set_value": "$Calls"}}]},
+                 {"event": "QueueMember", "metrics": [
+                     {"name": "referenced_calls_per_member", "description": "Calls per member",
+                      "labels": [{"name": "queue", "value": "$Queue"}],
+                      "value": {"type": "computed", "expression": "referenced_queue_calls / $Members"}}]}]}
+        action = config._load_action(c)
+        gauge = action.filter_list[0].get_metric_values()[0]
+        computed = action.filter_list[1].get_metric_values()[0]
+        self.assertFalse(gauge.supports_batch_processing)
+
+        events = [EventMock("QueueParams", {"ActionID": "1", "Queue": "q1", "Calls": "6"}),
+                  EventMock("QueueMember", {"ActionID": "1", "Queue": "q1", "Members": "2"})]
+        for event_filter in action.filter_list:
+            event_filter.on_scrape_start("1")
+        for event in events:
+            for event_filter in action.filter_list:
+                event_filter.process_event(event)
+        self.assertEqual(computed.get_value(("q1",)), 3, "Expected the value of the gauge of the same action")
+        for event_filter in action.filter_list:
+            event_filter.on_scrape_end()
+
+    def test__load_action_command(self):
+        c = {"command": "core show calls",
+             "parsers": [{"event": "ActiveCalls", "regex": r"^(?P<Count>\d+) active calls?"},
+                         {"event": "Peer", "columns": ["Name", "Host"], "match": "^[0-9]"}],
+             "collect": [{"event": "ActiveCalls"}]}
+        action = config._load_action(c)
+        self.assertEqual(action.name, "Command")
+        self.assertEqual(action.until, "")
+        self.assertEqual(action.parameters, {"Command": "core show calls"})
+        self.assertEqual([parser.event for parser in action.command_parsers], ["ActiveCalls", "Peer"])
+        self.assertEqual(action.label, "Command core show calls")
+
+        c["label"] = "calls"
+        self.assertEqual(config._load_action(c).label, "calls")
+        self.assertEqual(config._load_action({"name": "QueueStatus", "until": "QueueStatusComplete"}).label,
+                         "QueueStatus")
+
+    def test__load_action_discovery(self):
+        c = {"name": "QueueStatus",
+             "until": "QueueStatusComplete",
+             "event_timeout": 7,
+             "parameters": {"Queue": "$Queue", "Limit": 5},
+             "max_concurrency": 4,
+             "discover": {"name": "QueueSummary", "event": "QueueSummary", "until": "QueueSummaryComplete",
+                          "refresh_interval": 600}}
+        action = config._load_action(c)
+        self.assertEqual(action.parameters, {"Queue": "$Queue", "Limit": "5"})
+        self.assertEqual(action.max_concurrency, 4)
+        self.assertEqual(action.discovery.name, "QueueSummary")
+        self.assertEqual(action.discovery.attributes, ["Queue"])
+        self.assertEqual(action.discovery.refresh_interval, 600)
+        self.assertEqual(action.discovery.event_timeout, 7)
+
+        # The parameters have to reference an attribute of the discovered events
+        c["parameters"] = {"Queue": "support"}
+        with self.assertRaises(Exception):
+            config._load_action(c)
+
+        # Referenced attributes require a discovery
+        del c["discover"]
+        c["parameters"] = {"Queue": "$Queue"}
+        with self.assertRaises(Exception):
+            config._load_action(c)
+
+
+class TestRequiredEventNames(unittest.TestCase):
+    def test_get_required_event_names(self):
+        event_filter = config._load_event_filter({"event": "DialBegin|DialEnd"})
+        action = config._load_action({"name": "QueueStatus", "until": "QueueStatusComplete", "collect": [
+            {"event": "QueueMember", "metrics": [
+                {"name": "test_config_required_event_names", "description": "gauge",
+                 "value": {"type": "gauge", "set_value": "1", "track": [{"event": "QueueMemberStatus"}]}}]}]})
+        action.discovery = Discovery("QueueSummary", "QueueSummary", "QueueSummaryComplete", ["Queue"], 1, 1)
+        command = config._load_action({"command": "core show calls", "collect": [{"event": "ActiveCalls"}],
+                                       "parsers": [{"event": "ActiveCalls", "regex": "(?P<Count>\\d+) active"}]})
+        config.filter_config.filter_list.append(event_filter)
+        config.scrape_config.action_list.append(action)
+        config.scrape_config.action_list.append(command)
+        try:
+            event_names = config.get_required_event_names()
+            self.assertTrue({"DialBegin", "DialEnd", "QueueMember", "QueueStatusComplete",
+                             "QueueMemberStatus", "QueueSummary", "QueueSummaryComplete"} <= event_names)
+            self.assertNotIn("ActiveCalls", event_names, "Expected the rows of commands to not be required")
+            self.assertNotIn("", event_names)
+
+            event_names = config.get_required_event_names(include_actions=False)
+            self.assertTrue({"DialBegin", "DialEnd", "QueueMemberStatus"} <= event_names)
+            self.assertNotIn("QueueMember", event_names)
+            self.assertNotIn("QueueStatusComplete", event_names)
+            self.assertNotIn("QueueSummary", event_names)
+        finally:
+            config.filter_config.filter_list.remove(event_filter)
+            config.scrape_config.action_list.remove(action)
+            config.scrape_config.action_list.remove(command)
 
 
 class TestAMIClientConfig(unittest.TestCase):
@@ -124,6 +419,14 @@ class TestAMIClientConfig(unittest.TestCase):
         self.assertEqual(config.ami_client_config.port, 5)
         self.assertEqual(config.ami_client_config.username, "<username>")
         self.assertEqual(config.ami_client_config.secret, "<secret>")
+        self.assertFalse(config.ami_client_config.separate_action_connection)
+        self.assertFalse(config.ami_client_config.server_side_event_filter)
+
+        c["separate_action_connection"] = True
+        c["server_side_event_filter"] = True
+        config.ami_client_config.load(c)
+        self.assertTrue(config.ami_client_config.separate_action_connection)
+        self.assertTrue(config.ami_client_config.server_side_event_filter)
 
 
 class TestGeneralConfig(unittest.TestCase):
@@ -131,12 +434,86 @@ class TestGeneralConfig(unittest.TestCase):
         c = {"log_level": "<log_level>",
              "login_validation_timeout": 5,
              "response_timeout": 5,
-             "ping_timeout": 5}
+             "ping_timeout": 5,
+             "log_format": "json",
+             "log_rate_limit": 0,
+             "log_rate_limit_interval": 5}
         config.general_config.load(c)
         self.assertEqual(config.general_config.log_level, "<log_level>")
         self.assertEqual(config.general_config.login_validation_timeout, 5)
         self.assertEqual(config.general_config.response_timeout, 5)
         self.assertEqual(config.general_config.ping_timeout, 5)
+        self.assertEqual(config.general_config.log_format, "json")
+        self.assertEqual(config.general_config.log_rate_limit, 0)
+        self.assertEqual(config.general_config.log_rate_limit_interval, 5)
+
+
+class TestHTTPServerConfig(unittest.TestCase):
+    def test_load(self):
+        c = {"max_concurrent_scrapes": 5,
+             "request_timeout": 5,
+             "keep_alive_timeout": 5,
+             "gzip": False,
+             "debug_endpoints": True}
+        config.http_server_config.load(c)
+        self.assertEqual(config.http_server_config.max_concurrent_scrapes, 5)
+        self.assertEqual(config.http_server_config.request_timeout, 5)
+        self.assertEqual(config.http_server_config.keep_alive_timeout, 5)
+        self.assertEqual(config.http_server_config.gzip, False)
+        self.assertEqual(config.http_server_config.debug_endpoints, True)
+
+
+class TestPushConfig(unittest.TestCase):
+    def test_load(self):
+        c = {"mode": "pushgateway",
+             "url": "http://localhost:9091",
+             "job": "<job>",
+             "grouping_key": {"instance": "<instance>"},
+             "flush_interval": 1,
+             "queue_size": 5,
+             "max_retries": 2,
+             "retry_backoff": 0.5,
+             "max_backoff": 4,
+             "timeout": 3}
+        config.push_config.load(c)
+        self.assertEqual(config.push_config.mode, "pushgateway")
+        self.assertEqual(config.push_config.url, "http://localhost:9091")
+        self.assertEqual(config.push_config.job, "<job>")
+        self.assertEqual(config.push_config.grouping_key, {"instance": "<instance>"})
+        self.assertEqual(config.push_config.flush_interval, 1)
+        self.assertEqual(config.push_config.queue_size, 5)
+        self.assertEqual(config.push_config.max_retries, 2)
+        self.assertEqual(config.push_config.retry_backoff, 0.5)
+        self.assertEqual(config.push_config.max_backoff, 4)
+        self.assertEqual(config.push_config.timeout, 3)
+        self.assertTrue(config.push_config.is_enabled())
+
+
+class TestSnapshotConfig(unittest.TestCase):
+    def test_load(self):
+        c = {"path": "snapshot.ndjson",
+             "interval": 5}
+        config.snapshot_config.load(c)
+        self.assertEqual(config.snapshot_config.path, "snapshot.ndjson")
+        self.assertEqual(config.snapshot_config.interval, 5)
+        self.assertTrue(config.snapshot_config.is_enabled())
+
+
+class TestChannelTrackerConfig(unittest.TestCase):
+    def test_load(self):
+        c = {"name": "test_config_channels",
+             "labels": [{"name": "context", "value": "$Context"}],
+             "duration_buckets": [1, 10],
+             "event_timeout": 30}
+        config.channel_tracker_config.load(c)
+        tracker = config.channel_tracker_config.tracker
+        self.assertEqual(tracker._metric_label_names, ["context"])
+        self.assertEqual(config.channel_tracker_config.filter_list[0].get_metric_values(), [tracker])
+        action = config.channel_tracker_config.resync_action
+        self.assertEqual(action.name, "CoreShowChannels")
+        self.assertEqual(action.until, "CoreShowChannelsComplete")
+        self.assertEqual(action.event_timeout, 30)
+        self.assertEqual(action.resync_interval, math.inf)
 
 
 class TestDefaultConfig(unittest.TestCase):
@@ -146,7 +523,10 @@ class TestDefaultConfig(unittest.TestCase):
              "action_event_timeout": 5,
              "action_priority": 5,
              "action_context": "<context>",
-             "action_caller_id": "<caller_id>"}
+             "action_caller_id": "<caller_id>",
+             "action_max_backoff": 5,
+             "action_batch_size": 100,
+             "action_timestamps": True}
         config.default_config.load(c)
         self.assertEqual(config.default_config.scrape_interval, 5)
         self.assertEqual(config.default_config.action_response_timeout, 5)
@@ -154,10 +534,17 @@ class TestDefaultConfig(unittest.TestCase):
         self.assertEqual(config.default_config.action_priority, 5)
         self.assertEqual(config.default_config.action_context, "<context>")
         self.assertEqual(config.default_config.action_caller_id, "<caller_id>")
+        self.assertEqual(config.default_config.action_max_backoff, 5)
+        self.assertEqual(config.default_config.action_batch_size, 100)
+        self.assertTrue(config.default_config.action_timestamps)
+        config.default_config.action_timestamps = False
 
 
 class TestScrapeConfig(unittest.TestCase):
     def test_load(self):
-        c = {"interval": 5}
+        c = {"interval": 5,
+             "rate_limit": {"rate": 2}}
         config.scrape_config.load(c)
         self.assertEqual(config.scrape_config.interval, 5)
+        self.assertEqual(config.scrape_config.rate_limiter.rate, 2)
+        self.assertEqual(config.scrape_config.rate_limiter.burst, 1)
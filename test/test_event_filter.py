@@ -2,6 +2,9 @@ import unittest
 from typing import Dict
 from dataclasses import dataclass
 from event_filter import EventFilter
+from condition import Condition
+from metric_values import MetricValueCounter
+from test.test_metric_values import CounterMock
 
 
 @dataclass
@@ -14,6 +17,7 @@ class MetricValueMock():
     def __init__(self) -> None:
         self.exec_on_scrape_start = False
         self.exec_on_scrape_end = False
+        self.exec_on_scrape_abort = False
         self.last_event_processed = None
 
     def on_scrape_start(self):
@@ -22,10 +26,25 @@ class MetricValueMock():
     def on_scrape_end(self):
         self.exec_on_scrape_end = True
 
+    def on_scrape_abort(self):
+        self.exec_on_scrape_abort = True
+
     def process_event(self, event):
         self.last_event_processed = event
 
 
+class BatchMetricValueMock(MetricValueMock):
+    supports_batch_processing = True
+    stages_values = True
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.processed_batches = []
+
+    def process_events(self, events):
+        self.processed_batches.append(events)
+
+
 class TestEventFilter(unittest.TestCase):
     def setUp(self) -> None:
         self.__mv1 = MetricValueMock()
@@ -36,8 +55,8 @@ class TestEventFilter(unittest.TestCase):
 
     def test_on_scrape_start(self):
         self.__event_filter.on_scrape_start("1")
-        self.assertEqual(self.__event_filter._EventFilter__action_id,
-                         "1",
+        self.assertEqual(self.__event_filter._EventFilter__action_ids,
+                         frozenset(["1"]),
                          "Expected action id to be set in event filter")
         for metric in self.__event_filter._EventFilter__metric_values:
             self.assertTrue(metric.exec_on_scrape_start,
@@ -49,8 +68,16 @@ class TestEventFilter(unittest.TestCase):
             self.assertTrue(metric.exec_on_scrape_end,
                             "Expected on_scrape_start to be executed in metric")
 
+    def test_on_scrape_end_incomplete(self):
+        self.__event_filter.on_scrape_end(False)
+        for metric in self.__event_filter._EventFilter__metric_values:
+            self.assertFalse(metric.exec_on_scrape_end,
+                             "Expected on_scrape_end to not be executed in metric")
+            self.assertTrue(metric.exec_on_scrape_abort,
+                            "Expected on_scrape_abort to be executed in metric")
+
     def test_process_event(self):
-        self.__event_filter._EventFilter__action_id = "1"
+        self.__event_filter._EventFilter__action_ids = frozenset(["1"])
         ev = EventMock("SomeEvent", {"ActionID": "1"})
         self.__event_filter.process_event(ev)
         self.assertEqual(
@@ -86,3 +113,81 @@ class TestEventFilter(unittest.TestCase):
                          "Expected event to be processed by metric 1.")
         self.assertEqual(self.__mv2.last_event_processed, ev,
                          "Expected event to be processed by metric 2.")
+
+    def test_process_event_conditions(self):
+        regex = Condition("Channel", "regex", "PJSIP/tenant1-.*")
+        equals = Condition("Context", "equals", "from-trunk")
+        event_filter = EventFilter(["Event1"], [self.__mv1], [regex, equals])
+        self.assertEqual(event_filter._EventFilter__conditions, [equals, regex],
+                         "Expected cheap conditions to be checked first")
+
+        ev = EventMock("Event1", {"Context": "from-internal", "Channel": "PJSIP/tenant1-00000001"})
+        event_filter.process_event(ev)
+        self.assertEqual(self.__mv1.last_event_processed, None,
+                         "Expected event to not be processed by metric 1.")
+
+        ev = EventMock("Event1", {"Context": "from-trunk", "Channel": "PJSIP/tenant1-00000001"})
+        event_filter.process_event(ev)
+        self.assertEqual(self.__mv1.last_event_processed, ev,
+                         "Expected event to be processed by metric 1.")
+
+    def test_process_event_single_name(self):
+        event_filter = EventFilter("Event1", [self.__mv1])
+        event_filter.process_event(EventMock("Event", {}))
+        self.assertEqual(self.__mv1.last_event_processed, None,
+                         "Expected event name to not be matched as a substring.")
+
+    def test_batch_processing(self):
+        metric = BatchMetricValueMock()
+        event_filter = EventFilter(["Event1"], [metric])
+        event_filter.on_scrape_start("1")
+        events = [EventMock("Event1", {"ActionID": "1"}), EventMock("Event1", {"ActionID": "1"})]
+        for event in events + [EventMock("Event1", {"ActionID": "2"})]:
+            event_filter.process_event(event)
+        self.assertEqual(metric.last_event_processed, None, "Expected events to be collected until the end")
+
+        event_filter.on_scrape_end()
+        self.assertEqual(metric.processed_batches, [events])
+
+        # The events of an incomplete scrape process are discarded
+        event_filter.on_scrape_start("3")
+        event_filter.process_event(EventMock("Event1", {"ActionID": "3"}))
+        event_filter.on_scrape_end(False)
+        self.assertEqual(len(metric.processed_batches), 1)
+        self.assertTrue(metric.exec_on_scrape_abort)
+
+        # Full batches are processed while the action is running, so the memory is bounded by the batch size
+        event_filter = EventFilter(["Event1"], [metric], batch_size=2)
+        metric.processed_batches = []
+        event_filter.on_scrape_start("5")
+        for _ in range(5):
+            event_filter.process_event(EventMock("Event1", {"ActionID": "5"}))
+        self.assertEqual([len(batch) for batch in metric.processed_batches], [2, 2])
+        event_filter.on_scrape_end()
+        self.assertEqual([len(batch) for batch in metric.processed_batches], [2, 2, 1])
+
+        # A batch size of 0 processes every event when it is received
+        event_filter = EventFilter(["Event1"], [metric], batch_size=0)
+        event_filter.on_scrape_start("6")
+        event = EventMock("Event1", {"ActionID": "6"})
+        event_filter.process_event(event)
+        self.assertIs(metric.last_event_processed, event)
+
+        # A filter is only batched if every metric supports it
+        event_filter = EventFilter(["Event1"], [BatchMetricValueMock(), self.__mv1])
+        event_filter.on_scrape_start("4")
+        event_filter.process_event(EventMock("Event1", {"ActionID": "4"}))
+        self.assertNotEqual(self.__mv1.last_event_processed, None)
+
+    def test_batch_processing_incomplete(self):
+        # Counters are not staged, so an incomplete action counts every received event with and without batches
+        for batch_size in (1000, 0):
+            counter = MetricValueCounter("test_event_filter_counter", "Counter", {}, "1")
+            counter._MetricValueCounter__counter = CounterMock([])
+            event_filter = EventFilter(["Event1"], [counter], batch_size=batch_size)
+            event_filter.on_scrape_start("1")
+            for _ in range(1500):
+                event_filter.process_event(EventMock("Event1", {"ActionID": "1"}))
+            event_filter.on_scrape_end(False)
+            self.assertEqual(counter.get_value(()), 1500,
+                             f"Expected every event to be counted with batch_size={batch_size}")
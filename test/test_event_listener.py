@@ -1,6 +1,6 @@
 import unittest
 from dataclasses import dataclass
-from typing import Dict, List
+from typing import Dict, FrozenSet, List
 from event_listener import EventListener
 from time import time
 
@@ -13,7 +13,10 @@ class EventFilterMock():
         self.last_event_processed = event
 
     def get_event_names(self) -> List[str]:
-        return []
+        return ["Event"]
+
+    def get_event_name_set(self) -> FrozenSet[str]:
+        return frozenset(self.get_event_names())
 
 
 @dataclass
@@ -28,11 +31,11 @@ class TestEventListener(unittest.TestCase):
         self.__ef2 = EventFilterMock()
 
         self.__event_listener = EventListener()
-        self.__event_listener._EventListener__event_filter = [
-            self.__ef1, self.__ef2]
+        self.__event_listener.add_event_filter(self.__ef1)
+        self.__event_listener.add_event_filter(self.__ef2)
 
     def test_add_event_filter(self):
-        self.__event_listener._EventListener__event_filter.clear()
+        self.__event_listener.reset()
         self.__event_listener.add_event_filter(self.__ef1)
         self.__event_listener.add_event_filter(self.__ef2)
         self.assertEqual(
@@ -43,6 +46,10 @@ class TestEventListener(unittest.TestCase):
             self.__event_listener._EventListener__event_filter[1],
             self.__ef2,
             "Expected filter 2 to be attached to the event listener")
+        self.assertEqual(
+            self.__event_listener._EventListener__event_filter_index["Event"],
+            [self.__ef1, self.__ef2],
+            "Expected both filters to be indexed by their event name")
 
     def test_remove_event_filter(self):
         self.__event_listener.remove_event_filter(self.__ef1)
@@ -53,6 +60,14 @@ class TestEventListener(unittest.TestCase):
             self.__event_listener._EventListener__event_filter[0],
             self.__ef2,
             "Expected filter 2 to still be attached to the event listener")
+        self.assertEqual(
+            self.__event_listener._EventListener__event_filter_index["Event"],
+            [self.__ef2],
+            "Expected only filter 2 to be indexed")
+
+        self.__event_listener.remove_event_filter(self.__ef2)
+        self.assertNotIn("Event", self.__event_listener._EventListener__event_filter_index,
+                         "Expected empty index entries to be deleted")
 
     def test_get_time_of_last_event(self):
         self.__event_listener._EventListener__last_event_received = 55475484
@@ -88,3 +103,9 @@ class TestEventListener(unittest.TestCase):
         self.assertEqual(self.__ef2.last_event_processed,
                          event,
                          "Expected event to be processed by filter 2")
+
+        other_event = EventMock("OtherEvent", {"ActionID": "1"})
+        self.__event_listener.on_event(other_event)
+        self.assertEqual(self.__ef1.last_event_processed,
+                         event,
+                         "Expected event with another name to not be passed to filter 1")
@@ -0,0 +1,127 @@
+import json
+import socket
+import tempfile
+import unittest
+from pathlib import Path
+from time import sleep
+from typing import List
+from asterisk.ami import Event
+from event_sink import EventSink, EventSinkOutput, EventSinkOutputFile, EventSinkOutputUDP, EventSinkOutputTCP
+
+
+class OutputMock(EventSinkOutput):
+    def __init__(self) -> None:
+        self.batches: List[bytes] = []
+        self.closed = False
+
+    def write(self, data: bytes) -> None:
+        self.batches.append(data)
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class TestEventSink(unittest.TestCase):
+    def test_serialize(self):
+        line = EventSink.serialize(1.5, Event("Hangup", {"Channel": "PJSIP/1", "Cause": "16"}))
+        self.assertTrue(line.endswith(b"\n"))
+        self.assertEqual(json.loads(line), {"timestamp": 1.5, "event": "Hangup",
+                                            "attributes": {"Channel": "PJSIP/1", "Cause": "16"}})
+
+    def test_batches(self):
+        output = OutputMock()
+        sink = EventSink(output, batch_size=2, flush_interval=60)
+        for i in range(5):
+            sink.process_event(Event("Hangup", {"Uniqueid": str(i)}))
+        sink.start()
+        sink.stop()
+
+        self.assertEqual([batch.count(b"\n") for batch in output.batches], [2, 2, 1])
+        lines = b"".join(output.batches).splitlines()
+        self.assertEqual([json.loads(line)["attributes"]["Uniqueid"] for line in lines], ["0", "1", "2", "3", "4"])
+        self.assertTrue(output.closed)
+
+    def test_flush_interval(self):
+        output = OutputMock()
+        sink = EventSink(output, batch_size=100, flush_interval=0.01)
+        sink.start()
+        sink.process_event(Event("Hangup", {}))
+        for _ in range(500):
+            if len(output.batches) > 0:
+                break
+            sleep(0.01)
+        self.assertEqual(len(output.batches), 1)
+        sink.stop()
+
+    def test_queue_full(self):
+        output = OutputMock()
+        sink = EventSink(output, queue_size=2)
+        for _ in range(5):
+            sink.process_event(Event("Hangup", {}))
+        self.assertEqual(sink.dropped_events, 3)
+
+
+class TestEventSinkOutputFile(unittest.TestCase):
+    def test_write(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "events.ndjson"
+            output = EventSinkOutputFile(str(path))
+            output.write(b"a\n")
+            output.write(b"b\n")
+            output.close()
+            self.assertEqual(path.read_bytes(), b"a\nb\n")
+
+    def test_rotation(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "events.ndjson"
+            output = EventSinkOutputFile(str(path), max_bytes=4, backup_count=2)
+            for line in (b"a\n", b"b\n", b"c\n", b"d\n", b"e\n", b"f\n", b"g\n"):
+                output.write(line)
+            output.close()
+
+            self.assertEqual(path.read_bytes(), b"g\n")
+            self.assertEqual(Path(f"{path}.1").read_bytes(), b"e\nf\n")
+            self.assertEqual(Path(f"{path}.2").read_bytes(), b"c\nd\n")
+            self.assertFalse(Path(f"{path}.3").exists())
+
+
+class TestEventSinkOutputUDP(unittest.TestCase):
+    def test_write(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as receiver:
+            receiver.bind(("127.0.0.1", 0))
+            receiver.settimeout(5)
+            output = EventSinkOutputUDP("127.0.0.1", receiver.getsockname()[1], max_datagram_size=4)
+            output.write(b"a\nb\nccccc\n")
+            output.close()
+
+            self.assertEqual(receiver.recv(1024), b"a\nb\n")
+            self.assertEqual(receiver.recv(1024), b"ccccc\n")
+
+
+class TestEventSinkOutputTCP(unittest.TestCase):
+    def test_write(self):
+        with socket.create_server(("127.0.0.1", 0)) as server:
+            server.settimeout(5)
+            output = EventSinkOutputTCP("127.0.0.1", server.getsockname()[1])
+            output.write(b"a\n")
+            connection, _ = server.accept()
+            output.write(b"b\n")
+            output.close()
+
+            with connection:
+                connection.settimeout(5)
+                data = b""
+                while chunk := connection.recv(1024):
+                    data += chunk
+            self.assertEqual(data, b"a\nb\n")
+
+    def test_write_unreachable(self):
+        with socket.create_server(("127.0.0.1", 0)) as server:
+            port = server.getsockname()[1]
+        output = EventSinkOutputTCP("127.0.0.1", port)
+        with self.assertRaises(OSError):
+            output.write(b"a\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
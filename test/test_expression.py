@@ -0,0 +1,37 @@
+import unittest
+from expression import Expression
+
+
+class TestExpression(unittest.TestCase):
+    def test_evaluate(self):
+        fields = {"Lost": "5", "Expected": "20", "Invalid": "invalid"}
+        metrics = {"answered": 3, "dialed": 4}
+
+        expression = Expression("$Lost / $Expected * 100")
+        self.assertEqual(expression.evaluate(fields, metrics.get), 25)
+        self.assertEqual(expression.field_names, {"Lost", "Expected"})
+        self.assertEqual(expression.metric_names, set())
+
+        expression = Expression("answered / dialed")
+        self.assertEqual(expression.evaluate({}, metrics.get), 0.75)
+        self.assertEqual(expression.metric_names, {"answered", "dialed"})
+
+        expression = Expression("max(-$Lost, 2) + abs(-1) + min(1, 2, 3) + 7 % 4 + 2 ** 2")
+        self.assertEqual(expression.evaluate(fields, metrics.get), 11)
+
+        self.assertRaises(KeyError, Expression("$Missing").evaluate, fields, metrics.get)
+        self.assertRaises(ValueError, Expression("$Invalid").evaluate, fields, metrics.get)
+        self.assertRaises(ZeroDivisionError, Expression("$Lost / 0").evaluate, fields, metrics.get)
+        self.assertRaises(OverflowError, Expression("10 ** 1000.0").evaluate, fields, metrics.get)
+        self.assertRaisesRegex(ValueError, "not a real number", Expression("(-$Lost) ** 0.5").evaluate,
+                               fields, metrics.get)
+
+    def test_invalid_expression(self):
+        self.assertRaisesRegex(Exception, "Invalid expression", Expression, "$Lost /")
+        self.assertRaisesRegex(Exception, "unsupported syntax", Expression, "'string'")
+        self.assertRaisesRegex(Exception, "unsupported syntax", Expression, "__import__('os')")
+        self.assertRaisesRegex(Exception, "unsupported syntax", Expression, "$Lost if 1 else 2")
+        self.assertRaisesRegex(Exception, "unsupported syntax", Expression, "dialed.real")
+        self.assertRaisesRegex(Exception, r"min\(\) takes at least 2 arguments, but got 1", Expression, "min($A)")
+        self.assertRaisesRegex(Exception, r"max\(\) takes at least 2 arguments, but got 0", Expression, "max()")
+        self.assertRaisesRegex(Exception, r"abs\(\) takes 1 argument, but got 2", Expression, "abs($A, $B)")
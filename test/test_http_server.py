@@ -0,0 +1,146 @@
+import asyncio
+import gzip
+import unittest
+from time import sleep
+from typing import Dict, Tuple
+from prometheus_client import CollectorRegistry, Gauge
+from prometheus_client.core import GaugeMetricFamily
+from http_server import HTTPRequest, HTTPResponse, MetricsServer
+
+
+class SlowCollectorMock():
+    def __init__(self) -> None:
+        self.collect_count = 0
+
+    def collect(self):
+        self.collect_count += 1
+        sleep(0.2)
+        return [GaugeMetricFamily("test_http_server_slow_gauge", "Slow gauge", value=1)]
+
+
+class FailingCollectorMock():
+    def collect(self):
+        raise Exception("Collector failed")
+
+
+async def read_response(reader: asyncio.StreamReader) -> Tuple[str, Dict[str, str], bytes]:
+    status = (await reader.readline()).decode().strip()
+    headers: Dict[str, str] = {}
+    while True:
+        line = (await reader.readline()).decode()
+        if line == "\r\n":
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers["content-length"]))
+    return status, headers, body
+
+
+class TestMetricsServer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.__ready = False
+        self.__registry = CollectorRegistry()
+        gauge = Gauge("test_http_server_gauge", "Test gauge", registry=self.__registry)
+        gauge.set(5)
+
+        self.__server = MetricsServer(0, self.__registry, "127.0.0.1", lambda: self.__ready, request_timeout=0.5)
+        await self.__server.start()
+
+        self.__reader, self.__writer = await asyncio.open_connection("127.0.0.1", self.__server.get_port())
+
+    async def asyncTearDown(self) -> None:
+        self.__writer.close()
+        await self.__server.stop()
+
+    async def __request(self, path: str, headers: str = "") -> Tuple[str, Dict[str, str], bytes]:
+        self.__writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n{headers}\r\n".encode())
+        await self.__writer.drain()
+        return await read_response(self.__reader)
+
+    async def test_metrics(self):
+        status, headers, body = await self.__request("/metrics")
+        self.assertEqual(status, "HTTP/1.1 200 OK")
+        self.assertIn(b"test_http_server_gauge 5.0", body)
+        self.assertEqual(headers["connection"], "keep-alive")
+
+        # The connection is kept alive for further requests
+        status, headers, body = await self.__request("/", "Accept-Encoding: gzip\r\n")
+        self.assertEqual(status, "HTTP/1.1 200 OK")
+        self.assertEqual(headers["content-encoding"], "gzip")
+        self.assertIn(b"test_http_server_gauge 5.0", gzip.decompress(body))
+
+        status, headers, body = await self.__request("/metrics", "Connection: close\r\n")
+        self.assertEqual(headers["connection"], "close")
+        self.assertEqual(await self.__reader.read(), b"", "Expected connection to be closed")
+
+    async def test_healthz_and_ready(self):
+        status, _, _ = await self.__request("/healthz")
+        self.assertEqual(status, "HTTP/1.1 200 OK")
+
+        status, _, _ = await self.__request("/ready")
+        self.assertEqual(status, "HTTP/1.1 503 Service Unavailable")
+
+        self.__ready = True
+        status, _, _ = await self.__request("/ready")
+        self.assertEqual(status, "HTTP/1.1 200 OK")
+
+    async def test_add_route(self):
+        async def handle_async(request: HTTPRequest) -> HTTPResponse:
+            await asyncio.sleep(0)
+            return HTTPResponse("200 OK", request.params["value"][0].encode())
+
+        self.__server.add_route("/sync", lambda request: HTTPResponse("200 OK", b"sync"))
+        self.__server.add_route("/async", handle_async)
+        _, _, body = await self.__request("/sync")
+        self.assertEqual(body, b"sync")
+        _, _, body = await self.__request("/async?value=async")
+        self.assertEqual(body, b"async", "Expected coroutine handlers to be awaited")
+
+    async def test_internal_server_error(self):
+        def handle_failing(request: HTTPRequest) -> HTTPResponse:
+            raise Exception("Handler failed")
+
+        self.__server.add_route("/failing", handle_failing)
+        status, _, body = await self.__request("/failing")
+        self.assertEqual(status, "HTTP/1.1 500 Internal Server Error")
+        self.assertEqual(body, b"Internal Server Error\n")
+
+        # A failing collector does not drop the connection either
+        self.__registry.register(FailingCollectorMock())
+        status, headers, _ = await self.__request("/metrics")
+        self.assertEqual(status, "HTTP/1.1 500 Internal Server Error")
+        self.assertEqual(headers["connection"], "keep-alive")
+
+    async def test_method_not_allowed(self):
+        self.__writer.write(b"POST /metrics HTTP/1.1\r\nContent-Length: 4\r\n\r\ntest")
+        await self.__writer.drain()
+        status, _, _ = await read_response(self.__reader)
+        self.assertEqual(status, "HTTP/1.1 405 Method Not Allowed")
+
+    async def test_request_timeout(self):
+        self.__writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n")
+        await self.__writer.drain()
+        self.assertEqual(await asyncio.wait_for(self.__reader.read(), 2), b"",
+                         "Expected connection to be closed after the request timeout")
+
+    async def test_concurrent_scrapes(self):
+        registry = CollectorRegistry()
+        collector = SlowCollectorMock()
+        registry.register(collector)
+        server = MetricsServer(0, registry, "127.0.0.1")
+        await server.start()
+
+        async def scrape() -> bytes:
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.get_port())
+            writer.write(b"GET /metrics HTTP/1.1\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+            _, _, body = await read_response(reader)
+            writer.close()
+            return body
+
+        bodies = await asyncio.gather(scrape(), scrape(), scrape())
+        await server.stop()
+
+        self.assertEqual(collector.collect_count, 1, "Expected concurrent scrapes to share the rendering")
+        for body in bodies:
+            self.assertIn(b"test_http_server_slow_gauge 1.0", body)
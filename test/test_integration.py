@@ -0,0 +1,148 @@
+import unittest
+from time import monotonic, sleep
+from typing import Callable
+from action import Action, ActionExecuter
+from client_wrapper import ClientWrapper
+from command import CommandParser
+from event_filter import EventFilter
+from metric_values import MetricValueCounter, MetricValueGauge
+from test.fake_ami import FakeAMIServer, ScriptedAction
+
+
+def queue_members(count: int, complete: bool = True):
+    events = [{"Event": "QueueMember", "Queue": f"queue{i % 2}", "Name": f"PJSIP/{i}", "Status": "1"}
+              for i in range(count)]
+    if complete:
+        events.append({"Event": "QueueStatusComplete", "EventList": "Complete", "ListItems": str(count)})
+    return events
+
+
+def wait_until(condition: Callable[[], bool], timeout: float = 5) -> bool:
+    end = monotonic() + timeout
+    while not condition():
+        if monotonic() > end:
+            return False
+        sleep(0.01)
+    return True
+
+
+class TestIntegration(unittest.TestCase):
+    """Exercises the ClientWrapper and the ActionExecuter via a real socket to the fake AMI server."""
+
+    def setUp(self) -> None:
+        self.server = FakeAMIServer(seed=1)
+        self.server.start()
+        self.clients = []
+        self.client = self.new_client()
+
+    def tearDown(self) -> None:
+        # The event threads of the clients end once the server closes the connections
+        self.server.stop()
+        for client in self.clients:
+            client.disconnect()
+
+    def new_client(self, ping_timeout: int = 60, **kwargs) -> ClientWrapper:
+        client = ClientWrapper("127.0.0.1", self.server.port, 1, ping_timeout, **kwargs)
+        client.login(self.server.username, self.server.secret, 5, 5)
+        self.clients.append(client)
+        return client
+
+    def new_action(self, name: str) -> Action:
+        gauge = MetricValueGauge(name, "Members by queue", {"queue": "$Queue"}, None, "1", 0)
+        gauge.init()
+        return Action("QueueStatus", [EventFilter(["QueueMember"], [gauge])], "QueueStatusComplete", 1, 1, 1,
+                      "default", "python")
+
+    def test_login(self):
+        self.assertTrue(self.client.is_ready())
+        self.assertIsNone(self.client._ClientWrapper__client._socket.gettimeout(),
+                          "Expected the socket to have no timeout, so it is not closed without events")
+        self.assertEqual(self.server.get_actions("Login")[0]["Username"], self.server.username)
+
+        # The connection is validated by a Ping if no events are received
+        client = self.new_client(ping_timeout=-1)
+        self.assertTrue(client.check_ami_connection_health())
+        self.assertEqual(len(self.server.get_actions("Ping")), 1)
+        client.logoff()
+        self.assertTrue(self.server.wait_for_connections(1), "Expected the logoff to close the connection")
+
+    def test_exec(self):
+        self.server.script("QueueStatus", ScriptedAction(events=queue_members(5)))
+        action = self.new_action("test_integration_exec")
+        executer = ActionExecuter(self.client)
+        self.assertTrue(executer.exec(action))
+        gauge = action.filter_list[0].get_metric_values()[0]
+        self.assertEqual(gauge.get_value(("queue0",)), 3)
+        self.assertEqual(gauge.get_value(("queue1",)), 2)
+        self.assertEqual(self.server.get_actions("QueueStatus")[0]["CallerID"], "python")
+
+    def test_exec_partial_frames(self):
+        self.server.chunk_size = 7
+        self.server.script("QueueStatus", ScriptedAction(events=queue_members(20)))
+        action = self.new_action("test_integration_partial_frames")
+        self.assertTrue(ActionExecuter(self.client).exec(action))
+        self.assertEqual(action.filter_list[0].get_metric_values()[0].get_value(("queue0",)), 10)
+
+    def test_exec_timeouts(self):
+        action = self.new_action("test_integration_timeouts")
+        action.response_timeout = 0.2
+        action.event_timeout = 0.2
+        gauge = action.filter_list[0].get_metric_values()[0]
+        executer = ActionExecuter(self.client)
+
+        self.server.script("QueueStatus", ScriptedAction(response=None))
+        self.assertFalse(executer.exec(action), "Expected the response timeout to be reached")
+        self.assertGreaterEqual(executer.get_last_response_time(), 0.2)
+
+        self.server.script("QueueStatus", ScriptedAction(events=queue_members(4, complete=False)))
+        self.assertFalse(executer.exec(action), "Expected the event timeout to be reached")
+        self.assertEqual(gauge.get_value(("queue0",)), 0, "Expected the values of the execution to be discarded")
+
+    def test_exec_latency(self):
+        self.server.latency = 0.1
+        self.server.jitter = 0.05
+        self.server.script("QueueStatus", ScriptedAction(events=queue_members(2)))
+        executer = ActionExecuter(self.client)
+        self.assertTrue(executer.exec(self.new_action("test_integration_latency")))
+        self.assertGreaterEqual(executer.get_last_response_time(), 0.05)
+
+    def test_exec_command(self):
+        self.server.script("Command", ScriptedAction(
+            {"Response": "Success", "Message": "Command output follows", "Output": "3 active calls\n1 call processed"}))
+        gauge = MetricValueGauge("test_integration_command", "Active calls", {}, "$Count", None, None)
+        gauge.init()
+        action = Action("Command", [EventFilter(["ActiveCalls"], [gauge])], "", 1, 1, 1, "default", "python",
+                        parameters={"Command": "core show calls"},
+                        command_parsers=[CommandParser("ActiveCalls", r"^(?P<Count>\d+) active calls?")])
+        self.assertTrue(ActionExecuter(self.client).exec(action))
+        self.assertEqual(gauge.get_value(()), 3)
+        self.assertEqual(self.server.get_actions("Command")[0]["Command"], "core show calls")
+
+    def test_event_flood(self):
+        client = self.new_client(event_names=["Newchannel"])
+        self.assertEqual(self.server.get_actions("Filter")[-1]["Filter"], "Event: Newchannel")
+        counter = MetricValueCounter("test_integration_flood", "Channels", {}, "1")
+        counter.init()
+        client.add_event_filter([EventFilter(["Newchannel"], [counter])])
+
+        events = ({"Event": "Newchannel" if i % 2 == 0 else "VarSet", "Uniqueid": str(i)} for i in range(20000))
+        self.assertEqual(self.server.flood(events), 20000)
+        self.assertTrue(wait_until(lambda: counter.get_value(()) >= 10000))
+        self.assertEqual(counter.get_value(()), 10000, "Expected the server side filter to drop the other events")
+
+    def test_disconnect(self):
+        self.server.script("QueueStatus", ScriptedAction(truncate=10))
+        action = self.new_action("test_integration_disconnect")
+        action.response_timeout = 0.2
+        self.assertFalse(ActionExecuter(self.client).exec(action), "Expected a partial response to fail")
+        self.assertTrue(wait_until(lambda: not self.client.check_event_thread_health()),
+                        "Expected the event thread to end when the connection is closed")
+
+        # A new session logs in while the server is running
+        self.client = self.new_client()
+        self.server.disconnect_clients()
+        self.assertTrue(wait_until(lambda: not self.client.check_event_thread_health()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import io
+import json
+import logging
+import queue
+import sys
+import unittest
+from log_handler import DeferredQueueHandler, DeferredQueueListener, JSONFormatter, RateLimitFilter
+
+
+def create_record(level: int = logging.ERROR, lineno: int = 1, msg: str = "Message %s", args=("1",)):
+    return logging.LogRecord("test", level, "test.py", lineno, msg, args, None)
+
+
+class TestRateLimitFilter(unittest.TestCase):
+    def test_filter(self):
+        rate_limit_filter = RateLimitFilter(2, 60)
+        results = [rate_limit_filter.filter(create_record()) for _ in range(4)]
+        self.assertEqual(results, [True, True, False, False])
+        self.assertTrue(rate_limit_filter.filter(create_record(lineno=2)), "Expected call sites to be limited apart")
+        self.assertTrue(rate_limit_filter.filter(create_record(logging.DEBUG)),
+                        "Expected records below the level to not be limited")
+
+    def test_suppressed_count(self):
+        rate_limit_filter = RateLimitFilter(1, 0)
+        self.assertTrue(rate_limit_filter.filter(create_record()))
+
+        # Every record starts a new interval, so suppress the records by a long interval first
+        rate_limit_filter._RateLimitFilter__interval = 60
+        self.assertFalse(rate_limit_filter.filter(create_record()))
+        self.assertFalse(rate_limit_filter.filter(create_record()))
+        rate_limit_filter._RateLimitFilter__interval = 0
+
+        record = create_record()
+        self.assertTrue(rate_limit_filter.filter(record))
+        self.assertEqual(record.getMessage(), "Message 1 (suppressed 2 similar messages)")
+
+    def test_disabled(self):
+        rate_limit_filter = RateLimitFilter(0)
+        self.assertTrue(all(rate_limit_filter.filter(create_record()) for _ in range(100)))
+
+
+class TestJSONFormatter(unittest.TestCase):
+    def test_format(self):
+        try:
+            raise ValueError("invalid")
+        except ValueError:
+            record = logging.LogRecord("test", logging.ERROR, "test.py", 1, "Message %s", ("1",), sys.exc_info())
+
+        data = json.loads(JSONFormatter().format(record))
+        self.assertEqual(data["level"], "ERROR")
+        self.assertEqual(data["message"], "Message 1")
+        self.assertIn("ValueError: invalid", data["exception"])
+
+
+class TestDeferredQueueHandler(unittest.TestCase):
+    def test_handle(self):
+        stream = io.StringIO()
+        stream_handler = logging.StreamHandler(stream)
+        stream_handler.setFormatter(logging.Formatter("%(levelname)s:%(message)s"))
+        log_queue: queue.Queue = queue.Queue(1)
+        handler = DeferredQueueHandler(log_queue)
+
+        record = create_record()
+        handler.handle(record)
+        self.assertIs(log_queue.get_nowait(), record, "Expected the record to be queued without formatting")
+        self.assertIsNone(record.exc_text)
+
+        handler.handle(create_record(msg="First", args=None))
+        handler.handle(create_record(msg="Dropped", args=None))
+        listener = DeferredQueueListener(log_queue, stream_handler)
+        listener.start()
+        listener.stop()
+        self.assertEqual(stream.getvalue(), "ERROR:First\n", "Expected records to be dropped if the queue is full")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,11 @@
 import unittest
 from dataclasses import dataclass
 from typing import Dict, Any, Sequence, List
-from metric_values import MetricValueCounter, MetricValueGauge
-from prometheus_client import Gauge
+from metric_values import MetricValueCounter, MetricValueGauge, MetricValueGaugeTracker, MetricValueComputed, \
+    LabelMapping, GaugeCollector, MetricRegistry
+from expression import Expression
+from prometheus_client import REGISTRY
+from time import time
 
 
 @dataclass
@@ -20,8 +23,11 @@ class CounterMock():
     def inc(self, val):
         self.last_inc = val
 
-    def labels(self, **labelkwargs: Any):
-        label_values = tuple(str(labelkwargs[label]) for label in self.__label_names)
+    def labels(self, *labelvalues: Any, **labelkwargs: Any):
+        if labelvalues:
+            label_values = tuple(str(value) for value in labelvalues)
+        else:
+            label_values = tuple(str(labelkwargs[label]) for label in self.__label_names)
 
         if label_values in self.child_counters:
             return self.child_counters[label_values]
@@ -44,8 +50,11 @@ class GaugeMock():
     def inc(self, val):
         self.last_inc = val
 
-    def labels(self, **labelkwargs: Any):
-        label_values = tuple(str(labelkwargs[label]) for label in self.__label_names)
+    def labels(self, *labelvalues: Any, **labelkwargs: Any):
+        if labelvalues:
+            label_values = tuple(str(value) for value in labelvalues)
+        else:
+            label_values = tuple(str(labelkwargs[label]) for label in self.__label_names)
 
         if label_values in self.child_gauges:
             return self.child_gauges[label_values]
@@ -55,6 +64,62 @@ class GaugeMock():
         return child
 
 
+class TestLabelMapping(unittest.TestCase):
+    def test_map(self):
+        mapping = LabelMapping([("(?i)zoiper", "zoiper"), (r"PJSIP/(\w+)-", "\\1")], None)
+        self.assertEqual(mapping.map("Zoiper rv2.10"), "zoiper")
+        self.assertEqual(mapping.map("PJSIP/trunk1-00000001"), "trunk1")
+        self.assertEqual(mapping.map("Yealink SIP-T46S"), "Yealink SIP-T46S",
+                         "Expected value to be kept if no rule matches")
+        self.assertEqual(mapping._LabelMapping__cache["Zoiper rv2.10"], "zoiper",
+                         "Expected mapped value to be cached")
+
+        mapping = LabelMapping([("(?i)zoiper", "zoiper")], "other")
+        self.assertEqual(mapping.map("Yealink SIP-T46S"), "other", "Expected default value to be used")
+
+        mapping.max_cache_size = 1
+        mapping.map("Zoiper")
+        mapping.map("Other")
+        self.assertEqual(len(mapping._LabelMapping__cache), 1, "Expected cache to be bounded")
+
+
+class TestMetricValue(unittest.TestCase):
+    def test_convert_number(self):
+        metric_value = MetricValueGauge("test_convert_number", "metric_description", {}, "$value", None, None)
+        self.assertEqual(metric_value._convert_number("3"), 3.0)
+        self.assertEqual(metric_value._convert_number("2048"), 2048.0)
+        self.assertEqual(metric_value._convert_number("1.5"), 1.5)
+
+        for _ in range(3):
+            self.assertEqual(metric_value._convert_number("invalid"), 0)
+        self.assertEqual(REGISTRY.get_sample_value(
+            "metric_value_conversion_errors_total", {"metric": "test_convert_number"}), 3)
+        self.assertEqual(metric_value._MetricValue__conversion_error_count, 2,
+                         "Expected only the first error to be logged within the interval")
+
+        metric_value.conversion_error_log_interval = 0
+        metric_value._convert_number("invalid")
+        self.assertEqual(metric_value._MetricValue__conversion_error_count, 0,
+                         "Expected the suppressed errors to be logged after the interval")
+
+    def test_eval_number(self):
+        metric_value = MetricValueCounter("test_eval_number", "metric_description", {}, "invalid")
+        self.assertEqual(REGISTRY.get_sample_value(
+            "metric_value_conversion_errors_total", {"metric": "test_eval_number"}), 1,
+            "Expected constant value to be converted when the metric is created")
+
+        event = EventMock("SomeEvent", {"value": "7"})
+        for _ in range(3):
+            self.assertEqual(metric_value._eval_number(event, "invalid"), 0)
+        self.assertEqual(REGISTRY.get_sample_value(
+            "metric_value_conversion_errors_total", {"metric": "test_eval_number"}), 1,
+            "Expected constant value to not be converted again")
+
+        self.assertEqual(metric_value._eval_number(event, "$value"), 7)
+        self.assertEqual(metric_value._eval_number(event, "2.5"), 2.5)
+        self.assertEqual(metric_value._eval_number(event, "$missing"), 0)
+
+
 class TestMetricValueCounter(unittest.TestCase):
     def test_process_event(self):
         # Test without labels
@@ -122,6 +187,18 @@ class TestMetricValueCounter(unittest.TestCase):
             0,
             f"Expected child counter with labels {labels} to be incremented by 0")
 
+        self.assertEqual(metric_value.get_value(labels), 3, "Expected counter total to be 3")
+        self.assertEqual(metric_value.get_label_keys(), [labels])
+
+        # Test with label mapping
+        metric_value._MetricValueCounter__increment_value = "1"
+        metric_value.add_label_mapping("label_1", LabelMapping([("label_val", "mapped")], None))
+        metric_value.process_event(event)
+        self.assertEqual(
+            counter.child_counters[("mapped", "label_val_2")].last_inc,
+            1,
+            "Expected child counter with mapped labels to be incremented by 1")
+
         metric_value._MetricValueCounter__counter = None
         self.assertRaisesRegex(
             Exception,
@@ -129,22 +206,39 @@ class TestMetricValueCounter(unittest.TestCase):
             metric_value.process_event,
             event)
 
+    def test_restore_value(self):
+        metric_value = MetricValueCounter(
+            "test_metric_counter", "metric_description", {"label_1": "$key_1"}, "1")
+        counter = CounterMock(["label_1"])
+        metric_value._MetricValueCounter__counter = counter
+
+        metric_value.restore_value(("label_val",), 5)
+        self.assertEqual(counter.child_counters[("label_val",)].last_inc, 5)
+        metric_value.process_event(EventMock("SomeEvent", {"key_1": "label_val"}))
+        self.assertEqual(metric_value.get_value(("label_val",)), 6)
+
+    def test_process_events(self):
+        metric_value = MetricValueCounter(
+            "test_metric_counter", "metric_description", {"label_1": "$key_1"}, "$count")
+        counter = CounterMock(["label_1"])
+        metric_value._MetricValueCounter__counter = counter
+
+        metric_value.process_events([
+            EventMock("SomeEvent", {"key_1": "a", "count": "2"}),
+            EventMock("SomeEvent", {"key_1": "b", "count": "1"}),
+            EventMock("SomeEvent", {"key_1": "a", "count": "3"})])
+        self.assertEqual(counter.child_counters[("a",)].last_inc, 5,
+                         "Expected the increments to be summed up by label values")
+        self.assertEqual(metric_value.get_value(("a",)), 5)
+        self.assertEqual(metric_value.get_value(("b",)), 1)
+
 
 class TestMetricValueGauge(unittest.TestCase):
     def __init__(self, methodName: str = "runTest") -> None:
         super().__init__(methodName)
 
-        self.__updated_gauge: bool = False
         self.__set_on_scrape_start_values: bool = False
 
-    def __update_gauge_mock(self):
-        self.__updated_gauge = True
-
-    def __is_gauge_updated(self) -> bool:
-        temp = self.__updated_gauge
-        self.__updated_gauge = False
-        return temp
-
     def __set_on_scrape_start_mock(self):
         self.__set_on_scrape_start_values = True
 
@@ -153,7 +247,7 @@ class TestMetricValueGauge(unittest.TestCase):
         self.__set_on_scrape_start_values = False
         return temp
 
-    def test_on_scrape_end(self):
+    def test_on_scrape_start(self):
         metric_value = MetricValueGauge(
             "test_metric_gauge", "metric_description", {}, None, "1", None)
         metric_value._MetricValueGauge__set_on_scrape_start_value = self.__set_on_scrape_start_mock
@@ -177,14 +271,58 @@ class TestMetricValueGauge(unittest.TestCase):
             metric_value._MetricValueGauge__scrape_metric,
             "Expected scrape_metric to be updated to true")
 
-    def test_on_scrape_start(self):
+    def test_on_scrape_end(self):
+        event = EventMock("SomeEvent", {"key_1": "label_val_1"})
+        labels = tuple(["label_val_1"])
         metric_value = MetricValueGauge(
-            "test_metric_gauge", "metric_description", {}, None, "1", None)
-        metric_value._MetricValueGauge__update_gauge = self.__update_gauge_mock
+            "test_metric_gauge", "metric_description", {"label_1": "$key_1"}, None, "1", 0)
+        metric_value._MetricValueGauge__gauge = GaugeMock(["label_1"])
+        metric_value._MetricValueGauge__label_values[labels] = 5
+        metric_value._MetricValueGauge__published_label_values[labels] = 5
 
-        self.assertTrue(
-            self.__is_gauge_updated,
-            "Expected gauge to be updated")
+        metric_value.on_scrape_start()
+        metric_value.process_event(event)
+        self.assertEqual(
+            metric_value._MetricValueGauge__get_published_label_values()[labels],
+            5,
+            "Expected previous values to be published until the scrape process ends")
+
+        metric_value.on_scrape_end()
+        self.assertEqual(
+            metric_value._MetricValueGauge__get_published_label_values()[labels],
+            1,
+            "Expected values of the scrape process to be published")
+
+        metric_value._MetricValueGauge__gauge = None
+        self.assertRaisesRegex(
+            Exception,
+            "Metric is not initialized",
+            metric_value.on_scrape_end)
+
+    def test_on_scrape_abort(self):
+        labels = tuple(["label_val_1"])
+        metric_value = MetricValueGauge(
+            "test_metric_gauge", "metric_description", {"label_1": "$key_1"}, None, "1", 0)
+        metric_value._MetricValueGauge__gauge = GaugeMock(["label_1"])
+
+        metric_value.on_scrape_start()
+        for _ in range(3):
+            metric_value.process_event(EventMock("SomeEvent", {"key_1": "label_val_1"}))
+        metric_value.on_scrape_end()
+
+        # A partially collected scrape process is discarded
+        metric_value.on_scrape_start()
+        metric_value.process_event(EventMock("SomeEvent", {"key_1": "label_val_1"}))
+        metric_value.on_scrape_abort()
+        self.assertEqual(
+            metric_value._MetricValueGauge__get_published_label_values()[labels],
+            3,
+            "Expected values of the last complete scrape process to be kept")
+        self.assertEqual(metric_value.get_value(labels), 3, "Expected staged values to be discarded")
+
+        # Tracked events change the published values once, even though both buffers are the same after publishing
+        metric_value.process_tracked_event(EventMock("SomeEvent", {"key_1": "label_val_1"}), None, "1")
+        self.assertEqual(metric_value._MetricValueGauge__get_published_label_values()[labels], 4)
 
     def test_process_event(self):
         event = EventMock("SomeEvent", {"key_1": "2", "key_2": "invalid"})
@@ -192,20 +330,19 @@ class TestMetricValueGauge(unittest.TestCase):
         # Test without labels and increment values
         metric_value = MetricValueGauge(
             "test_metric_gauge", "metric_description", {}, None, "1", None)
-        metric_value._MetricValueGauge__update_gauge = self.__update_gauge_mock
 
         metric_value.process_event(event)
-        self.assertEqual(metric_value._MetricValueGauge__value,
+        self.assertEqual(metric_value.get_value(()),
                          1, "Expected gauge to be increment by 1")
 
         metric_value._MetricValueGauge__increment_value = "$key_1"
         metric_value.process_event(event)
-        self.assertEqual(metric_value._MetricValueGauge__value,
+        self.assertEqual(metric_value.get_value(()),
                          3, "Expected gauge to be increment by 2")
 
         metric_value._MetricValueGauge__increment_value = "invalid_number"
         metric_value.process_event(event)
-        self.assertEqual(metric_value._MetricValueGauge__value,
+        self.assertEqual(metric_value.get_value(()),
                          3, "Expected gauge to be increment by 0")
 
         # Test without labels and set values
@@ -216,20 +353,19 @@ class TestMetricValueGauge(unittest.TestCase):
             "1",
             None,
             None)
-        metric_value._MetricValueGauge__update_gauge = self.__update_gauge_mock
 
         metric_value.process_event(event)
-        self.assertEqual(metric_value._MetricValueGauge__value,
+        self.assertEqual(metric_value.get_value(()),
                          1, "Expected gauge to be set to 1")
 
         metric_value._MetricValueGauge__set_value = "$key_1"
         metric_value.process_event(event)
-        self.assertEqual(metric_value._MetricValueGauge__value,
+        self.assertEqual(metric_value.get_value(()),
                          2, "Expected gauge to be set to 2")
 
         metric_value._MetricValueGauge__set_value = "invalid_number"
         metric_value.process_event(event)
-        self.assertEqual(metric_value._MetricValueGauge__value,
+        self.assertEqual(metric_value.get_value(()),
                          0, "Expected gauge to be set to 0")
 
         # Test with labels and increment values
@@ -240,7 +376,6 @@ class TestMetricValueGauge(unittest.TestCase):
         metric_value = MetricValueGauge(
             "test_metric_gauge_labels", "metric description", {
                 "label_1": "$key_1", "label_2": "$key_2"}, None, "1", None)
-        metric_value._MetricValueGauge__update_gauge = self.__update_gauge_mock
 
         metric_value.process_event(event)
         self.assertEqual(
@@ -266,7 +401,6 @@ class TestMetricValueGauge(unittest.TestCase):
         metric_value = MetricValueGauge(
             "test_metric_gauge_labels_set_value", "metric description", {
                 "label_1": "$key_1", "label_2": "$key_2"}, "1", None, None)
-        metric_value._MetricValueGauge__update_gauge = self.__update_gauge_mock
 
         metric_value.process_event(event)
         self.assertEqual(
@@ -288,14 +422,18 @@ class TestMetricValueGauge(unittest.TestCase):
             0,
             f"Expected value with labels {labels} to be set to 0")
 
-        self.assertTrue(
-            self.__is_gauge_updated(),
-            "Expected gauge to be updated")
+        # Gauges not collected by an action expose their current values
+        self.assertIs(
+            metric_value._MetricValueGauge__get_published_label_values(),
+            metric_value._MetricValueGauge__label_values,
+            "Expected current values to be published")
         metric_value._MetricValueGauge__scrape_metric = True
+        metric_value._MetricValueGauge__set_value = "1"
         metric_value.process_event(event)
-        self.assertFalse(
-            self.__is_gauge_updated(),
-            "Expected gauge to not be updated")
+        self.assertEqual(
+            metric_value._MetricValueGauge__get_published_label_values(),
+            {},
+            "Expected values to not be published before the end of the scrape process")
 
     def test_init(self):
         metric_value = MetricValueGauge(
@@ -309,5 +447,319 @@ class TestMetricValueGauge(unittest.TestCase):
         self.assertTrue(
             isinstance(
                 metric_value._MetricValueGauge__gauge,
-                Gauge),
+                GaugeCollector),
             "Expected gauge to be created")
+        self.assertEqual(
+            REGISTRY.get_sample_value("test__init_metric_gauge"),
+            0,
+            "Expected gauge to be registered")
+
+        metric_value.process_event(EventMock("SomeEvent", {}))
+        self.assertEqual(
+            REGISTRY.get_sample_value("test__init_metric_gauge"),
+            1,
+            "Expected gauge to expose the current value")
+
+    def test_expose_timestamps(self):
+        metric_value = MetricValueGauge("test_expose_timestamps", "metric_description", {}, "$Value", None, None)
+        metric_value.init()
+        metric_value.expose_timestamps()
+        collector = metric_value._MetricValueGauge__gauge
+        self.assertIsNone(list(collector.collect())[0].samples[0].timestamp,
+                          "Expected values not collected by an action to have no timestamp")
+
+        start = time()
+        metric_value.on_scrape_start()
+        metric_value.process_event(EventMock("SomeEvent", {"Value": "2"}))
+        metric_value.on_scrape_end()
+        sample = list(collector.collect())[0].samples[0]
+        self.assertEqual(sample.value, 2)
+        self.assertGreaterEqual(sample.timestamp, start)
+        self.assertLessEqual(sample.timestamp, time())
+
+        # An aborted scrape process keeps the timestamp of the published values
+        metric_value.on_scrape_start()
+        metric_value.on_scrape_abort()
+        self.assertEqual(list(collector.collect())[0].samples[0].timestamp, sample.timestamp)
+
+    def test_restore_value(self):
+        metric_value = MetricValueGauge(
+            "test_metric_gauge", "metric_description", {"label_1": "$key_1"}, None, "1", None)
+        metric_value._MetricValueGauge__gauge = GaugeMock(["label_1"])
+        metric_value.on_scrape_start()
+
+        metric_value.restore_value(("label_val",), 5)
+        self.assertEqual(metric_value.get_value(("label_val",)), 5)
+        self.assertEqual(metric_value._MetricValueGauge__get_published_label_values(), {("label_val",): 5},
+                         "Expected restored value to be published")
+
+    def test_process_events(self):
+        events = [
+            EventMock("SomeEvent", {"key_1": "PJSIP/trunk1-01", "value": "2"}),
+            EventMock("SomeEvent", {"key_1": "PJSIP/trunk2-02", "value": "4"}),
+            EventMock("SomeEvent", {"key_1": "PJSIP/trunk1-03", "value": "3"}),
+            EventMock("SomeEvent", {"value": "1"})]
+        mapping = LabelMapping([(r"PJSIP/(\w+)-", "\\1")], None)
+
+        # Processing the events at once results in the same values as processing them one by one
+        for set_value, increment_value in (("$value", None), (None, "$value"), (None, "1"), (None, None),
+                                           ("$value", "1")):
+            batch = MetricValueGauge("test_metric_gauge", "metric_description", {"label_1": "$key_1"},
+                                     set_value, increment_value, None)
+            batch.add_label_mapping("label_1", mapping)
+            single = MetricValueGauge("test_metric_gauge", "metric_description", {"label_1": "$key_1"},
+                                      set_value, increment_value, None)
+            single.add_label_mapping("label_1", mapping)
+
+            batch.process_events(events)
+            for event in events:
+                single.process_event(event)
+            self.assertEqual(batch._MetricValueGauge__label_values, single._MetricValueGauge__label_values,
+                             f"Expected equal values for set_value={set_value}, increment_value={increment_value}")
+
+        gauge = MetricValueGauge("test_metric_gauge", "metric_description", {}, None, "$value", None)
+        gauge.process_events(events)
+        self.assertEqual(gauge.get_value(()), 10)
+
+    def test_aggregate(self):
+        # Two endpoints of the same trunk collapse into one series after dropping the endpoint label
+        events = [EventMock("RTCPReceived", {"Trunk": "t1", "EndpointName": "e1", "FractionLost": "0.1"}),
+                  EventMock("RTCPReceived", {"Trunk": "t1", "EndpointName": "e2", "FractionLost": "0.3"})]
+        gauge = MetricValueGauge("test_metric_gauge_aggregate", "metric_description", {"trunk": "$Trunk"},
+                                 "$FractionLost", None, None, "avg")
+        gauge.init()
+        for event in events:
+            gauge.process_event(event)
+        self.assertAlmostEqual(gauge.get_value(("t1",)), 0.2)
+        self.assertAlmostEqual(REGISTRY.get_sample_value("test_metric_gauge_aggregate", {"trunk": "t1"}), 0.2)
+
+        # The values are combined per scrape process
+        gauge.on_scrape_start()
+        gauge.process_event(events[1])
+        self.assertAlmostEqual(gauge.get_value(("t1",)), 0.3)
+        gauge.on_scrape_end()
+        self.assertAlmostEqual(REGISTRY.get_sample_value("test_metric_gauge_aggregate", {"trunk": "t1"}), 0.3)
+
+        for aggregate, expected in (("sum", 0.4), ("min", 0.1), ("max", 0.3)):
+            single = MetricValueGauge("test_metric_gauge", "metric_description", {"trunk": "$Trunk"},
+                                      "$FractionLost", None, None, aggregate)
+            for event in events:
+                single.process_event(event)
+            batch = MetricValueGauge("test_metric_gauge", "metric_description", {"trunk": "$Trunk"},
+                                     "$FractionLost", None, None, aggregate)
+            batch.process_events(events)
+            self.assertAlmostEqual(single.get_value(("t1",)), expected, msg=f"Expected the {aggregate}")
+            self.assertAlmostEqual(batch.get_value(("t1",)), expected, msg=f"Expected the {aggregate} of the batch")
+
+        self.assertRaisesRegex(Exception, "Unknown aggregation", MetricValueGauge, "test_metric_gauge",
+                               "metric_description", {}, "1", None, None, "median")
+        self.assertRaisesRegex(Exception, "requires a set_value", MetricValueGauge, "test_metric_gauge",
+                               "metric_description", {}, None, "1", None, "sum")
+
+
+class TestMetricValueGaugeTracker(unittest.TestCase):
+    def test_process_event(self):
+        event = EventMock("SomeEvent", {"key_1": "label_val_1"})
+        labels = tuple(["label_val_1"])
+        gauge = MetricValueGauge(
+            "test_metric_gauge_tracked", "metric description", {
+                "label_1": "$key_1"}, None, "1", 0)
+        gauge._MetricValueGauge__gauge = GaugeMock(["label_1"])
+        gauge._MetricValueGauge__scrape_metric = True
+        gauge._MetricValueGauge__label_values[labels] = 2
+        # Published by the last resync
+        gauge._MetricValueGauge__published_label_values = gauge._MetricValueGauge__label_values
+
+        tracker = MetricValueGaugeTracker(gauge, None, "-1")
+        tracker.process_event(event)
+        self.assertEqual(
+            gauge._MetricValueGauge__label_values[labels],
+            1,
+            f"Expected value with labels {labels} to be decremented by 1")
+        self.assertEqual(
+            gauge._MetricValueGauge__published_label_values[labels],
+            1,
+            "Expected change to be published immediately")
+
+        tracker = MetricValueGaugeTracker(gauge, "5", None)
+        tracker.process_event(event)
+        self.assertEqual(
+            gauge._MetricValueGauge__label_values[labels],
+            5,
+            f"Expected value with labels {labels} to be set to 5")
+        self.assertEqual(
+            gauge._MetricValueGauge__published_label_values[labels],
+            5,
+            "Expected change to be published immediately")
+
+    def test_process_event_during_resync(self):
+        def member(queue: str) -> EventMock:
+            return EventMock("QueueMember", {"Queue": queue})
+
+        gauge = MetricValueGauge("test_metric_gauge_resync", "metric description", {"queue": "$Queue"},
+                                 None, "1", 0)
+        gauge._MetricValueGauge__gauge = GaugeMock(["queue"])
+        tracker = MetricValueGaugeTracker(gauge, None, "1")
+        gauge.on_scrape_start()
+        gauge.process_events([member("q1"), member("q1")])
+        gauge.on_scrape_end()
+
+        # A member is added after the resync started, and is already contained in the list of the resync
+        gauge.on_scrape_start()
+        gauge.process_event(member("q1"))
+        tracker.process_event(member("q1"))
+        self.assertEqual(gauge._MetricValueGauge__published_label_values[("q1",)], 3,
+                         "Expected the change to be published immediately")
+        gauge.process_event(member("q1"))
+        gauge.process_event(member("q1"))
+        gauge.on_scrape_end()
+        self.assertEqual(gauge._MetricValueGauge__published_label_values[("q1",)], 3,
+                         "Expected the change not to be counted twice by the resync")
+
+        # The change is kept if the resync does not complete
+        gauge.on_scrape_start()
+        gauge.process_event(member("q1"))
+        tracker.process_event(member("q1"))
+        gauge.on_scrape_abort()
+        self.assertEqual(gauge._MetricValueGauge__published_label_values[("q1",)], 4)
+        tracker.process_event(member("q1"))
+        self.assertEqual(gauge.get_value(("q1",)), 5, "Expected the change to be applied after the resync")
+
+
+class TestMetricValueComputed(unittest.TestCase):
+    def test_process_event(self):
+        event = EventMock("SomeEvent", {"key_1": "label_val_1", "lost": "5", "expected": "20"})
+        labels = tuple(["label_val_1"])
+        metric_value = MetricValueComputed(
+            "test_metric_computed", "metric description", {"label_1": "$key_1"},
+            Expression("$lost / $expected"), {}, False)
+        gauge = GaugeMock(["label_1"])
+        metric_value._MetricValueComputed__gauge = gauge
+
+        metric_value.process_event(event)
+        self.assertEqual(gauge.child_gauges[labels].last_set, 0.25, "Expected gauge to be set to 0.25")
+        self.assertEqual(metric_value.get_value(labels), 0.25)
+
+        # Values that can not be evaluated are skipped
+        event.keys["expected"] = "0"
+        metric_value.process_event(event)
+        self.assertEqual(metric_value.get_value(labels), 0.25, "Expected value to not be updated")
+        del event.keys["expected"]
+        metric_value.process_event(event)
+        self.assertEqual(metric_value.get_value(labels), 0.25, "Expected value to not be updated")
+
+    def test_on_scrape_end(self):
+        event = EventMock("SomeEvent", {"key_1": "label_val_1"})
+        labels = tuple(["label_val_1"])
+        answered = MetricValueGauge("test_answered", "answered", {"label_1": "$key_1"}, "3", None, None)
+        dialed = MetricValueGauge("test_dialed", "dialed", {"label_1": "$key_1"}, "4", None, None)
+        answered.process_event(event)
+        dialed.process_event(event)
+
+        metric_value = MetricValueComputed(
+            "test_metric_computed_scrape_end", "metric description", {"label_1": "$key_1"},
+            Expression("answered / dialed"), {"answered": answered, "dialed": dialed}, True)
+        gauge = GaugeMock(["label_1"])
+        metric_value._MetricValueComputed__gauge = gauge
+
+        metric_value.process_event(event)
+        self.assertEqual(gauge.child_gauges, {}, "Expected gauge to not be evaluated on events")
+
+        metric_value.on_scrape_end()
+        self.assertEqual(gauge.child_gauges[labels].last_set, 0.75, "Expected gauge to be set to 0.75")
+
+        # Powers that are not real or overflow are skipped instead of aborting the scrape process
+        for source in ("(-dialed) ** 0.5", "dialed ** 1000.0"):
+            metric_value = MetricValueComputed(
+                "test_metric_computed_scrape_end", "metric description", {"label_1": "$key_1"},
+                Expression(source), {"dialed": dialed}, True)
+            gauge = GaugeMock(["label_1"])
+            metric_value._MetricValueComputed__gauge = gauge
+            metric_value.on_scrape_end()
+            self.assertEqual(gauge.child_gauges, {}, f"Expected '{source}' to be skipped")
+
+
+class TestMetricRegistry(unittest.TestCase):
+    def test_register_counter(self):
+        registry = MetricRegistry()
+        params = MetricValueCounter(
+            "test_registry_counter", "counter", {"queue": "$Queue", "type": "params"}, "$Completed")
+        summary = MetricValueCounter(
+            "test_registry_counter", "counter", {"type": "summary", "queue": "$Queue"}, "1")
+        registry.register(params)
+        registry.register(summary)
+        self.assertEqual(registry.get_metrics(), {"test_registry_counter": params})
+        self.assertEqual(summary._metric_label_names, ["queue", "type"], "Expected the order of the first definition")
+
+        params.process_event(EventMock("QueueParams", {"Queue": "q1", "Completed": "5"}))
+        summary.process_events([EventMock("QueueSummary", {"Queue": "q1"})] * 2)
+        self.assertEqual(REGISTRY.get_sample_value(
+            "test_registry_counter_total", {"queue": "q1", "type": "params"}), 5)
+        self.assertEqual(REGISTRY.get_sample_value(
+            "test_registry_counter_total", {"queue": "q1", "type": "summary"}), 2)
+        self.assertEqual(params.get_value(("q1", "summary")), 2)
+        self.assertEqual(summary.get_label_keys(), [("q1", "params"), ("q1", "summary")])
+
+    def test_register_incompatible(self):
+        registry = MetricRegistry()
+        registry.register(MetricValueCounter("test_registry_incompatible", "counter", {"queue": "$Queue"}, "1"))
+        self.assertRaisesRegex(
+            Exception, "already defined with the labels", registry.register,
+            MetricValueCounter("test_registry_incompatible", "counter", {"name": "$Queue"}, "1"))
+        self.assertRaisesRegex(
+            Exception, "different type", registry.register,
+            MetricValueGauge("test_registry_incompatible", "gauge", {"queue": "$Queue"}, "1", None, None))
+
+        registry.register(MetricValueComputed(
+            "test_registry_computed", "computed", {}, Expression("$a"), {}, False))
+        self.assertRaisesRegex(
+            Exception, "can not be shared", registry.register,
+            MetricValueComputed("test_registry_computed", "computed", {}, Expression("$b"), {}, False))
+
+    def test_reference(self):
+        registry = MetricRegistry()
+        params = MetricValueGauge("test_registry_referenced", "gauge", {}, "$Calls", None, None)
+        registry.register(params)
+        self.assertIsNone(registry.reference("test_registry_undefined"))
+        self.assertIs(registry.reference("test_registry_referenced"), params)
+        self.assertFalse(params.supports_batch_processing)
+
+        # Definitions registered after the reference do not batch their events either
+        summary = MetricValueGauge("test_registry_referenced", "gauge", {}, "$Waiting", None, None)
+        registry.register(summary)
+        self.assertFalse(summary.supports_batch_processing)
+        self.assertTrue(MetricValueGauge("test", "gauge", {}, "1", None, None).supports_batch_processing)
+
+    def test_register_gauge(self):
+        registry = MetricRegistry()
+        params = MetricValueGauge(
+            "test_registry_gauge", "gauge", {"queue": "$Queue"}, "$Calls", None, 0)
+        summary = MetricValueGauge(
+            "test_registry_gauge", "gauge", {"queue": "$Queue"}, "$Waiting", None, 0)
+        registry.register(params)
+        registry.register(summary)
+
+        params.on_scrape_start()
+        params.process_event(EventMock("QueueParams", {"Queue": "q1", "Calls": "3"}))
+        params.on_scrape_end()
+        summary.on_scrape_start()
+        summary.process_events([EventMock("QueueSummary", {"Queue": "q2", "Waiting": "4"})])
+        summary.on_scrape_end()
+        self.assertEqual(REGISTRY.get_sample_value("test_registry_gauge", {"queue": "q1"}), 3)
+        self.assertEqual(REGISTRY.get_sample_value("test_registry_gauge", {"queue": "q2"}), 4)
+
+        # The value on scrape start only resets the values collected by the same definition
+        summary.on_scrape_start()
+        summary.on_scrape_end()
+        self.assertEqual(REGISTRY.get_sample_value("test_registry_gauge", {"queue": "q1"}), 3)
+        self.assertEqual(REGISTRY.get_sample_value("test_registry_gauge", {"queue": "q2"}), 0)
+
+        # Both definitions can be collected by the same action
+        params.on_scrape_start()
+        summary.on_scrape_start()
+        params.process_event(EventMock("QueueParams", {"Queue": "q2", "Calls": "1"}))
+        self.assertEqual(REGISTRY.get_sample_value("test_registry_gauge", {"queue": "q2"}), 0,
+                         "Expected values to be published at the end of the scrape process")
+        summary.on_scrape_abort()
+        self.assertEqual(params.get_value(("q1",)), 3)
+        self.assertEqual(summary.get_value(("q2",)), 0)
@@ -0,0 +1,124 @@
+import asyncio
+import threading
+import unittest
+from collections import Counter
+from asterisk.ami import Event
+from event_filter import EventFilter
+from http_server import HTTPRequest
+from profiling import CPUAccounting, DebugEndpoints, MemoryTracer, format_top_functions, sample_stacks
+
+
+class MetricMock():
+    def __init__(self) -> None:
+        self._metric_name = "metric_mock"
+        self.events = []
+
+    def process_event(self, event):
+        self.events.append(event)
+
+
+def busy_loop(stopped: threading.Event) -> None:
+    while not stopped.is_set():
+        sum(range(100))
+
+
+class TestProfiling(unittest.TestCase):
+    def test_sample_stacks(self):
+        stopped = threading.Event()
+        thread = threading.Thread(target=busy_loop, args=(stopped,), name="busy")
+        thread.start()
+        stacks = sample_stacks(0.1, 0.005)
+        stopped.set()
+        thread.join()
+
+        busy_stacks = [stack for stack in stacks if stack.startswith("busy;")]
+        self.assertGreater(len(busy_stacks), 0, "Expected the busy thread to be sampled")
+        self.assertTrue(all("busy_loop (test_profiling.py:" in stack for stack in busy_stacks))
+        self.assertFalse(any("sample_stacks" in stack for stack in stacks), "Expected own thread to be skipped")
+
+    def test_format_top_functions(self):
+        stacks = Counter({"main;a (x.py:1);b (x.py:5)": 3, "main;a (x.py:1)": 1})
+        lines = format_top_functions(stacks).splitlines()
+        self.assertEqual(lines[1].split(), ["75.0%", "75.0%", "b", "(x.py:5)"])
+        self.assertEqual(lines[2].split(), ["25.0%", "100.0%", "a", "(x.py:1)"])
+
+    def test_cpu_accounting(self):
+        metric = MetricMock()
+        filter = EventFilter(["Hangup"], [metric])
+        accounting = CPUAccounting([filter, EventFilter(["Newchannel"], [metric])])
+
+        filter.process_event(Event("Hangup", {}))
+        self.assertEqual(accounting.get_cpu_seconds(), {})
+
+        accounting.enable()
+        filter.process_event(Event("Hangup", {}))
+        filter.process_event(Event("Hangup", {}))
+        cpu_seconds = accounting.get_cpu_seconds()
+        self.assertEqual(cpu_seconds[("filter", "Hangup")][1], 2)
+        self.assertEqual(cpu_seconds[("metric", "metric_mock")][1], 2)
+        self.assertEqual(len(metric.events), 3, "Expected the events to be processed while measuring")
+
+        accounting.disable()
+        self.assertNotIn("process_event", vars(filter), "Expected the original method to be restored")
+        self.assertNotIn("process_event", vars(metric), "Expected the original method to be restored")
+        filter.process_event(Event("Hangup", {}))
+        self.assertEqual(accounting.get_cpu_seconds()[("filter", "Hangup")][1], 2)
+
+        accounting.reset()
+        self.assertEqual(accounting.get_cpu_seconds(), {})
+
+    def test_memory_tracer(self):
+        tracer = MemoryTracer()
+        self.assertRaises(Exception, tracer.diff)
+        tracer.start()
+        try:
+            allocations = [bytearray(1024) for _ in range(100)]
+            diff = tracer.diff()
+            self.assertTrue(any("test_profiling.py" in str(statistic) for statistic in diff))
+            del allocations
+        finally:
+            tracer.stop()
+        self.assertFalse(tracer.is_tracing())
+
+
+class TestDebugEndpoints(unittest.IsolatedAsyncioTestCase):
+    async def test_profile(self):
+        endpoints = DebugEndpoints([])
+        handle_profile = endpoints._DebugEndpoints__handle_profile
+
+        response = await handle_profile(HTTPRequest("GET", "/debug/profile", "HTTP/1.1", params={"seconds": ["0.05"]}))
+        self.assertEqual(response.status, "200 OK")
+        response = await handle_profile(HTTPRequest(
+            "GET", "/debug/profile", "HTTP/1.1", params={"seconds": ["0.05"], "format": ["top"]}))
+        self.assertTrue(response.body.startswith(b"    own   cumul"))
+
+        for params in ({"seconds": ["invalid"]}, {"seconds": ["3600"]}, {"format": ["pstats"]}):
+            response = await handle_profile(HTTPRequest("GET", "/debug/profile", "HTTP/1.1", params=params))
+            self.assertEqual(response.status, "400 Bad Request")
+
+        # Only one profile runs at a time
+        first = asyncio.ensure_future(handle_profile(
+            HTTPRequest("GET", "/debug/profile", "HTTP/1.1", params={"seconds": ["0.1"]})))
+        await asyncio.sleep(0.01)
+        response = await handle_profile(HTTPRequest("GET", "/debug/profile", "HTTP/1.1", params={"seconds": ["0.1"]}))
+        self.assertEqual(response.status, "409 Conflict")
+        await first
+
+    async def test_cpu(self):
+        metric = MetricMock()
+        filter = EventFilter(["Hangup"], [metric])
+        handle_cpu = DebugEndpoints([filter])._DebugEndpoints__handle_cpu
+
+        response = handle_cpu(HTTPRequest("GET", "/debug/cpu", "HTTP/1.1"))
+        self.assertIn(b"Started", response.body)
+        filter.process_event(Event("Hangup", {}))
+        response = handle_cpu(HTTPRequest("GET", "/debug/cpu", "HTTP/1.1"))
+        self.assertIn(b"filter  Hangup", response.body)
+        self.assertIn(b"metric  metric_mock", response.body)
+
+        response = handle_cpu(HTTPRequest("GET", "/debug/cpu", "HTTP/1.1", params={"action": ["stop"]}))
+        self.assertNotIn("process_event", vars(filter))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,229 @@
+import struct
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+from typing import Dict, List, Tuple
+from prometheus_client import CollectorRegistry, Counter
+import push
+from push import Pusher, PushError, encode_write_request, snappy_compress, collect_samples
+
+
+def _decode_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if byte < 0x80:
+            return value, offset
+
+
+def _decode_fields(data: bytes) -> List[Tuple[int, bytes]]:
+    """Decodes the length delimited and fixed 64 bit fields of a protobuf message. Varints are returned encoded
+    as 8 byte integer."""
+    fields = []
+    offset = 0
+    while offset < len(data):
+        key, offset = _decode_varint(data, offset)
+        wire_type = key & 0x7
+        if wire_type == 2:
+            length, offset = _decode_varint(data, offset)
+            fields.append((key >> 3, data[offset:offset + length]))
+            offset += length
+        elif wire_type == 1:
+            fields.append((key >> 3, data[offset:offset + 8]))
+            offset += 8
+        else:
+            value, offset = _decode_varint(data, offset)
+            fields.append((key >> 3, struct.pack("<q", value)))
+    return fields
+
+
+def snappy_decompress(data: bytes) -> bytes:
+    """Decompresses snappy data containing only literals, unless python-snappy is installed."""
+    if push.snappy is not None:
+        return push.snappy.decompress(data)
+
+    length, offset = _decode_varint(data, 0)
+    decompressed = bytearray()
+    while offset < len(data):
+        tag = data[offset]
+        offset += 1
+        assert tag & 0x3 == 0, "Only literals are supported"
+        literal_length = tag >> 2
+        if literal_length >= 60:
+            size = literal_length - 59
+            literal_length = int.from_bytes(data[offset:offset + size], "little")
+            offset += size
+        literal_length += 1
+        decompressed += data[offset:offset + literal_length]
+        offset += literal_length
+    assert len(decompressed) == length
+    return bytes(decompressed)
+
+
+def decode_write_request(data: bytes) -> List[Tuple[Dict[str, str], float, int]]:
+    samples = []
+    for _, series in _decode_fields(data):
+        labels = {}
+        for field_number, value in _decode_fields(series):
+            if field_number == 1:
+                label = dict(_decode_fields(value))
+                labels[label[1].decode()] = label[2].decode()
+            else:
+                sample = dict(_decode_fields(value))
+                samples.append((labels, struct.unpack("<d", sample[1])[0], struct.unpack("<q", sample[2])[0]))
+    return samples
+
+
+class Receiver():
+    """Local stand-in for a remote-write endpoint and a Pushgateway. Records the received requests and answers
+    them with the given status codes, followed by 200."""
+
+    def __init__(self, statuses: List[int] = []) -> None:
+        self.requests: List[Tuple[str, str, Dict[str, str], bytes]] = []
+        self.statuses: List[int] = list(statuses)
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def handle_request(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                receiver.requests.append((self.command, self.path, dict(self.headers), body))
+                self.send_response(receiver.statuses.pop(0) if receiver.statuses else 200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            do_POST = handle_request
+            do_PUT = handle_request
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, args=(0.01,), daemon=True).start()
+
+    def url(self, path: str = "") -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}{path}"
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def wait_for(condition, timeout: float = 5) -> None:
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        sleep(0.01)
+    raise AssertionError("Condition not met")
+
+
+class TestEncoding(unittest.TestCase):
+    def test_encode_write_request(self):
+        samples = [({"__name__": "calls_total", "queue": "support"}, 3.5, 1700000000000),
+                   ({"__name__": "members"}, -1, 1700000000001)]
+        self.assertEqual(decode_write_request(encode_write_request(samples)), samples)
+
+    def test_snappy_compress(self):
+        for data in (b"", b"a", b"a" * 59, b"a" * 60, b"a" * 300, bytes(range(256)) * 1000):
+            self.assertEqual(snappy_decompress(snappy_compress(data)), data)
+
+    def test_collect_samples(self):
+        registry = CollectorRegistry()
+        counter = Counter("calls", "Calls", ["queue"], registry=registry)
+        counter.labels("support").inc(2)
+
+        samples = collect_samples(registry, 1000)
+        self.assertIn(({"__name__": "calls_total", "queue": "support"}, 2.0, 1000), samples)
+
+
+class TestPusher(unittest.TestCase):
+    def setUp(self):
+        self.registry = CollectorRegistry()
+        self.counter = Counter("calls", "Calls", registry=self.registry)
+        self.receiver = Receiver()
+
+    def tearDown(self):
+        self.receiver.close()
+
+    def test_remote_write(self):
+        self.counter.inc(3)
+        pusher = Pusher("remote_write", self.receiver.url("/api/v1/write"), self.registry, flush_interval=0.05)
+        pusher.start()
+        wait_for(lambda: len(self.receiver.requests) >= 2)
+        pusher.stop()
+
+        method, path, headers, body = self.receiver.requests[0]
+        self.assertEqual(method, "POST")
+        self.assertEqual(path, "/api/v1/write")
+        self.assertEqual(headers["Content-Encoding"], "snappy")
+        self.assertEqual(headers["Content-Type"], "application/x-protobuf")
+        samples = decode_write_request(snappy_decompress(body))
+        self.assertIn(({"__name__": "calls_total"}, 3.0), [(labels, value) for labels, value, _ in samples])
+
+    def test_pushgateway(self):
+        self.counter.inc()
+        pusher = Pusher("pushgateway", self.receiver.url(), self.registry, job="asterisk",
+                        grouping_key={"instance": "pbx/1"})
+        pusher.flush()
+        pusher.start()
+        wait_for(lambda: len(self.receiver.requests) == 1)
+        pusher.stop()
+
+        method, path, _, body = self.receiver.requests[0]
+        self.assertEqual(method, "PUT")
+        self.assertEqual(path, "/metrics/job/asterisk/instance/pbx%2F1")
+        self.assertIn(b"calls_total 1.0", body)
+
+    def test_retry(self):
+        self.receiver.statuses = [500, 429]
+        pusher = Pusher("remote_write", self.receiver.url(), self.registry, flush_interval=60, retry_backoff=0.01)
+        pusher.flush()
+        pusher.start()
+        wait_for(lambda: len(self.receiver.requests) == 3 and pusher.get_queue_length() == 0)
+        pusher.stop()
+
+    def test_retry_client_error(self):
+        self.receiver.statuses = [400]
+        pusher = Pusher("remote_write", self.receiver.url(), self.registry, flush_interval=60, retry_backoff=0.01)
+        pusher.flush()
+        pusher.start()
+        wait_for(lambda: pusher.get_queue_length() == 0)
+        pusher.stop()
+        self.assertEqual(len(self.receiver.requests), 1)
+
+    def test_max_retries(self):
+        self.receiver.statuses = [500, 500, 500]
+        pusher = Pusher("remote_write", self.receiver.url(), self.registry, flush_interval=60, max_retries=1,
+                        retry_backoff=0.01)
+        pusher.flush()
+        pusher.start()
+        wait_for(lambda: pusher.get_queue_length() == 0)
+        pusher.stop()
+        self.assertEqual(len(self.receiver.requests), 2)
+
+    def test_bounded_queue(self):
+        pusher = Pusher("pushgateway", self.receiver.url(), self.registry, queue_size=2)
+        for _ in range(5):
+            pusher.flush()
+        self.assertEqual(pusher.get_queue_length(), 2)
+        self.assertEqual(pusher.dropped_batches, 3)
+
+    def test_send_unreachable(self):
+        self.receiver.close()
+        pusher = Pusher("remote_write", self.receiver.url(), self.registry, timeout=1)
+        with self.assertRaises(PushError) as context:
+            pusher.send(b"")
+        self.assertTrue(context.exception.retryable)
+        self.receiver = Receiver()
+
+    def test_invalid_mode(self):
+        with self.assertRaises(Exception):
+            Pusher("invalid", self.receiver.url())
+
+
+if __name__ == '__main__':
+    unittest.main()
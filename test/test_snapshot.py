@@ -0,0 +1,111 @@
+import tempfile
+import unittest
+from pathlib import Path
+from metric_values import MetricValueCounter, MetricValueGauge, MetricValueComputed
+from expression import Expression
+from snapshot import MetricSnapshot
+from test.test_metric_values import CounterMock, EventMock, GaugeMock
+
+
+def create_metrics():
+    counter = MetricValueCounter("calls", "Calls", {"queue": "$Queue"}, "1")
+    counter._MetricValueCounter__counter = CounterMock(["queue"])
+    gauge = MetricValueGauge("members", "Members", {}, "$Count", None, None)
+    computed = MetricValueComputed("computed", "Computed", {}, Expression("members * 2"), {"members": gauge}, True)
+    return {"calls": counter, "members": gauge, "computed": computed}
+
+
+class TestMetricSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = str(Path(self.directory.name) / "snapshot.ndjson")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_restore(self):
+        metrics = create_metrics()
+        metrics["calls"].process_event(EventMock("Call", {"Queue": "support"}))
+        metrics["calls"].process_event(EventMock("Call", {"Queue": "support"}))
+        metrics["members"].process_event(EventMock("Members", {"Count": "3"}))
+        MetricSnapshot(self.path, metrics).write()
+
+        restored_metrics = create_metrics()
+        self.assertEqual(MetricSnapshot(self.path, restored_metrics).restore(), 2)
+        self.assertEqual(restored_metrics["calls"].get_value(("support",)), 2)
+        self.assertEqual(restored_metrics["members"].get_value(()), 3)
+        self.assertEqual(restored_metrics["computed"].get_label_keys(), [])
+
+    def test_write_during_action(self):
+        gauge = MetricValueGauge("queue_members", "Members", {"queue": "$Queue"}, None, "1", 0)
+        gauge._MetricValueGauge__gauge = GaugeMock(["queue"])
+        gauge.on_scrape_start()
+        gauge.process_events([EventMock("QueueMember", {"Queue": "support"})] * 3)
+        gauge.on_scrape_end()
+
+        # The next action reset the values and collected one member so far
+        gauge.on_scrape_start()
+        gauge.process_event(EventMock("QueueMember", {"Queue": "support"}))
+        MetricSnapshot(self.path, {"queue_members": gauge}).write()
+
+        restored = MetricValueGauge("queue_members", "Members", {"queue": "$Queue"}, None, "1", 0)
+        self.assertEqual(MetricSnapshot(self.path, {"queue_members": restored}).restore(), 1)
+        self.assertEqual(restored.get_value(("support",)), 3, "Expected the published value to be written")
+
+    def test_restore_missing_file(self):
+        self.assertEqual(MetricSnapshot(self.path, create_metrics()).restore(), 0)
+
+    def test_restore_invalid_lines(self):
+        Path(self.path).write_text(
+            '["calls",{"queue":"support"},2.0]\n'
+            '["calls",{"other":"support"},5.0]\n'
+            '["unknown",{},1.0]\n'
+            '["members",{},3.0]\n'
+            '["calls",{"queue":"sal')
+
+        metrics = create_metrics()
+        self.assertEqual(MetricSnapshot(self.path, metrics).restore(), 2)
+        self.assertEqual(metrics["calls"].get_label_keys(), [("support",)])
+        self.assertEqual(metrics["members"].get_value(()), 3)
+
+    def test_write_incremental(self):
+        metrics = create_metrics()
+        snapshot = MetricSnapshot(self.path, metrics, compact_ratio=100)
+        metrics["calls"].process_event(EventMock("Call", {"Queue": "support"}))
+        metrics["calls"].process_event(EventMock("Call", {"Queue": "sales"}))
+        snapshot.write()
+        self.assertEqual(len(Path(self.path).read_text().splitlines()), 3)
+
+        metrics["calls"].process_event(EventMock("Call", {"Queue": "sales"}))
+        snapshot.write()
+        snapshot.write()
+        lines = Path(self.path).read_text().splitlines()
+        self.assertEqual(len(lines), 4, "Expected only the changed value to be appended")
+        self.assertEqual(lines[-1], '["calls",{"queue":"sales"},2.0]')
+
+    def test_write_compact(self):
+        metrics = create_metrics()
+        snapshot = MetricSnapshot(self.path, metrics, compact_ratio=2)
+        for _ in range(5):
+            metrics["calls"].process_event(EventMock("Call", {"Queue": "support"}))
+            snapshot.write()
+
+        self.assertLessEqual(len(Path(self.path).read_text().splitlines()), 4)
+        restored_metrics = create_metrics()
+        MetricSnapshot(self.path, restored_metrics).restore()
+        self.assertEqual(restored_metrics["calls"].get_value(("support",)), 5)
+
+    def test_stop(self):
+        metrics = create_metrics()
+        snapshot = MetricSnapshot(self.path, metrics, interval=60)
+        snapshot.start()
+        metrics["members"].process_event(EventMock("Members", {"Count": "7"}))
+        snapshot.stop()
+
+        restored_metrics = create_metrics()
+        MetricSnapshot(self.path, restored_metrics).restore()
+        self.assertEqual(restored_metrics["members"].get_value(()), 7)
+
+
+if __name__ == '__main__':
+    unittest.main()